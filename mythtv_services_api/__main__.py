@@ -0,0 +1,455 @@
+# -*- coding: utf-8 -*-
+
+"""Command line client, prints responses as newline delimited JSON."""
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+import argparse
+import errno
+import hashlib
+import itertools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import deque
+from datetime import date, datetime
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from . import send as api, schema
+from .columns import find_list
+
+# pylint: disable=no-name-in-module, import-error
+if sys.version_info[0] == 2:
+    from Queue import Queue
+elif sys.version_info[0] == 3:
+    from queue import Queue
+else:
+    sys.exit('Unable to import Queue')
+# pylint: enable=no-name-in-module, import-error
+
+USAGE_EXAMPLES = '''
+examples:
+  python -m mythtv_services_api --host someName Myth/GetHostName
+  python -m mythtv_services_api --host someName --page 200 \\
+      --fields Title,StartTime,Channel/ChanId Dvr/GetRecordedList | jq ...
+  cut -f1 chanids | sed 's|^|Channel/GetChannelInfo?ChanID=|' | \\
+      python -m mythtv_services_api --host someName --concurrency 8 -
+'''
+
+LOG = logging.getLogger(__name__)
+logging.getLogger(__name__).addHandler(logging.NullHandler())
+
+
+def parse_spec(spec):
+    """'Dvr/GetRecordedList?Count=10' to ('Dvr/GetRecordedList', 'Count=10')"""
+
+    endpoint, _, rest = spec.strip().partition('?')
+
+    return endpoint.strip('/'), rest
+
+
+def project(value, fields):
+    """
+    Keep only fields (paths like 'Channel/ChanId', as in columns.py) of a
+    dict, or of each dict in a list. Missing fields are left out.
+    """
+
+    if isinstance(value, list):
+        return [project(item, fields) for item in value]
+
+    result = {}
+
+    for field in fields:
+        source = value
+        target = result
+        keys = field.split('/')
+        for key in keys[:-1]:
+            source = source.get(key) if isinstance(source, dict) else None
+            if not isinstance(source, dict):
+                break
+            target = target.setdefault(key, {})
+        else:
+            if isinstance(source, dict) and keys[-1] in source:
+                target[keys[-1]] = source[keys[-1]]
+
+    return result
+
+
+def _project_list(response, fields):
+    """A copy of a list response with project()ed items, if it has a list."""
+
+    try:
+        found = find_list(response)
+    except RuntimeError:
+        return response
+
+    if found is response:
+        return project(found, fields)
+
+    result = {}
+    for name, outer in response.items():
+        result[name] = dict((key, project(value, fields)
+                             if value is found else value)
+                            for key, value in outer.items())
+
+    return result
+
+
+class ResponseCache(object):
+    """
+    Responses on disk, one JSON file per host/port/endpoint/rest. Those
+    younger than max_age are used without asking the backend. Older ones
+    are revalidated with their ETag, so unchanged responses aren't sent
+    again.
+    """
+
+    def __init__(self, directory, max_age=60):
+        self.directory = directory
+        self.max_age = max_age
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def send(self, backend, endpoint, rest, opts):
+        """backend.send(), via the cache."""
+
+        key = '{}:{}/{}?{} {}'.format(backend.host, backend.port, endpoint,
+                                      rest, sorted(opts.get('fields') or ()))
+        name = os.path.join(self.directory, hashlib.sha1(
+            key.encode('utf-8')).hexdigest() + '.json')
+
+        try:
+            with open(name) as f_obj:
+                entry = json.load(f_obj)
+        except (IOError, OSError, ValueError):
+            entry = None
+
+        if entry and time.time() - entry['time'] < self.max_age:
+            return entry['response']
+
+        opts = dict(opts)
+        if entry and entry['etag']:
+            opts['etag'] = entry['etag']
+
+        try:
+            response = backend.send(endpoint=endpoint, rest=rest, opts=opts)
+            etag = backend.etag
+        except RuntimeWarning as warning:
+            if not entry or not api.not_modified(warning):
+                raise
+            # send() raised before backend.etag was set, it could be from
+            # another request.
+            response = entry['response']
+            etag = entry['etag']
+
+        # Write a new file and rename it, other processes may be reading.
+        temporary = '{}.{}.{}'.format(name, os.getpid(),
+                                      threading.current_thread().ident)
+        with open(temporary, 'w') as f_obj:
+            json.dump({'time': time.time(), 'etag': etag,
+                       'response': response}, f_obj, default=_plain)
+        os.rename(temporary, name)
+
+        return response
+
+
+class Client(object):
+    """
+    Runs many requests concurrently over a pool of Send()s (so connections
+    are reused) and writes the results as they arrive, one JSON document
+    per line. Used by main(), but usable on its own too.
+
+    Without page, each line is {"endpoint": ..., "rest": ..., "response":
+    ...}. With page (or items), each line is one item of a list response,
+    so a pipeline can process big lists an item at a time. Errors are
+    written to errors, also as lines of JSON.
+    """
+
+    def __init__(self, host, port=6544, concurrency=4, opts=None, page=None,
+                 items=False, fields=None, cache=None, ordered=False,
+                 output=None, errors=None):
+        """
+        INPUT:
+        ======
+
+        host:        The back/frontend, and port.
+        port:
+
+        concurrency: Requests sent at once, and Send()s in the pool.
+
+        opts:        The same as for send().
+
+        page:        If set, list endpoints are fetched Count=page items at a
+                     time, until TotalAvailable is reached.
+
+        items:       Write list items, rather than whole responses.
+
+        fields:      If set, only these fields (paths, see project()) of
+                     each item of a list are decoded (see opts['fields'])
+                     and written.
+
+        cache:       Optional, a ResponseCache.
+
+        ordered:     Write results in the order of the specs, rather than
+                     as they arrive. Buffers the results of later specs.
+
+        output:      File objects, default stdout and stderr.
+        errors:
+        """
+
+        self.concurrency = concurrency
+        self.opts = dict(opts or {})
+        self.page = page
+        self.items = items or bool(page)
+        self.fields = fields
+        if fields:
+            self.opts['fields'] = tuple(fields)
+        self.cache = cache
+        self.ordered = ordered
+        self.output = output or sys.stdout
+        self.errors = errors or sys.stderr
+        self.failed = 0
+        self._lock = threading.Lock()
+        self._pool = Queue()
+
+        for _ in range(concurrency):
+            self._pool.put(api.Send(host=host, port=port))
+
+    def run(self, specs):
+        """
+        Run each spec ('endpoint?rest', e.g. from parse_spec()) and write
+        the results. specs may be a generator (e.g. lines of stdin), only
+        a few more than concurrency are read ahead. Returns the number of
+        specs that failed.
+        """
+
+        executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        pending = deque() if self.ordered else set()
+
+        try:
+            for spec in specs:
+                if not spec.strip() or spec.lstrip().startswith('#'):
+                    continue
+                if len(pending) >= 2 * self.concurrency:
+                    self._drain(pending, everything=False)
+                future = executor.submit(self._run_one, spec)
+                if self.ordered:
+                    pending.append(future)
+                else:
+                    pending.add(future)
+            self._drain(pending, everything=True)
+        finally:
+            executor.shutdown(wait=True)
+
+        return self.failed
+
+    def _drain(self, pending, everything):
+        """Write finished results, the 1st in order if ordered."""
+
+        while pending:
+            if self.ordered:
+                self._write(pending.popleft().result())
+            else:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                pending.difference_update(done)
+                for future in done:
+                    future.result()
+            if not everything:
+                return
+
+    def _run_one(self, spec):
+        """Run one spec. Returns its lines if ordered, else writes them."""
+
+        endpoint, rest = parse_spec(spec)
+        lines = []
+        emit = lines.extend if self.ordered else self._write
+
+        backend = self._pool.get()
+
+        try:
+            if self.page:
+                self._paged(backend, endpoint, rest, emit)
+            else:
+                response = self._send(backend, endpoint, rest)
+                if self.items:
+                    emit(self._lines(find_list(response)))
+                else:
+                    if self.fields:
+                        response = _project_list(response, self.fields)
+                    emit([_dumps({'endpoint': endpoint, 'rest': rest,
+                                  'response': response})])
+        except (RuntimeError, RuntimeWarning) as error:
+            with self._lock:
+                self.failed += 1
+                self.errors.write(_dumps({'endpoint': endpoint, 'rest': rest,
+                                          'error': str(error)}) + '\n')
+        finally:
+            self._pool.put(backend)
+
+        return lines
+
+    def _paged(self, backend, endpoint, rest, emit):
+        """Fetch and emit a list page by page."""
+
+        start = 0
+
+        while True:
+            response = self._send(backend, endpoint, '&'.join(
+                part for part in (rest, 'StartIndex={}&Count={}'.format(
+                    start, self.page)) if part))
+            found = find_list(response)
+            emit(self._lines(found))
+            start += len(found)
+
+            try:
+                total = int(next(iter(response.values()))['TotalAvailable'])
+            except (KeyError, TypeError, ValueError, StopIteration):
+                total = None
+
+            if len(found) < self.page or (total is not None and
+                                          start >= total):
+                return
+
+    def _send(self, backend, endpoint, rest):
+        """One request, via the cache if there is one."""
+
+        if self.cache:
+            return self.cache.send(backend, endpoint, rest, self.opts)
+
+        return backend.send(endpoint=endpoint, rest=rest,
+                            opts=dict(self.opts))
+
+    def _lines(self, found):
+        """The lines for a list's items."""
+
+        if self.fields:
+            found = project(found, self.fields)
+
+        return [_dumps(item) for item in found]
+
+    def _write(self, lines):
+        """Write lines together, so those of concurrent specs don't mix."""
+
+        if lines:
+            with self._lock:
+                self.output.write('\n'.join(lines) + '\n')
+                self.output.flush()
+
+
+def _dumps(value):
+    """One line of JSON."""
+
+    return json.dumps(value, separators=(',', ':'), sort_keys=True,
+                      default=_plain)
+
+
+def _plain(value):
+    """
+    For json.dumps(), opts['typed'] dates and times as the backend sends
+    them (times are naive UTC) and records.Record as dicts.
+    """
+
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    if isinstance(value, date):
+        return value.isoformat()
+
+    if hasattr(value, 'to_dict'):
+        return value.to_dict()
+
+    raise TypeError('{!r} is not JSON serializable'.format(value))
+
+
+def _stdin_specs():
+    """Lines of stdin, read as they're needed."""
+
+    line = sys.stdin.readline()
+    while line:
+        yield line
+        line = sys.stdin.readline()
+
+
+def main(args=None):
+    """The python -m mythtv_services_api entry point."""
+
+    parser = argparse.ArgumentParser(
+        prog='python -m mythtv_services_api',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description='Send Services API GETs concurrently and print the '
+                    'responses as newline delimited JSON.',
+        epilog=USAGE_EXAMPLES)
+    parser.add_argument('specs', nargs='*', metavar='ENDPOINT[?REST]',
+                        help="e.g. 'Dvr/GetRecordedList?Count=10'. Specs "
+                             "are read from stdin, one per line, if there "
+                             "are none or one is -")
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=6544)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--page', type=int, metavar='COUNT',
+                        help='fetch lists COUNT items at a time and print '
+                             'one item per line')
+    parser.add_argument('--items', action='store_true',
+                        help='print one item of a list per line')
+    parser.add_argument('--fields', metavar='PATH,...',
+                        help='print only these fields, e.g. '
+                             'Title,StartTime,Channel/ChanId')
+    parser.add_argument('--ordered', action='store_true',
+                        help='print results in the order of the specs')
+    parser.add_argument('--cache-dir', metavar='DIRECTORY',
+                        help='cache responses (and WSDLs) here')
+    parser.add_argument('--max-age', type=float, default=60,
+                        help='seconds a cached response is used without '
+                             'revalidating it, default 60')
+    parser.add_argument('--timeout', type=float, default=10)
+    parser.add_argument('--user')
+    parser.add_argument('--pass', dest='password')
+    parser.add_argument('--typed', action='store_true',
+                        help="see opts['typed']")
+    parser.add_argument('--validate', action='store_true',
+                        help="see opts['validate']")
+    parser.add_argument('--debug', action='store_true')
+    options = parser.parse_args(args)
+
+    logging.basicConfig(level=logging.DEBUG if options.debug
+                        else logging.WARNING)
+
+    opts = {'timeout': options.timeout, 'typed': options.typed,
+            'validate': options.validate}
+    if options.user:
+        opts.update(user=options.user, **{'pass': options.password})
+
+    cache = None
+    if options.cache_dir:
+        schema.CACHE_DIR = os.path.join(options.cache_dir, 'wsdl')
+        cache = ResponseCache(options.cache_dir, max_age=options.max_age)
+
+    specs = [spec for spec in options.specs if spec != '-']
+    if not specs or '-' in options.specs:
+        specs = itertools.chain(specs, _stdin_specs())
+
+    client = Client(options.host, port=options.port,
+                    concurrency=options.concurrency, opts=opts,
+                    page=options.page, items=options.items,
+                    fields=options.fields.split(',') if options.fields
+                    else None,
+                    cache=cache, ordered=options.ordered)
+
+    try:
+        return 1 if client.run(specs) else 0
+    except IOError as error:
+        # e.g. | head
+        if error.errno != errno.EPIPE:
+            raise
+        return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+# vim: set expandtab tabstop=4 shiftwidth=4 smartindent noai colorcolumn=80:
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+
+"""Bulk postdata writes."""
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+import logging
+import threading
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from . import send as api
+
+PENDING = 'pending'
+INVALID = 'invalid'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+LOG = logging.getLogger(__name__)
+logging.getLogger(__name__).addHandler(logging.NullHandler())
+
+
+class BulkWrite(object):
+    """
+    Validate, dry run and then apply many postdata writes to one
+    back/frontend.
+
+    EXAMPLE:
+    ========
+
+        import mythtv_services_api.send as send
+        from mythtv_services_api.bulk import BulkWrite
+
+        backend = send.Send(host='someName')
+        bulk = BulkWrite(backend, max_workers=4)
+
+        for recorded_id in recorded_ids:
+            bulk.add(endpoint='Dvr/UpdateRecordedWatchedStatus',
+                     postdata={'RecordedId': recorded_id, 'Watched': True})
+
+        print(bulk.dry_run())
+
+        try:
+            bulk.apply(opts={'wrmi': True})
+        except RuntimeError as error:
+            ...examine bulk.results, fix things and call apply() again.
+
+    Items that succeeded are never re-sent, so apply() can simply be called
+    again after a partial failure to resume.
+    """
+
+    def __init__(self, backend, max_workers=4):
+        """
+        INPUT:
+        ======
+
+        backend:     A send.Send() object. Only its host and port are used.
+                     Each worker thread gets its own Send() because send()
+                     saves per-call state in the object.
+
+        max_workers: The maximum number of writes in flight at once. Keep
+                     this small, the backend serializes DB updates anyway.
+                     Defaults to 4.
+        """
+
+        if not isinstance(backend, api.Send):
+            raise RuntimeError('usage: backend must be a Send() object')
+
+        if max_workers < 1:
+            raise RuntimeError('usage: max_workers must be at least 1')
+
+        self.host = backend.host
+        self.port = backend.port
+        self.max_workers = max_workers
+        self.items = []
+        self.results = []
+        self._local = threading.local()
+
+    def add(self, endpoint, postdata):
+        """
+        Queue one write. Nothing is validated or sent yet. Returns the
+        index of the item, which is also its index in results.
+        """
+
+        self.items.append((endpoint, postdata))
+        self.results.append({'status': PENDING, 'response': None,
+                             'error': None})
+
+        return len(self.items) - 1
+
+    def validate(self, opts=None):
+        """
+        Run the same checks send() does on every queued item, without
+        sending anything. Items that fail are marked INVALID, the others
+        that haven't already succeeded are (re)marked PENDING.
+
+        Returns a list of (index, error message) tuples, empty if all items
+        are valid.
+        """
+
+        checker = api.Send(host=self.host, port=self.port)
+        errors = []
+
+        for index, (endpoint, postdata) in enumerate(self.items):
+
+            if self.results[index]['status'] == SUCCEEDED:
+                continue
+
+            try:
+                if not postdata:
+                    raise RuntimeError('usage: postdata is required')
+                # Validation only, wrmi=False is handled once in apply().
+                checker.check(endpoint, postdata=postdata,
+                              opts=dict(opts or {}, wrmi=True))
+            except RuntimeError as error:
+                self.results[index].update({'status': INVALID,
+                                            'error': str(error)})
+                errors.append((index, str(error)))
+            else:
+                self.results[index].update({'status': PENDING,
+                                            'error': None})
+
+        return errors
+
+    def dry_run(self, opts=None):
+        """
+        Validate all items and return a single report (a string) showing
+        what apply() would send. The report is also logged at DEBUG level.
+        """
+
+        errors = dict(self.validate(opts=opts))
+        lines = []
+
+        for index, (endpoint, postdata) in enumerate(self.items):
+            status = self.results[index]['status']
+            lines.append('{:>6} {:9} {} {}'.format(index, status, endpoint,
+                                                   postdata))
+            if index in errors:
+                lines.append('{:>6} {:9} {}'.format('', '', errors[index]))
+
+        lines.append('{} item(s): {}'.format(len(self.items), self.summary))
+
+        report = '\n'.join(lines)
+        LOG.debug('Bulk dry run for %s:%s\n%s', self.host, self.port, report)
+
+        return report
+
+    def apply(self, opts=None):
+        """
+        Validate everything, then send all items that haven't succeeded
+        yet, at most max_workers at a time.
+
+        If any item is invalid, nothing is sent and a RuntimeError is
+        raised. If opts['wrmi'] isn't True, the dry run report is logged
+        and a single RuntimeWarning is raised, just like send() does for one
+        item. If some writes fail, a RuntimeError is raised after all
+        others have completed. A {'bool': 'false'} answer is a failure
+        too. Per-item status, response and error are in results.
+
+        Returns the summary, e.g. {'succeeded': 1000, ...}
+        """
+
+        opts = dict(opts or {})
+
+        if not opts.get('wrmi'):
+            self.dry_run(opts=opts)
+            raise RuntimeWarning('wrmi=False, {} item(s) not sent'
+                                 .format(self.summary[PENDING]))
+
+        errors = self.validate(opts=opts)
+        if errors:
+            raise RuntimeError('{} invalid item(s), nothing sent. 1st: {}: {}'
+                               .format(len(errors), *errors[0]))
+
+        pending = [index for index, result in enumerate(self.results)
+                   if result['status'] != SUCCEEDED]
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(self._write, index, opts)
+                       for index in pending]
+            for future in as_completed(futures):
+                future.result()
+
+        summary = self.summary
+
+        if summary[FAILED]:
+            raise RuntimeError('{} of {} write(s) failed, call apply() again '
+                               'to retry them'.format(summary[FAILED],
+                                                      len(pending)))
+
+        return summary
+
+    @property
+    def summary(self):
+        """
+        Returns a count of items in each state.
+        """
+
+        counts = dict.fromkeys((PENDING, INVALID, SUCCEEDED, FAILED), 0)
+        for result in self.results:
+            counts[result['status']] += 1
+
+        return counts
+
+    def _write(self, index, opts):
+        """Send one item using this thread's Send() and record the result."""
+
+        endpoint, postdata = self.items[index]
+
+        backend = api.local_send(self._local, self.host, self.port)
+
+        try:
+            response = backend.send(endpoint=endpoint, postdata=postdata,
+                                    opts=dict(opts))
+            if isinstance(response, dict) and \
+                    str(response.get('bool')).lower() == 'false':
+                raise RuntimeError('{} returned false'.format(endpoint))
+        except (RuntimeError, RuntimeWarning) as error:
+            LOG.debug('Bulk item %d failed: %s', index, error)
+            self.results[index].update({'status': FAILED, 'response': None,
+                                        'error': str(error)})
+        else:
+            self.results[index].update({'status': SUCCEEDED,
+                                        'response': response, 'error': None})
+
+# vim: set expandtab tabstop=4 shiftwidth=4 smartindent noai colorcolumn=80:
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+"""Columnar (and NumPy) export of list responses."""
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+import logging
+from datetime import datetime
+
+from .utilities import to_int
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Column name: (path in each item, type.) Types are: int, float, bool,
+# datetime, category and str. Paths use / to reach nested values.
+PROGRAM_COLUMNS = {
+    'ChanId': ('Channel/ChanId', 'int'),
+    'CallSign': ('Channel/CallSign', 'category'),
+    'StartTime': ('StartTime', 'datetime'),
+    'EndTime': ('EndTime', 'datetime'),
+    'Title': ('Title', 'category'),
+    'SubTitle': ('SubTitle', 'str'),
+    'Category': ('Category', 'category'),
+    'FileSize': ('FileSize', 'int'),
+    'RecordedId': ('Recording/RecordedId', 'int'),
+    'Status': ('Recording/Status', 'int'),
+    'RecGroup': ('Recording/RecGroup', 'category'),
+    'StorageGroup': ('Recording/StorageGroup', 'category'),
+}
+
+CHANNEL_COLUMNS = {
+    'ChanId': ('ChanId', 'int'),
+    'ChanNum': ('ChanNum', 'str'),
+    'CallSign': ('CallSign', 'category'),
+    'SourceId': ('SourceId', 'int'),
+    'Visible': ('Visible', 'bool'),
+}
+
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+# What missing or invalid values become in NumPy int columns.
+INT_MISSING = -1
+
+LOG = logging.getLogger(__name__)
+logging.getLogger(__name__).addHandler(logging.NullHandler())
+
+
+def find_list(response):
+    """
+    Return the list of items in a response like {'ProgramList':
+    {'Programs': [...], 'Count': ...}} or the response itself if it's
+    already a list.
+    """
+
+    if isinstance(response, list):
+        return response
+
+    try:
+        for outer in response.values():
+            for value in outer.values():
+                if isinstance(value, list):
+                    return value
+    except AttributeError:
+        pass
+
+    raise RuntimeError('No list found in the response')
+
+
+def columns(response, spec=None):
+    """
+    Convert a list response (or the list in it) to a dict of columns, each
+    a Python list with one value per item, converted to the spec's type.
+    Missing or invalid values are None. category columns are plain strings
+    here.
+
+    spec defaults to PROGRAM_COLUMNS.
+    """
+
+    converters = {'int': to_int, 'float': _float, 'bool': _bool,
+                  'datetime': _datetime, 'category': _str, 'str': _str}
+
+    result = {}
+
+    for name, values in _raw_columns(response, spec).items():
+        convert = converters[(spec or PROGRAM_COLUMNS)[name][1]]
+        result[name] = [convert(value) for value in values]
+
+    return result
+
+
+def to_numpy(response, spec=None, structured=False):
+    """
+    Convert a list response (or the list in it) to NumPy arrays, ready for
+    vectorized aggregation or pandas.DataFrame(...):
+
+        int:      int64, missing values are INT_MISSING.
+        float:    float64, missing values are NaN.
+        bool:     bool, missing values are False.
+        datetime: datetime64[s] (UTC), missing values are NaT.
+        category: int32 codes in the column, and the array of distinct
+                  strings that they index in column + '_categories'. E.g.
+                  pandas.Categorical.from_codes(result['Title'],
+                  result['Title_categories'])
+        str:      unicode strings.
+
+    If structured is True, a single structured array is returned instead,
+    with category columns stored as strings.
+
+    spec defaults to PROGRAM_COLUMNS. Requires NumPy.
+    """
+
+    if numpy is None:
+        raise RuntimeError('Install python-numpy or python3-numpy')
+
+    spec = spec or PROGRAM_COLUMNS
+    arrays = {}
+
+    for name, values in _raw_columns(response, spec).items():
+        column_type = spec[name][1]
+
+        if column_type == 'int':
+            arrays[name] = numpy.array([to_int(value, INT_MISSING)
+                                        for value in values],
+                                       dtype=numpy.int64)
+        elif column_type == 'float':
+            arrays[name] = numpy.array([_float(value, numpy.nan)
+                                        for value in values],
+                                       dtype=numpy.float64)
+        elif column_type == 'bool':
+            arrays[name] = numpy.array([bool(_bool(value)) for value in
+                                        values], dtype=bool)
+        elif column_type == 'datetime':
+            arrays[name] = numpy.array([(value or 'NaT').rstrip('Z')
+                                        for value in values],
+                                       dtype='datetime64[s]')
+        elif column_type == 'category' and not structured:
+            categories, codes = numpy.unique(
+                numpy.array([value or '' for value in values], dtype=str),
+                return_inverse=True)
+            arrays[name] = codes.astype(numpy.int32)
+            arrays[name + '_categories'] = categories
+        else:
+            arrays[name] = numpy.array([value or '' for value in values],
+                                       dtype=str)
+
+    if not structured:
+        return arrays
+
+    names = sorted(arrays)
+    result = numpy.empty(len(arrays[names[0]]) if names else 0,
+                         dtype=[(name, arrays[name].dtype) for name in names])
+    for name in names:
+        result[name] = arrays[name]
+
+    return result
+
+
+def _raw_columns(response, spec):
+    """One pass over the items, collecting the unconverted values."""
+
+    spec = spec or PROGRAM_COLUMNS
+    paths = [(name, path.split('/')) for name, (path, _) in spec.items()]
+    result = dict((name, []) for name in spec)
+
+    for item in find_list(response):
+        for name, path in paths:
+            value = item
+            for key in path:
+                try:
+                    value = value.get(key)
+                except AttributeError:
+                    value = None
+                    break
+            result[name].append(value)
+
+    return result
+
+
+def _float(value, missing=None):
+    """MythTV sends numbers as strings."""
+
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return missing
+
+
+def _bool(value):
+    """MythTV sends booleans as 'true' or 'false'."""
+
+    if value is None:
+        return None
+
+    return str(value).lower() in ('true', '1')
+
+
+def _datetime(value):
+    """A naive datetime in UTC, or None."""
+
+    try:
+        return datetime.strptime(value, TIME_FORMAT)
+    except (TypeError, ValueError):
+        return None
+
+
+def _str(value):
+    """Keep strings, None for anything missing."""
+
+    return value if value is None else '{}'.format(value)
+
+# vim: set expandtab tabstop=4 shiftwidth=4 smartindent noai colorcolumn=80:
@@ -0,0 +1,382 @@
+# -*- coding: utf-8 -*-
+
+"""Local tuner conflict and free tuner analysis of the schedule."""
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+import calendar
+import logging
+import time
+
+from . import utilities as util
+
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+# Recording statuses that hold an input: Pending, Tuning, Recording,
+# WillRecord.
+SCHEDULED_STATUSES = (-15, -10, -2, -1)
+
+LOG = logging.getLogger(__name__)
+logging.getLogger(__name__).addHandler(logging.NullHandler())
+
+
+def _seconds(value):
+    """2019-01-01T00:00:00Z to seconds since the epoch, None if invalid."""
+
+    try:
+        return calendar.timegm(time.strptime(value, TIME_FORMAT))
+    except (TypeError, ValueError):
+        return None
+
+
+def _string(seconds):
+    """The format the backend uses."""
+
+    return time.strftime(TIME_FORMAT, time.gmtime(seconds))
+
+
+class IntervalTree(object):
+    """
+    A static centered interval tree of half open [start, end) intervals,
+    each (start, end, value). Built once in O(n log n), then overlap()
+    finds the k intervals overlapping a window in O(log n + k).
+    """
+
+    def __init__(self, intervals=()):
+        intervals = sorted((interval for interval in intervals
+                            if interval[1] > interval[0]),
+                           key=lambda interval: interval[0])
+        self.size = len(intervals)
+        self._root = self._build(intervals)
+
+    def _build(self, intervals):
+        """A node is (center, here by start, here by end desc, left, right.)"""
+
+        if not intervals:
+            return None
+
+        center = intervals[len(intervals) // 2][0]
+        left = [interval for interval in intervals if interval[1] <= center]
+        right = [interval for interval in intervals if interval[0] > center]
+        here = [interval for interval in intervals
+                if interval[0] <= center < interval[1]]
+
+        return (center, here,
+                sorted(here, key=lambda interval: interval[1], reverse=True),
+                self._build(left), self._build(right))
+
+    def overlap(self, start, end):
+        """Return the intervals that overlap [start, end), by start."""
+
+        result = []
+        pending = [self._root]
+
+        while pending:
+            node = pending.pop()
+            if node is None:
+                continue
+            center, by_start, by_end, left, right = node
+
+            if end <= center:
+                for interval in by_start:
+                    if interval[0] >= end:
+                        break
+                    result.append(interval)
+                pending.append(left)
+            elif start > center:
+                for interval in by_end:
+                    if interval[1] <= start:
+                        break
+                    result.append(interval)
+                pending.append(right)
+            else:
+                result.extend(by_start)
+                pending.extend((left, right))
+
+        result.sort(key=lambda interval: interval[0])
+
+        return result
+
+    def __len__(self):
+        return self.size
+
+
+class Schedule(object):
+    """
+    The upcoming recordings, conflicts and encoder inputs, loaded once
+    (3 requests) and indexed in an IntervalTree per input, so questions
+    about the schedule are answered locally:
+
+        conflicts_with(): What would a program compete with, if a rule
+                          that records it were added?
+        free_windows():   When are inputs free?
+
+    Statuses and recording types in the results are rendered with the
+    utilities *_to_string() translators, which cache them.
+
+    EXAMPLE:
+    ========
+
+        import mythtv_services_api.send as send
+        from mythtv_services_api.conflicts import Schedule
+
+        backend = send.Send(host='someName')
+        schedule = Schedule(backend)
+
+        for window in schedule.free_windows('2019-01-01T18:00:00Z',
+                                            '2019-01-02T00:00:00Z',
+                                            source_id=1):
+            print(window)
+
+    Backends from v29 on, where a Recording's EncoderId is its input, are
+    expected. Call load() again after the schedule changes. Conflicts the
+    backend reports that have a free input here are kept in unexplained
+    (and logged), answers about them can't be trusted.
+    """
+
+    def __init__(self, backend, opts=None):
+        """
+        INPUT:
+        ======
+
+        backend: A send.Send() object.
+
+        opts:    The same as for send().
+        """
+
+        self.backend = backend
+        self.opts = opts
+        # {input id: {'SourceId': ..., 'Name': ..., 'EncoderId': ...}}
+        self.inputs = {}
+        # As returned by the backend, see describe().
+        self.upcoming = []
+        self.conflicting = []
+        # Those in conflicting that have a free input here, see load().
+        self.unexplained = []
+        self.trees = {}
+        self.load()
+
+    def load(self):
+        """Fetch the upcoming list, conflict list and encoders, and index."""
+
+        try:
+            self.upcoming = self._send('Dvr/GetUpcomingList')[
+                'ProgramList']['Programs']
+            self.conflicting = self._send('Dvr/GetConflictList')[
+                'ProgramList']['Programs']
+            encoders = self._send('Dvr/GetEncoderList')[
+                'EncoderList']['Encoders']
+        except (KeyError, TypeError):
+            raise RuntimeError('Unexpected Dvr/ list response')
+
+        self.inputs = {}
+        for encoder in encoders:
+            for card_input in encoder.get('Inputs') or []:
+                self.inputs[util.to_int(card_input.get('Id'))] = {
+                    'SourceId': util.to_int(card_input.get('SourceId')),
+                    'Name': (card_input.get('DisplayName') or
+                             card_input.get('InputName')),
+                    'EncoderId': util.to_int(encoder.get('Id'))}
+            if not encoder.get('Inputs'):
+                # Older backends, any source.
+                self.inputs[util.to_int(encoder.get('Id'))] = {
+                    'SourceId': None, 'Name': encoder.get('HostName'),
+                    'EncoderId': util.to_int(encoder.get('Id'))}
+
+        intervals = dict((input_id, []) for input_id in self.inputs)
+        for program in self.upcoming:
+            recording = program.get('Recording') or {}
+            if util.to_int(recording.get('Status')) not in SCHEDULED_STATUSES:
+                continue
+            start, end = self._times(program)
+            input_id = util.to_int(recording.get('EncoderId'))
+            if start is None or end is None or input_id not in intervals:
+                LOG.debug('Not indexed: %s %s', program.get('Title'),
+                          program.get('StartTime'))
+                continue
+            intervals[input_id].append((start, end, program))
+
+        self.trees = dict((input_id, IntervalTree(items))
+                          for input_id, items in intervals.items())
+
+        # The backend couldn't fit these, so they should compete with
+        # something here too. If not, the answers below can't be trusted
+        # for them (input groups, multirec etc. aren't modelled.)
+        self.unexplained = [program for program in self.conflicting
+                            if None not in self._times(program) and
+                            not self._competing(program)]
+        if self.unexplained:
+            LOG.warning('%d of %d backend conflicts have a free input here',
+                        len(self.unexplained), len(self.conflicting))
+
+        LOG.debug('Schedule: %d upcoming, %d conflicting, %d inputs',
+                  len(self.upcoming), len(self.conflicting),
+                  len(self.inputs))
+
+    def inputs_for(self, source_id=None):
+        """The ids of the inputs that can record from a video source."""
+
+        return sorted(input_id for input_id, card_input in self.inputs.items()
+                      if source_id is None or card_input['SourceId'] is None
+                      or card_input['SourceId'] == util.to_int(source_id))
+
+    def busy(self, input_id, start, end):
+        """The scheduled programs on an input overlapping start to end."""
+
+        first = _seconds(start)
+        last = _seconds(end)
+        if first is None or last is None:
+            raise RuntimeError('usage: start and end must be UTC times like '
+                               '{}'.format(TIME_FORMAT))
+
+        return [interval[2] for interval in self.trees.get(
+            util.to_int(input_id), IntervalTree()).overlap(first, last)]
+
+    def conflicts_with(self, program):
+        """
+        Return [] if an input that can record program (a dict like those in
+        Guide/GetProgramList or Dvr/GetUpcomingList) is free for all of
+        it. Otherwise, return the scheduled programs it would compete with
+        on each of those inputs, described by describe().
+        """
+
+        if None in self._times(program):
+            raise RuntimeError('usage: program needs StartTime and EndTime')
+
+        return [self.describe(entry) for entry in self._competing(program)]
+
+    def would_conflict(self, programs):
+        """
+        For each showing a new rule would record, conflicts_with(). Returns
+        [(program, [conflicts...]), ...] for those that wouldn't fit.
+        """
+
+        result = []
+
+        for program in programs:
+            competing = self.conflicts_with(program)
+            if competing:
+                result.append((program, competing))
+
+        return result
+
+    def free_windows(self, start, end, source_id=None, min_free=1):
+        """
+        Return [(start, end, number of free inputs), ...] for the parts of
+        start to end (UTC strings) where at least min_free inputs that can
+        record source_id (or any source if None) are free.
+        """
+
+        first = _seconds(start)
+        last = _seconds(end)
+        if first is None or last is None or last <= first:
+            raise RuntimeError('usage: start and end must be UTC times like '
+                               '{}, start first'.format(TIME_FORMAT))
+
+        input_ids = self.inputs_for(source_id)
+        events = []
+
+        for input_id in input_ids:
+            for interval in _merge(self.trees[input_id].overlap(first, last)):
+                events.append((max(interval[0], first), 1))
+                events.append((min(interval[1], last), -1))
+
+        events.sort()
+
+        windows = []
+        busy = 0
+        position = first
+
+        for moment, change in events + [(last, 0)]:
+            if moment > position:
+                free = len(input_ids) - busy
+                if free >= min_free:
+                    if windows and windows[-1][1] == position and \
+                            windows[-1][2] == free:
+                        windows[-1][1] = moment
+                    else:
+                        windows.append([position, moment, free])
+                position = moment
+            busy += change
+
+        return [(_string(window[0]), _string(window[1]), window[2])
+                for window in windows]
+
+    def describe(self, program):
+        """A program's title, times, input, status and type, readable."""
+
+        recording = program.get('Recording') or {}
+        input_id = util.to_int(recording.get('EncoderId'))
+
+        return {'Title': program.get('Title'),
+                'SubTitle': program.get('SubTitle'),
+                'StartTime': program.get('StartTime'),
+                'EndTime': program.get('EndTime'),
+                'ChanId': (program.get('Channel') or {}).get('ChanId'),
+                'Input': self.inputs.get(input_id, {}).get('Name'),
+                'Status': util.rec_status_to_string(
+                    backend=self.backend,
+                    rec_status=recording.get('Status', 0), opts=self.opts),
+                'RecType': util.rec_type_to_string(
+                    backend=self.backend,
+                    rec_type=recording.get('RecType', 0), opts=self.opts)}
+
+    def _competing(self, program):
+        """
+        The scheduled programs program competes with on the inputs that
+        can record it, as returned by the backend. [] if one is free.
+        """
+
+        start, end = self._times(program)
+        key = _key(program)
+        found = []
+
+        for input_id in self.inputs_for(
+                (program.get('Channel') or {}).get('SourceId')):
+            competing = [interval[2] for interval
+                         in self.trees[input_id].overlap(start, end)
+                         if _key(interval[2]) != key]
+            if not competing:
+                return []
+            found.extend(competing)
+
+        return found
+
+    def _send(self, endpoint):
+        """One list request."""
+
+        return self.backend.send(endpoint=endpoint, opts=self.opts)
+
+    @staticmethod
+    def _times(program):
+        """Start and end, including any pre/post roll, in seconds."""
+
+        recording = program.get('Recording') or {}
+
+        return (_seconds(recording.get('StartTs') or
+                         program.get('StartTime')),
+                _seconds(recording.get('EndTs') or program.get('EndTime')))
+
+
+def _key(program):
+    """What identifies a showing."""
+
+    return ((program.get('Channel') or {}).get('ChanId'),
+            program.get('StartTime'))
+
+
+def _merge(intervals):
+    """Merge overlapping intervals (sorted by start) into [start, end]s."""
+
+    merged = []
+
+    for interval in intervals:
+        if merged and interval[0] <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], interval[1])
+        else:
+            merged.append([interval[0], interval[1]])
+
+    return merged
+
+# vim: set expandtab tabstop=4 shiftwidth=4 smartindent noai colorcolumn=80:
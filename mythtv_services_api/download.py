@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+
+"""Stream files and recordings to disk, with resume and parallel ranges."""
+
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import json
+import logging
+import os
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from . import send as api
+
+CHUNK_SIZE = 256 * 1024
+PROGRESS_INTERVAL = 0.5
+
+LOG = logging.getLogger(__name__)
+logging.getLogger(__name__).addHandler(logging.NullHandler())
+
+
+def download(backend, endpoint, rest='', path=None, sink=None, opts=None,
+             resume=True, parts=1, progress=None):
+    """
+    Stream the raw bytes returned by an endpoint, e.g. Content/GetFile or
+    Content/GetRecording, to a file or writable object. Nothing is decoded
+    and at most CHUNK_SIZE bytes (per part) are held in memory.
+
+    EXAMPLES:
+    =========
+
+        import mythtv_services_api.send as send
+        from mythtv_services_api.download import download
+
+        backend = send.Send(host='someName')
+
+        download(backend, 'Content/GetRecording', rest='RecordedId=1234',
+                 path='/tmp/1234.ts', parts=4)
+
+        with open('/tmp/file.jpg', 'wb') as sink:
+            download(backend, 'Content/GetFile', sink=sink,
+                     rest='StorageGroup=Fanart&FileName=file.jpg')
+
+    INPUT:
+    ======
+
+    backend:  A send.Send() object. It's used for the request when there's
+              only one part. Parallel parts each get their own Send().
+
+    endpoint: The same as for send(), also rest and opts. opts['timeout']
+    rest:     only limits the wait for each chunk, not the whole download.
+    opts:
+
+    path:     Where to save the file. Use either this or sink.
+
+    sink:     Anything with a write() method. The whole file is written
+              from the start, resume and parts don't apply.
+
+    resume:   If True and path exists, only the missing bytes are requested
+              (with an HTTP Range: header.) If the server ignores the Range,
+              the file is overwritten. For parts > 1, progress is kept in
+              path + '.parts' until the download completes. It's saved as
+              each part finishes, so it survives the process being killed.
+
+    parts:    Split the file into this many ranges, fetched concurrently.
+              If the server doesn't support ranges, one stream is used.
+
+    progress: A function called at most every PROGRESS_INTERVAL seconds,
+              and once at the end, with (bytes done, total bytes or None,
+              bytes/second.)
+
+    OUTPUT:
+    =======
+
+    A dict, e.g. {'bytes': bytes transferred by this call, 'size': size of
+    the file or None if the server didn't say, 'seconds': 2.5, 'rate':
+    bytes/second.} Or a RuntimeError.
+    """
+
+    if (path is None) == (sink is None):
+        raise RuntimeError('usage: download() needs either path or sink')
+
+    if sink is not None and parts > 1:
+        raise RuntimeError('usage: parts > 1 needs a path, not a sink')
+
+    tracker = _Progress(progress)
+
+    if sink is not None:
+        response = _open(backend, endpoint, rest, opts)
+        tracker.start(0, _content_length(response))
+        _copy(response, sink, tracker)
+    elif parts < 2 or not _download_parts(backend, endpoint, rest, opts,
+                                          path, resume, parts, tracker):
+        _download_one(backend, endpoint, rest, opts, path, resume, tracker)
+
+    return tracker.finish()
+
+
+def _open(backend, endpoint, rest, opts, first_byte=None, last_byte=None,
+          allowed=()):
+    """Send a streamed GET, for a range of bytes if first_byte is set."""
+
+    url = backend.prepare(endpoint, rest=rest, opts=opts)
+
+    # A compressed response would make Range refer to the compressed bytes.
+    headers = {'Accept-Encoding': 'identity'}
+    if first_byte is not None:
+        headers['Range'] = 'bytes={}-{}'.format(
+            first_byte, '' if last_byte is None else last_byte)
+
+    LOG.debug('Download URL=%s, Range: %s', url, headers.get('Range'))
+
+    return backend.request(url, headers=headers, stream=True,
+                           allowed=allowed)
+
+
+def _content_length(response):
+    """The size of the whole file, or None."""
+
+    try:
+        if response.status_code == 206:
+            return int(response.headers['Content-Range'].split('/')[1])
+        return int(response.headers['Content-Length'])
+    except (KeyError, IndexError, ValueError):
+        return None
+
+
+def _copy(response, sink, tracker, part=None):
+    """Write the body to sink in chunks. Count them in part[2] too."""
+
+    try:
+        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+            sink.write(chunk)
+            if part is not None:
+                part[2] += len(chunk)
+            tracker.add(len(chunk))
+    except (IOError, OSError, ValueError) as error:
+        raise RuntimeError('Download interrupted: {}'.format(error))
+    finally:
+        response.close()
+
+
+def _download_one(backend, endpoint, rest, opts, path, resume, tracker):
+    """Stream into path, appending to what's already there if resuming."""
+
+    offset = 0
+    if resume and os.path.exists(path):
+        offset = os.path.getsize(path)
+
+    response = _open(backend, endpoint, rest, opts,
+                     first_byte=offset or None, allowed=(416,))
+
+    if response.status_code == 416:
+        LOG.debug('%s is already complete (%d bytes)', path, offset)
+        response.close()
+        tracker.start(offset, offset)
+        return
+
+    if response.status_code == 206:
+        mode = 'ab'
+    else:
+        mode = 'wb'
+        offset = 0
+
+    tracker.start(offset, _content_length(response))
+
+    with open(path, mode) as f_obj:
+        _copy(response, f_obj, tracker)
+
+
+def _download_parts(backend, endpoint, rest, opts, path, resume, parts,
+                    tracker):
+    """
+    Fetch ranges of the file concurrently, each written at its own offset
+    in path. Returns False (having done nothing) if the server doesn't
+    support ranges.
+    """
+
+    state_path = path + '.parts'
+    ranges = None
+
+    if resume and os.path.exists(path) and os.path.exists(state_path):
+        try:
+            with open(state_path) as f_obj:
+                ranges = json.load(f_obj)
+        except (IOError, OSError, ValueError) as error:
+            LOG.debug('Ignoring %s: %s', state_path, error)
+
+    if not ranges:
+        response = _open(backend, endpoint, rest, opts, first_byte=0,
+                         last_byte=0)
+        response.close()
+        size = _content_length(response)
+        if response.status_code != 206 or not size:
+            LOG.debug('No range support, using a single stream')
+            return False
+
+        part_size = -(-size // parts)
+        # Each range is [first byte, last byte, bytes done.]
+        ranges = [[first, min(first + part_size, size) - 1, 0]
+                  for first in range(0, size, part_size)]
+
+        with open(path, 'wb') as f_obj:
+            f_obj.truncate(size)
+
+    tracker.start(sum(part[2] for part in ranges),
+                  sum(part[1] - part[0] + 1 for part in ranges))
+
+    # What's known to be on disk: parts in progress may have bytes that
+    # are counted but still buffered, so only finished parts are updated.
+    saved = [list(part) for part in ranges]
+    _save_state(state_path, saved)
+
+    pending = [index for index, part in enumerate(ranges)
+               if part[0] + part[2] <= part[1]]
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, len(pending))) as executor:
+            futures = dict((executor.submit(_download_part, backend, endpoint,
+                                            rest, opts, path, ranges[index],
+                                            tracker), index)
+                           for index in pending)
+            for future in as_completed(futures):
+                future.result()
+                index = futures[future]
+                saved[index] = list(ranges[index])
+                _save_state(state_path, saved)
+    finally:
+        # Every file is closed by now, so all of ranges is on disk.
+        if all(part[0] + part[2] > part[1] for part in ranges):
+            if os.path.exists(state_path):
+                os.remove(state_path)
+        else:
+            _save_state(state_path, ranges)
+
+    return True
+
+
+def _save_state(state_path, ranges):
+    """Write a new file and rename it, so there's always a whole one."""
+
+    temporary = '{}.{}'.format(state_path, os.getpid())
+
+    with open(temporary, 'w') as f_obj:
+        json.dump(ranges, f_obj)
+        f_obj.flush()
+        os.fsync(f_obj.fileno())
+
+    os.rename(temporary, state_path)
+
+
+def _download_part(backend, endpoint, rest, opts, path, part, tracker):
+    """Fetch the rest of one range."""
+
+    worker = api.Send(host=backend.host, port=backend.port)
+    response = _open(worker, endpoint, rest, opts,
+                     first_byte=part[0] + part[2], last_byte=part[1])
+
+    if response.status_code != 206:
+        response.close()
+        raise RuntimeError('Server ignored Range: bytes={}-{}'
+                           .format(part[0] + part[2], part[1]))
+
+    with open(path, 'r+b') as f_obj:
+        f_obj.seek(part[0] + part[2])
+        _copy(response, f_obj, tracker, part=part)
+        # Before the state file says the part is done.
+        f_obj.flush()
+        os.fsync(f_obj.fileno())
+
+
+class _Progress(object):
+    """Count bytes from any number of threads and report progress."""
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.lock = threading.Lock()
+        self.began = time.time()
+        self.reported = self.began
+        self.base = 0
+        self.done = 0
+        self.total = None
+
+    def start(self, done, total):
+        """done is what was already there before this call."""
+
+        self.base = self.done = done
+        self.total = total
+
+    def add(self, count):
+        """Called for every chunk written."""
+
+        with self.lock:
+            self.done += count
+            now = time.time()
+            if self.callback is None or \
+                    now - self.reported < PROGRESS_INTERVAL:
+                return
+            self.reported = now
+            done = self.done
+
+        self.callback(done, self.total, self.rate(done, now))
+
+    def rate(self, done, now):
+        """Bytes/second transferred by this call."""
+
+        return (done - self.base) / max(now - self.began, 1e-6)
+
+    def finish(self):
+        """Report once more and return the totals."""
+
+        now = time.time()
+        rate = self.rate(self.done, now)
+
+        if self.callback is not None:
+            self.callback(self.done, self.total, rate)
+
+        return {'bytes': self.done - self.base, 'size': self.total,
+                'seconds': now - self.began, 'rate': rate}
+
+# vim: set expandtab tabstop=4 shiftwidth=4 smartindent noai colorcolumn=80:
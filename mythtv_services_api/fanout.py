@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+"""Send the same request to many back/frontends at once."""
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+import logging
+import time
+
+from concurrent.futures import (ThreadPoolExecutor, as_completed,
+                                TimeoutError as FuturesTimeoutError)
+
+from . import send as api
+
+LOG = logging.getLogger(__name__)
+logging.getLogger(__name__).addHandler(logging.NullHandler())
+
+
+def iter_fan_out(hosts, endpoint, rest='', opts=None, port=6544,
+                 deadline=None, max_workers=None):
+    """
+    Send the same GET to all hosts concurrently and yield a tuple of
+    (host, response, error) for each as soon as it arrives. One of response
+    and error is None. error is the RuntimeError or RuntimeWarning send()
+    raised, as a string.
+
+    EXAMPLE:
+    ========
+
+        from mythtv_services_api import fanout
+
+        frontends = [('fe1', 6547), ('fe2', 6547), 'fe3']
+        for host, response, error in fanout.iter_fan_out(
+                frontends, 'Frontend/GetStatus', port=6547,
+                opts={'timeout': 2}, deadline=5):
+            ...
+
+    INPUT:
+    ======
+
+    hosts:       An iterable of host names, (host, port) tuples or Send()
+                 objects. A Send() keeps its session (and anything warm()
+                 did) between calls. Each item is yielded back as host, as
+                 passed.
+
+    endpoint:    The same as for send(), also rest and opts. opts['timeout']
+    rest:        is the timeout for each host. opts is copied for each host.
+    opts:
+
+    port:        Used for items in hosts that are just a name.
+
+    deadline:    Optional, in seconds. The most time to wait for the whole
+                 sweep. Hosts that haven't answered by then are yielded with
+                 a 'Deadline...' error. Their requests carry on in the
+                 background until opts['timeout'] expires, but aren't
+                 waited for.
+
+    max_workers: Optional, the number of hosts contacted at once. Defaults
+                 to all of them.
+    """
+
+    backends = {}
+    for host in hosts:
+        if isinstance(host, api.Send):
+            backends[host] = host
+        elif isinstance(host, tuple):
+            backends[host] = api.Send(host=host[0], port=host[1])
+        else:
+            backends[host] = api.Send(host=host, port=port)
+
+    if not backends:
+        return
+
+    executor = ThreadPoolExecutor(max_workers=max_workers or len(backends))
+
+    futures = dict((executor.submit(_send, backend, endpoint, rest, opts),
+                    host) for host, backend in backends.items())
+
+    if deadline is not None:
+        deadline = time.time() + deadline
+
+    try:
+        for future in as_completed(futures, timeout=deadline and
+                                   max(0, deadline - time.time())):
+            response, error = future.result()
+            yield futures.pop(future), response, error
+    except FuturesTimeoutError:
+        for future, host in futures.items():
+            future.cancel()
+            LOG.debug('%s: no response before the deadline', host)
+            yield host, None, 'Deadline reached before {} answered' \
+                .format(backends[host].host)
+    finally:
+        executor.shutdown(wait=False)
+
+
+def fan_out(hosts, endpoint, rest='', opts=None, port=6544, deadline=None,
+            max_workers=None):
+    """
+    The same as iter_fan_out(), but waits for all hosts (or the deadline)
+    and returns a dict of: {host: {'response': ..., 'error': ...}}
+    """
+
+    return dict((host, {'response': response, 'error': error})
+                for host, response, error in iter_fan_out(
+                    hosts, endpoint, rest=rest, opts=opts, port=port,
+                    deadline=deadline, max_workers=max_workers))
+
+
+def _send(backend, endpoint, rest, opts):
+    """Returns (response, None) or (None, error) for one host."""
+
+    try:
+        return backend.send(endpoint=endpoint, rest=rest,
+                            opts=dict(opts or {})), None
+    except (RuntimeError, RuntimeWarning) as error:
+        return None, str(error)
+
+# vim: set expandtab tabstop=4 shiftwidth=4 smartindent noai colorcolumn=80:
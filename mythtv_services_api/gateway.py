@@ -0,0 +1,442 @@
+# -*- coding: utf-8 -*-
+
+"""Caching gateway, serving many clients from one set of connections."""
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+import logging
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from . import send as api
+from .passthrough import passthrough
+
+# pylint: disable=no-name-in-module, import-error
+if sys.version_info[0] == 2:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from Queue import Queue
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qsl
+elif sys.version_info[0] == 3:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from queue import Queue
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qsl
+else:
+    sys.exit('Unable to import http.server')
+# pylint: enable=no-name-in-module, import-error
+
+# Responses from these services are relayed, never cached.
+UNCACHED_SERVICES = ('Content',)
+
+LOG = logging.getLogger(__name__)
+logging.getLogger(__name__).addHandler(logging.NullHandler())
+
+
+class Gateway(object):
+    """
+    A small HTTP server with the same paths as the Services API, for many
+    clients (kiosks, scripts...) to use instead of the backend. GETs are
+    answered from a shared cache while fresh (max_age) and revalidated
+    with the backend's ETag after that. Requests for the same URL that
+    arrive while it's being fetched wait for that one fetch. At most
+    max_upstream requests are sent to the backend at once, each over one
+    of max_upstream kept alive sessions.
+
+    POSTs are refused (403) unless allow_writes is True. Then they're
+    passed through with the gateway's opts (so opts['wrmi'] must be True,
+    as for send()) and the whole cache is cleared, as a write can change
+    the results of any service. Any client that can reach the gateway
+    writes with its user and pass, which is why it only listens on
+    127.0.0.1 unless told otherwise. Content/ (files, recordings, images)
+    is never cached, but streamed to the client as it arrives, see
+    stream().
+
+    Bodies are cached and, if the client accepts it, sent as compressed by
+    the backend. Clients get ETag: and 304 responses too.
+
+    EXAMPLE:
+    ========
+
+        import mythtv_services_api.send as send
+        from mythtv_services_api.gateway import Gateway
+
+        backend = send.Send(host='someName')
+        gateway = Gateway(backend, max_age=10)
+        gateway.serve(host='', port=6544)
+
+    and then send.Send(host='gatewayHost') in the clients.
+    """
+
+    def __init__(self, backend, max_age=5, max_upstream=4, max_entries=1000,
+                 opts=None, allow_writes=False):
+        """
+        INPUT:
+        ======
+
+        backend:      A send.Send() object. Only its host and port are used.
+
+        max_age:      Seconds a response is served from the cache without
+                      asking the backend. Defaults to 5.
+
+        max_upstream: The most requests sent to the backend at once, and
+                      the number of sessions kept. Defaults to 4.
+
+        max_entries:  The most responses cached. The least recently used
+                      are dropped 1st. Defaults to 1000.
+
+        opts:         Only user, pass, timeout and wrmi are used, for the
+                      requests to the backend.
+
+        allow_writes: If True, POSTs are passed through. Defaults to
+                      False.
+        """
+
+        if not isinstance(backend, api.Send):
+            raise RuntimeError('usage: backend must be a Send() object')
+
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self.allow_writes = allow_writes
+        self.opts = dict((key, value) for key, value in (opts or {}).items()
+                         if key in ('user', 'pass', 'timeout', 'wrmi'))
+        self.cache = OrderedDict()
+        self.stats = {'hits': 0, 'misses': 0, 'revalidated': 0,
+                      'coalesced': 0, 'writes': 0, 'streamed': 0,
+                      'errors': 0}
+        self.server = None
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._pool = Queue()
+
+        for _ in range(max_upstream):
+            self._pool.put(api.Send(host=backend.host, port=backend.port))
+
+    def serve(self, host='127.0.0.1', port=6544):
+        """
+        Serve until stop() is called (e.g. from another thread.) Use
+        host='' for all interfaces.
+        """
+
+        self.server = _Server((host, port), self)
+
+        LOG.debug('Gateway listening on %s:%s', host, port)
+
+        self.server.serve_forever()
+
+    def start(self, host='127.0.0.1', port=6544):
+        """serve() in a background thread. Returns the thread."""
+
+        thread = threading.Thread(target=self.serve, args=(host, port))
+        thread.daemon = True
+        thread.start()
+
+        while self.server is None and thread.is_alive():
+            time.sleep(0.01)
+
+        return thread
+
+    def stop(self):
+        """Stop serving."""
+
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def count(self, name):
+        """Add one to stats[name]."""
+
+        with self._lock:
+            self.stats[name] += 1
+
+    def clear(self):
+        """Forget all cached responses."""
+
+        with self._lock:
+            self.cache.clear()
+
+    def get(self, endpoint, rest='', usexml=False):
+        """
+        Return the cached response for a GET (see passthrough() for what's
+        in it) fetching or revalidating it only if needed. Not for
+        UNCACHED_SERVICES, see stream().
+        """
+
+        key = (endpoint, rest, usexml)
+
+        if endpoint.split('/')[0] in UNCACHED_SERVICES:
+            raise RuntimeError('usage: {} responses aren\'t cached, use '
+                               'stream()'.format(endpoint))
+
+        while True:
+            with self._lock:
+                entry = self.cache.get(key)
+                if entry and time.time() - entry['time'] < self.max_age:
+                    self.stats['hits'] += 1
+                    self.cache.pop(key)
+                    self.cache[key] = entry
+                    return entry
+                event = self._inflight.get(key)
+                leader = event is None
+                if leader:
+                    event = self._inflight[key] = threading.Event()
+
+            if not leader:
+                event.wait()
+                with self._lock:
+                    self.stats['coalesced'] += 1
+                    if key in self.cache:
+                        return self.cache[key]
+                # The fetch failed, try again.
+                continue
+
+            try:
+                return self._fetch(key, entry)
+            finally:
+                with self._lock:
+                    del self._inflight[key]
+                event.set()
+
+    def stream(self, endpoint, sink, on_headers, rest='', usexml=False,
+               compressed=True):
+        """
+        Pass a GET through without caching it, writing the body to sink in
+        chunks as it arrives, so big files aren't held in memory. See
+        passthrough() for on_headers and compressed.
+        """
+
+        backend = self._pool.get()
+
+        try:
+            return passthrough(backend, endpoint, rest=rest,
+                               opts=dict(self.opts, usexml=usexml),
+                               sink=sink, compressed=compressed,
+                               on_headers=on_headers)
+        finally:
+            self._pool.put(backend)
+            with self._lock:
+                self.stats['streamed'] += 1
+
+    def post(self, endpoint, postdata, usexml=False):
+        """
+        Pass a write through, then clear the cache. A RuntimeError unless
+        allow_writes is True.
+        """
+
+        if not self.allow_writes:
+            raise RuntimeError('usage: writes need Gateway(allow_writes=True)')
+
+        backend = self._pool.get()
+
+        try:
+            response = passthrough(backend, endpoint, postdata=postdata,
+                                   opts=dict(self.opts, usexml=usexml),
+                                   compressed=True)
+        finally:
+            self._pool.put(backend)
+            with self._lock:
+                self.stats['writes'] += 1
+                self.cache.clear()
+
+        return response
+
+    def _fetch(self, key, stale=None):
+        """Get (or revalidate) one response from the backend."""
+
+        endpoint, rest, usexml = key
+        opts = dict(self.opts, usexml=usexml)
+
+        if stale and stale['etag']:
+            opts['etag'] = stale['etag']
+
+        backend = self._pool.get()
+
+        try:
+            response = passthrough(backend, endpoint, rest=rest, opts=opts,
+                                   compressed=True)
+        finally:
+            self._pool.put(backend)
+
+        response['time'] = time.time()
+
+        with self._lock:
+            if response['status'] == 304 and stale:
+                self.stats['revalidated'] += 1
+                stale['time'] = response['time']
+                response = stale
+            else:
+                self.stats['misses'] += 1
+
+            self.cache.pop(key, None)
+            self.cache[key] = response
+            while len(self.cache) > self.max_entries:
+                self.cache.popitem(last=False)
+
+        return response
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    """A thread per client connection."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, gateway):
+        self.gateway = gateway
+        HTTPServer.__init__(self, address, _Handler)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Hands requests to the Gateway and writes its responses."""
+
+    protocol_version = 'HTTP/1.1'
+    server_header = None
+
+    def do_GET(self):
+        """Cached."""
+
+        parsed = urlparse(self.path)
+        endpoint = parsed.path.strip('/')
+
+        if endpoint.split('/')[0] in UNCACHED_SERVICES:
+            self._stream(endpoint, parsed.query)
+            return
+
+        self._respond(lambda gateway: gateway.get(
+            endpoint, rest=parsed.query, usexml=self._usexml()))
+
+    def do_POST(self):
+        """Passed through, if the gateway allows writes."""
+
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode('utf-8')
+
+        if not self.server.gateway.allow_writes:
+            self._send(403, b'This gateway is read only',
+                       {'Content-Type': 'text/plain; charset=utf-8'})
+            return
+
+        postdata = dict(parse_qsl(body, keep_blank_values=True))
+
+        self._respond(lambda gateway: gateway.post(
+            urlparse(self.path).path.strip('/'), postdata,
+            usexml=self._usexml()))
+
+    def log_message(self, format, *args):
+        # pylint: disable=redefined-builtin
+        LOG.debug('%s ' + format, self.address_string(), *args)
+
+    def version_string(self):
+        """Clients check the backend's Server: header, so pass it on."""
+
+        return self.server_header or BaseHTTPRequestHandler.version_string(
+            self)
+
+    def _usexml(self):
+        """The backend's default is XML, unless JSON is asked for."""
+
+        return 'json' not in (self.headers.get('Accept') or '')
+
+    def _respond(self, function):
+        """Call function(gateway) and send what it returns, or the error."""
+
+        try:
+            response = function(self.server.gateway)
+        except (RuntimeError, RuntimeWarning) as error:
+            self._error(error)
+            return
+
+        headers = {'Server': response['server'],
+                   'Content-Type': response['content_type'],
+                   'ETag': response['etag']}
+
+        if response['etag'] and \
+                self.headers.get('If-None-Match') == response['etag']:
+            self._send(304, b'', headers)
+            return
+
+        body = response['body']
+        encoding = response['content_encoding']
+
+        if encoding and encoding not in \
+                (self.headers.get('Accept-Encoding') or ''):
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS
+                                   if encoding == 'gzip' else zlib.MAX_WBITS)
+            encoding = None
+
+        headers['Content-Encoding'] = encoding
+
+        self._send(response['status'], body, headers)
+
+    def _stream(self, endpoint, rest):
+        """
+        Send the headers as soon as they arrive, then the body in chunks.
+        If the backend didn't send Content-Length:, the end of the body is
+        marked by closing the connection.
+        """
+
+        started = []
+
+        def on_headers(response):
+            """Before the 1st chunk is written."""
+            headers = {'Server': response['server'],
+                       'Content-Type': response['content_type'],
+                       'Content-Encoding': response['content_encoding'],
+                       'ETag': response['etag'],
+                       'Content-Length': response['content_length']}
+            if response['content_length'] is None:
+                headers['Connection'] = 'close'
+                self.close_connection = True
+            self._send_headers(response['status'], headers)
+            started.append(True)
+
+        try:
+            self.server.gateway.stream(
+                endpoint, self.wfile, on_headers, rest=rest,
+                usexml=self._usexml(),
+                compressed='gzip' in (self.headers.get('Accept-Encoding') or
+                                      ''))
+        except (RuntimeError, RuntimeWarning) as error:
+            if not started:
+                self._error(error)
+                return
+            # Too late for an error response, the client sees it end early.
+            LOG.debug('%s: %s', endpoint, error)
+            self.close_connection = True
+
+    def _error(self, error):
+        """Count error and send it, with the backend's status if any."""
+
+        self.server.gateway.count('errors')
+
+        if isinstance(error, api.ServicesError):
+            self._send(error.status or 502,
+                       (error.description or str(error)).encode('utf-8'),
+                       {'Content-Type': 'text/plain; charset=utf-8'})
+        else:
+            self._send(502, str(error).encode('utf-8'),
+                       {'Content-Type': 'text/plain; charset=utf-8'})
+
+    def _send(self, status, body, headers):
+        """Write a response, leaving out headers that are None."""
+
+        headers['Content-Length'] = str(len(body))
+        self._send_headers(status, headers)
+        self.wfile.write(body)
+
+    def _send_headers(self, status, headers):
+        """Write the status and headers, leaving out those that are None."""
+
+        self.server_header = headers.pop('Server', None)
+        self.send_response(status)
+        for header, value in headers.items():
+            if value is not None:
+                self.send_header(header, value)
+        self.end_headers()
+
+# vim: set expandtab tabstop=4 shiftwidth=4 smartindent noai colorcolumn=80:
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+
+"""Tile cache for Guide/GetProgramGuide."""
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+import calendar
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from concurrent.futures import ThreadPoolExecutor
+
+from . import send as api
+
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+LOG = logging.getLogger(__name__)
+logging.getLogger(__name__).addHandler(logging.NullHandler())
+
+
+def _to_seconds(value):
+    """A UTC timestamp string (with or without the Z) or datetime."""
+
+    if isinstance(value, datetime):
+        return calendar.timegm(value.timetuple())
+
+    try:
+        return calendar.timegm(time.strptime(value.replace('Z', ''),
+                                             TIME_FORMAT[:-1]))
+    except (AttributeError, ValueError):
+        raise RuntimeError('Invalid UTC time: {}, use: {}'
+                           .format(value, TIME_FORMAT))
+
+
+def _to_string(seconds):
+    """The format the backend uses."""
+
+    return time.strftime(TIME_FORMAT, time.gmtime(seconds))
+
+
+class GuideCache(object):
+    """
+    Answer Guide/GetProgramGuide requests for any time window from fixed
+    size tiles, e.g. 2 hours of one channel group each.
+
+    Only tiles that are missing or older than max_age are fetched, all at
+    once. The tiles are then stitched into the same structure the backend
+    returns, holding only programs that overlap the window. Optionally, the
+    tiles next to the window are fetched in the background so scrolling
+    the guide finds them ready.
+
+    EXAMPLE:
+    ========
+
+        import mythtv_services_api.send as send
+        from mythtv_services_api.guidecache import GuideCache
+
+        backend = send.Send(host='someName')
+        guide = GuideCache(backend)
+
+        response = guide.get('2019-01-01T18:00:00Z', '2019-01-01T21:30:00Z',
+                             channel_group_id=1, prefetch=1)
+        for channel in response['ProgramGuide']['Channels']:
+            ...
+    """
+
+    def __init__(self, backend, tile_hours=2, max_age=3600, details=False,
+                 opts=None, max_workers=4, max_tiles=500):
+        """
+        INPUT:
+        ======
+
+        backend:     A send.Send() object. Only its host and port are used,
+                     each worker thread gets its own Send().
+
+        tile_hours:  The length of each tile. Tiles start on multiples of
+                     this many hours since the epoch (UTC.) Defaults to 2.
+
+        max_age:     Seconds before a tile is fetched again. Defaults to
+                     3600.
+
+        details:     Passed to the backend as Details=true|false.
+
+        opts:        The same as for send().
+
+        max_workers: The most tiles fetched at once. Defaults to 4.
+
+        max_tiles:   The most tiles cached. The least recently used are
+                     dropped 1st. Defaults to 500.
+        """
+
+        if not isinstance(backend, api.Send):
+            raise RuntimeError('usage: backend must be a Send() object')
+
+        self.host = backend.host
+        self.port = backend.port
+        self.tile_seconds = int(tile_hours * 3600)
+        self.max_age = max_age
+        self.max_tiles = max_tiles
+        self.details = details
+        self.opts = dict(opts or {})
+        # (channel group, tile start): (time fetched, ProgramGuide), the
+        # least recently used 1st.
+        self.tiles = OrderedDict()
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def get(self, start, end, channel_group_id=None, prefetch=0):
+        """
+        Return {'ProgramGuide': {'StartTime': start, 'EndTime': end,
+        'Channels': [...]}} for the window, each channel with the Programs
+        that overlap it.
+
+        start/end: UTC times, either strings like 2019-01-01T18:00:00Z or
+                   datetimes (naive, in UTC.)
+
+        channel_group_id: Passed to the backend as ChannelGroupId.
+
+        prefetch:  The number of tiles before and after the window to fetch
+                   in the background.
+        """
+
+        start = _to_seconds(start)
+        end = _to_seconds(end)
+
+        if end <= start:
+            raise RuntimeError('usage: end must be after start')
+
+        first = start - start % self.tile_seconds
+        wanted = list(range(first, end, self.tile_seconds))
+
+        futures = [self._tile(channel_group_id, tile_start)
+                   for tile_start in wanted]
+        guides = [future.result() for future in futures]
+
+        for count in range(1, prefetch + 1):
+            self._tile(channel_group_id, first - count * self.tile_seconds)
+            self._tile(channel_group_id,
+                       wanted[-1] + count * self.tile_seconds)
+
+        return {'ProgramGuide': {'StartTime': _to_string(start),
+                                 'EndTime': _to_string(end),
+                                 'Channels': self._stitch(guides, start,
+                                                          end)}}
+
+    def clear(self):
+        """Forget all tiles."""
+
+        with self._lock:
+            self.tiles.clear()
+
+    def close(self):
+        """Stop the worker threads."""
+
+        self._executor.shutdown(wait=False)
+
+    def _tile(self, channel_group_id, tile_start):
+        """Return a future for a tile, submitting a fetch only if needed."""
+
+        key = (channel_group_id, tile_start)
+
+        with self._lock:
+            if key in self._inflight:
+                return self._inflight[key]
+
+            cached = self.tiles.get(key)
+            if cached and time.time() - cached[0] < self.max_age:
+                self.tiles.pop(key)
+                self.tiles[key] = cached
+                future = _Done(cached[1])
+            else:
+                future = self._executor.submit(self._fetch, key)
+                self._inflight[key] = future
+
+        return future
+
+    def _fetch(self, key):
+        """Get one tile from the backend and cache it."""
+
+        channel_group_id, tile_start = key
+
+        backend = api.local_send(self._local, self.host, self.port)
+
+        rest = 'StartTime={}&EndTime={}&Details={}'.format(
+            _to_string(tile_start), _to_string(tile_start + self.tile_seconds),
+            'true' if self.details else 'false')
+        if channel_group_id is not None:
+            rest += '&ChannelGroupId={}'.format(channel_group_id)
+
+        try:
+            guide = backend.send(endpoint='Guide/GetProgramGuide', rest=rest,
+                                 opts=dict(self.opts))['ProgramGuide']
+            LOG.debug('Fetched guide tile %s', rest)
+            with self._lock:
+                self.tiles.pop(key, None)
+                self.tiles[key] = (time.time(), guide)
+                while len(self.tiles) > self.max_tiles:
+                    self.tiles.popitem(last=False)
+        except (KeyError, TypeError):
+            raise RuntimeError('Unexpected Guide/GetProgramGuide response')
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+        return guide
+
+    @staticmethod
+    def _stitch(guides, start, end):
+        """
+        Merge the channels from each tile, keeping one copy of programs
+        that span tiles and only those that overlap the window.
+        """
+
+        start = _to_string(start)
+        end = _to_string(end)
+        channels = []
+        programs = {}
+
+        for guide in guides:
+            for channel in guide.get('Channels') or []:
+                chan_id = channel.get('ChanId')
+                if chan_id not in programs:
+                    merged = dict(channel)
+                    merged.pop('Programs', None)
+                    channels.append(merged)
+                    programs[chan_id] = {}
+                for program in channel.get('Programs') or []:
+                    if program.get('EndTime', '') > start and \
+                            program.get('StartTime', '') < end:
+                        programs[chan_id][program.get('StartTime')] = program
+
+        for channel in channels:
+            found = programs[channel.get('ChanId')]
+            channel['Programs'] = [found[key] for key in sorted(found)]
+
+        return channels
+
+
+class _Done(object):
+    """A future for a tile that was already cached."""
+
+    def __init__(self, guide):
+        self.guide = guide
+
+    def result(self):
+        """The same as Future.result()."""
+        return self.guide
+
+# vim: set expandtab tabstop=4 shiftwidth=4 smartindent noai colorcolumn=80:
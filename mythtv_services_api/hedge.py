@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+
+"""Hedged reads across backends that can answer the same requests."""
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from . import send as api
+from .stats import percentile
+
+# pylint: disable=no-name-in-module, import-error
+if sys.version_info[0] == 2:
+    from Queue import Queue, Empty
+elif sys.version_info[0] == 3:
+    from queue import Queue, Empty
+else:
+    sys.exit('Unable to import Queue')
+# pylint: enable=no-name-in-module, import-error
+
+# Endpoints (or prefixes ending in /) that any of the backends can answer.
+HEDGED_ENDPOINTS = ('Myth/GetHostName', 'Content/GetPreviewImage', 'Guide/')
+
+IMAGE_FILE = re.compile(r'Image file = "(.*)"')
+
+LOG = logging.getLogger(__name__)
+logging.getLogger(__name__).addHandler(logging.NullHandler())
+
+
+class Hedged(object):
+    """
+    Send reads to a primary backend and, if it hasn't answered within a
+    delay (by default, the 95th percentile of its recent response times),
+    send the same GET to the next backend too. The 1st good answer wins.
+    An error from a backend is hedged at once, rather than after the delay.
+
+    Requests can't be stopped once they've been sent, so the losers are
+    abandoned: nothing waits for them, their results are dropped (and
+    temporary image files from Content/GetPreviewImage deleted) and each
+    ends by opts['timeout'] at the latest.
+
+    Only GETs to endpoints in endpoints are hedged. Everything else, and
+    all postdata, goes to the primary, as with send().
+
+    stats counts requests, hedged (requests sent to a 2nd backend),
+    primary_wins, alternate_wins, errors and abandoned. See metrics().
+
+    EXAMPLE:
+    ========
+
+        from mythtv_services_api.hedge import Hedged
+
+        backends = Hedged('master', ['slave1', ('slave2', 6544)])
+        backends.send(endpoint='Guide/GetProgramGuide', rest='...')
+        print(backends.metrics())
+    """
+
+    def __init__(self, primary, alternates, port=6544, delay=None,
+                 fraction=0.95, initial_delay=0.5, min_delay=0.01,
+                 window=100, endpoints=HEDGED_ENDPOINTS, max_workers=8):
+        """
+        INPUT:
+        ======
+
+        primary:       A host name, (host, port) tuple or Send() object,
+        alternates:    and a list of them, tried in order. Only the host
+                       and port of a Send() are used.
+
+        port:          Used for hosts that are just a name.
+
+        delay:         Optional, a fixed hedging delay in seconds.
+
+        fraction:      Otherwise, the delay is this percentile of the
+                       primary's last window response times, but at least
+                       min_delay. initial_delay is used until there are 10.
+
+        endpoints:     Those that are hedged, see HEDGED_ENDPOINTS.
+
+        max_workers:   The most requests in flight, to all backends.
+        """
+
+        self.hosts = [_host_port(host, port)
+                      for host in [primary] + list(alternates)]
+        self.delay = delay
+        self.fraction = fraction
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.endpoints = tuple(endpoints)
+        self.stats = {'requests': 0, 'hedged': 0, 'primary_wins': 0,
+                      'alternate_wins': 0, 'errors': 0, 'abandoned': 0}
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._pools = dict((host, Queue()) for host in self.hosts)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def send(self, endpoint='', postdata=None, rest='', opts=None):
+        """
+        The same as send.Send.send(), hedged if endpoint is. RuntimeWarnings
+        (e.g. for images, or 304) are answers and are raised as send()
+        would. If every backend fails, the last error is raised.
+        """
+
+        with self._lock:
+            self.stats['requests'] += 1
+
+        if postdata or not self.hedged(endpoint):
+            return self._send(0, endpoint, postdata, rest, opts)[1]
+
+        pending = set([self._submit(0, endpoint, rest, opts)])
+        sent = 1
+        error = None
+
+        while pending:
+            done, pending = wait(
+                pending, return_when=FIRST_COMPLETED,
+                timeout=self.hedge_delay() if sent < len(self.hosts)
+                else None)
+
+            for future in done:
+                try:
+                    index, response = future.result()
+                except RuntimeError as err:
+                    error = err
+                    continue
+                self._finish(index, pending)
+                if isinstance(response, RuntimeWarning):
+                    raise response
+                return response
+
+            if sent < len(self.hosts):
+                if sent == 1:
+                    with self._lock:
+                        self.stats['hedged'] += 1
+                LOG.debug('Hedging %s to %s', endpoint, self.hosts[sent])
+                pending.add(self._submit(sent, endpoint, rest, opts))
+                sent += 1
+
+        with self._lock:
+            self.stats['errors'] += 1
+
+        raise error
+
+    def hedged(self, endpoint):
+        """True if endpoint is one of (or under one of) endpoints."""
+
+        return any(endpoint == hedged or
+                   (hedged.endswith('/') and endpoint.startswith(hedged))
+                   for hedged in self.endpoints)
+
+    def hedge_delay(self):
+        """Seconds to wait for the primary before hedging."""
+
+        if self.delay is not None:
+            return self.delay
+
+        with self._lock:
+            latencies = sorted(self._latencies)
+
+        if len(latencies) < 10:
+            return self.initial_delay
+
+        return max(self.min_delay, percentile(latencies, self.fraction))
+
+    def metrics(self):
+        """stats, plus hedge_rate and alternate_win_rate (of those hedged.)"""
+
+        with self._lock:
+            stats = dict(self.stats)
+
+        stats['hedge_rate'] = stats['hedged'] / float(stats['requests']) \
+            if stats['requests'] else 0.0
+        stats['alternate_win_rate'] = stats['alternate_wins'] / \
+            float(stats['hedged']) if stats['hedged'] else 0.0
+        stats['hedge_delay'] = self.hedge_delay()
+
+        return stats
+
+    def close(self):
+        """Stop the worker threads, once abandoned requests end."""
+
+        self._executor.shutdown(wait=False)
+
+    def _submit(self, index, endpoint, rest, opts):
+        """Send in a worker."""
+
+        return self._executor.submit(self._send, index, endpoint, None, rest,
+                                     opts, True)
+
+    def _send(self, index, endpoint, postdata, rest, opts, answer=False):
+        """
+        Send to self.hosts[index] with a pooled Send(). Returns (index,
+        response). If answer is True, RuntimeWarnings are returned as the
+        response rather than raised.
+        """
+
+        host = self.hosts[index]
+
+        try:
+            backend = self._pools[host].get_nowait()
+        except Empty:
+            backend = api.Send(host=host[0], port=host[1])
+
+        start = time.time()
+
+        try:
+            response = backend.send(endpoint=endpoint, postdata=postdata,
+                                    rest=rest, opts=dict(opts or {}))
+        except RuntimeWarning as warning:
+            if not answer:
+                raise
+            response = warning
+        finally:
+            if index == 0:
+                with self._lock:
+                    self._latencies.append(time.time() - start)
+            self._pools[host].put(backend)
+
+        return index, response
+
+    def _finish(self, index, pending):
+        """Count the winner, abandon the rest."""
+
+        with self._lock:
+            self.stats['primary_wins' if index == 0
+                       else 'alternate_wins'] += 1
+            self.stats['abandoned'] += len(pending)
+
+        for future in pending:
+            if not future.cancel():
+                future.add_done_callback(_discard)
+
+
+def _discard(future):
+    """Drop an abandoned result, deleting any image file it made."""
+
+    try:
+        _, response = future.result()
+    except RuntimeError:
+        return
+
+    if isinstance(response, RuntimeWarning):
+        found = IMAGE_FILE.search(str(response))
+        if found:
+            try:
+                os.remove(found.group(1))
+            except OSError:
+                pass
+
+
+def _host_port(host, port):
+    """(host, port) from a name, tuple or Send()."""
+
+    if isinstance(host, api.Send):
+        return host.host, host.port
+
+    if isinstance(host, tuple):
+        return host
+
+    return host, port
+
+# vim: set expandtab tabstop=4 shiftwidth=4 smartindent noai colorcolumn=80:
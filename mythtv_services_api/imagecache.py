@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+
+"""Size-capped on-disk cache for artwork and preview images."""
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+import errno
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from . import send as api
+
+# pylint: disable=no-name-in-module, import-error
+if sys.version_info[0] == 2:
+    from urlparse import parse_qsl
+elif sys.version_info[0] == 3:
+    from urllib.parse import parse_qsl
+else:
+    sys.exit('Unable to import urllib')
+# pylint: enable=no-name-in-module, import-error
+
+# Images being written: key.pid.thread.tmp, see _fetch().
+TEMPORARY = re.compile(r'^[0-9a-f]{40}\.(\d+)\.\d+\.tmp$')
+
+LOG = logging.getLogger(__name__)
+logging.getLogger(__name__).addHandler(logging.NullHandler())
+
+
+class ImageCache(object):
+    """
+    Keep the images returned by Content/GetPreviewImage,
+    Content/GetRecordingArtwork, Content/GetImageFile etc. in a directory.
+
+    Files are named by a hash of the host, port, endpoint and the rest
+    parameters (in any order), so the same request always maps to the same
+    file. A cached file younger than max_age seconds is returned without
+    contacting the server. An older one is revalidated with its ETag or
+    Last-Modified value and only downloaded again if it changed. When the
+    files add up to more than max_bytes, the least recently used ones are
+    deleted. Concurrent requests for the same image cause a single fetch.
+
+    EXAMPLE:
+    ========
+
+        import mythtv_services_api.send as send
+        from mythtv_services_api.imagecache import ImageCache
+
+        backend = send.Send(host='someName')
+        cache = ImageCache(backend, '/var/cache/mythweb/images')
+
+        path = cache.get('Content/GetPreviewImage',
+                         rest='RecordedId=1234&Width=320')
+
+    The returned path belongs to the cache. Callers must not delete it (it
+    may be evicted at any time, so copy or open it right away.)
+    """
+
+    def __init__(self, backend, directory, max_bytes=256 * 1024 * 1024,
+                 max_age=3600):
+        """
+        INPUT:
+        ======
+
+        backend:   A send.Send() object. Only its host and port are used,
+                   each thread gets its own Send().
+
+        directory: Where to keep the images. Created if needed. Files found
+                   there from an earlier run are used.
+
+        max_bytes: The most space the images may use. Defaults to 256MiB.
+
+        max_age:   Seconds before a cached image is revalidated. Defaults to
+                   3600. Use 0 to revalidate every time.
+        """
+
+        if not isinstance(backend, api.Send):
+            raise RuntimeError('usage: backend must be a Send() object')
+
+        self.host = backend.host
+        self.port = backend.port
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        # key: metadata, least recently used first.
+        self._index = OrderedDict()
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._local = threading.local()
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self._load_index()
+
+    def key(self, endpoint, rest=''):
+        """The cache key (also the file name, less extension) of a request."""
+
+        params = '&'.join('{}={}'.format(name, value) for name, value in
+                          sorted(parse_qsl(rest or '',
+                                           keep_blank_values=True)))
+
+        return hashlib.sha1('{}:{}/{}?{}'.format(
+            self.host, self.port, endpoint, params).encode('utf-8')) \
+            .hexdigest()
+
+    def get(self, endpoint, rest='', opts=None):
+        """
+        Return the path of the cached image for this request, fetching or
+        revalidating it if needed. Errors from the server are raised as
+        RuntimeErrors, just like send().
+        """
+
+        key = self.key(endpoint, rest)
+        started = time.time()
+
+        while True:
+            with self._lock:
+                meta = self._index.get(key)
+                if meta is not None and \
+                        (time.time() - meta['fetched'] < self.max_age or
+                         meta['fetched'] >= started):
+                    self._touch(key)
+                    self.hits += 1
+                    return os.path.join(self.directory, meta['file'])
+
+                event = self._inflight.get(key)
+                if event is None:
+                    event = self._inflight[key] = threading.Event()
+                    break
+
+            # Someone else is fetching it, use their result.
+            event.wait()
+
+        try:
+            return self._fetch(key, meta, endpoint, rest, opts)
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            event.set()
+
+    def clear(self):
+        """Delete every cached image."""
+
+        with self._lock:
+            for key in list(self._index):
+                self._remove(key)
+
+    def _fetch(self, key, meta, endpoint, rest, opts):
+        """Get or revalidate one image, store it and evict as needed."""
+
+        backend = api.local_send(self._local, self.host, self.port)
+
+        url = backend.prepare(endpoint, rest=rest, opts=opts)
+
+        headers = {}
+        if meta is not None:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+
+        response = backend.request(url, headers=headers, stream=True,
+                                   allowed=(304,))
+
+        if response.status_code == 304:
+            response.close()
+            LOG.debug('%s unchanged', url)
+            with self._lock:
+                if key not in self._index:
+                    # Evicted while revalidating.
+                    meta = None
+            if meta is None:
+                return self._fetch(key, None, endpoint, rest, opts)
+            with self._lock:
+                meta['fetched'] = time.time()
+                self._save_meta(key, meta)
+                self._touch(key)
+                self.hits += 1
+            return os.path.join(self.directory, meta['file'])
+
+        extension = response.headers.get('Content-Type', '').split(';')[0] \
+            .split('/')[-1].strip()
+        if not extension.isalnum() or extension == 'meta':
+            extension = 'bin'
+        name = '{}.{}'.format(key, extension)
+
+        temp_name, size = self._write(key, response, url)
+
+        with self._lock:
+            if key in self._index:
+                self._remove(key)
+            try:
+                os.rename(temp_name, os.path.join(self.directory, name))
+            except OSError as error:
+                _remove_temporary(temp_name)
+                raise RuntimeError('Unable to cache {}: {}'.format(url,
+                                                                   error))
+            self._index[key] = {'file': name, 'size': size,
+                                'fetched': time.time(),
+                                'etag': response.headers.get('ETag'),
+                                'last_modified':
+                                response.headers.get('Last-Modified')}
+            self._save_meta(key, self._index[key])
+            self.size += size
+            self.misses += 1
+            self._evict(keep=key)
+
+        return os.path.join(self.directory, name)
+
+    def _write(self, key, response, url):
+        """
+        Write the response to a temporary file, to be renamed by the
+        caller, other processes may be reading. Returns its name and size.
+        """
+
+        temp_name = os.path.join(self.directory, '{}.{}.{}.tmp'.format(
+            key, os.getpid(), threading.current_thread().ident))
+        size = 0
+
+        try:
+            with open(temp_name, 'wb') as f_obj:
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    f_obj.write(chunk)
+                    size += len(chunk)
+        except (IOError, OSError) as error:
+            _remove_temporary(temp_name)
+            raise RuntimeError('Unable to cache {}: {}'.format(url, error))
+        finally:
+            response.close()
+
+        return temp_name, size
+
+    def _touch(self, key):
+        """Mark key most recently used. Hold the lock."""
+
+        self._index[key] = self._index.pop(key)
+        try:
+            os.utime(os.path.join(self.directory, key + '.meta'), None)
+        except OSError:
+            pass
+
+    def _evict(self, keep):
+        """Delete the least recently used images. Hold the lock."""
+
+        for key in list(self._index):
+            if self.size <= self.max_bytes:
+                break
+            if key != keep:
+                LOG.debug('Evicting %s', self._index[key]['file'])
+                self._remove(key)
+
+    def _remove(self, key):
+        """Delete an image and its metadata. Hold the lock."""
+
+        meta = self._index.pop(key)
+        self.size -= meta['size']
+        for name in (meta['file'], key + '.meta'):
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+    def _save_meta(self, key, meta):
+        """Keep the metadata next to the image, for the next run."""
+
+        with open(os.path.join(self.directory, key + '.meta'), 'w') as f_obj:
+            json.dump(meta, f_obj)
+
+    def _load_index(self):
+        """Rebuild the index from the directory, by last use."""
+
+        entries = []
+
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            match = TEMPORARY.match(name)
+            if match:
+                # Left behind by a process that's gone, others may still
+                # be writing theirs.
+                if not _running(int(match.group(1))):
+                    _remove_temporary(path)
+                continue
+            if not name.endswith('.meta'):
+                continue
+            try:
+                with open(path) as f_obj:
+                    meta = json.load(f_obj)
+                meta['size'] = os.path.getsize(
+                    os.path.join(self.directory, meta['file']))
+                entries.append((os.path.getmtime(path), name[:-5], meta))
+            except (IOError, OSError, KeyError, ValueError) as error:
+                LOG.debug('Ignoring cache entry %s: %s', name, error)
+
+        for _, key, meta in sorted(entries, key=lambda entry: entry[0]):
+            self._index[key] = meta
+            self.size += meta['size']
+
+        self._evict(keep=None)
+
+
+def _running(pid):
+    """True if process pid exists (or if that can't be told.)"""
+
+    if os.name != 'posix':
+        return True
+
+    try:
+        os.kill(pid, 0)
+    except OSError as error:
+        return error.errno != errno.ESRCH
+
+    return True
+
+
+def _remove_temporary(path):
+    """Delete a temporary file, if it's still there."""
+
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+# vim: set expandtab tabstop=4 shiftwidth=4 smartindent noai colorcolumn=80:
@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+
+"""In-memory lookup indexes for channel lists and guide data."""
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+import bisect
+import logging
+
+from .columns import find_list
+from .utilities import to_int
+
+# Sorts after any character in a StartTime or callsign, for prefixes.
+HIGHEST = u'\uffff'
+
+LOG = logging.getLogger(__name__)
+logging.getLogger(__name__).addHandler(logging.NullHandler())
+
+
+class ChannelIndex(object):
+    """
+    Index the channels from Channel/GetChannelInfoList (or anything with a
+    list of channels) by ChanId, CallSign and ChanNum. Lookups are dict
+    lookups, and callsign prefixes are found with a binary search.
+
+    EXAMPLE:
+    ========
+
+        import mythtv_services_api.send as send
+        from mythtv_services_api.indexes import ChannelIndex
+
+        backend = send.Send(host='someName')
+        channels = ChannelIndex(backend.send(
+            endpoint='Channel/GetChannelInfoList', rest='Details=true'))
+
+        channels.get(1071)['CallSign']
+        channels.by_callsign('kabc')
+        channels.callsign_prefix('KA')
+    """
+
+    def __init__(self, response=None):
+        self.channels = {}
+        self._callsigns = {}
+        self._numbers = {}
+        self._sorted = []
+
+        if response is not None:
+            self.update(response)
+
+    def update(self, response):
+        """
+        Replace the indexed channels with those in a new response. Only the
+        channels that were added, removed or changed are re-indexed. Returns
+        the number of those.
+        """
+
+        fresh = {}
+        for channel in find_list(response):
+            chan_id = to_int(channel.get('ChanId'))
+            if chan_id is not None:
+                fresh[chan_id] = channel
+
+        changed = 0
+
+        for chan_id in set(self.channels) - set(fresh):
+            self._remove(chan_id)
+            changed += 1
+
+        for chan_id, channel in fresh.items():
+            if chan_id in self.channels:
+                if self.channels[chan_id] == channel:
+                    continue
+                self._remove(chan_id)
+            self._add(chan_id, channel)
+            changed += 1
+
+        LOG.debug('Channel index: %d channels, %d changed',
+                  len(self.channels), changed)
+
+        return changed
+
+    def get(self, chan_id):
+        """The channel with a ChanId, or None."""
+
+        return self.channels.get(to_int(chan_id))
+
+    def by_callsign(self, callsign):
+        """The channels with a CallSign (without regard to case.)"""
+
+        return [self.channels[chan_id] for chan_id
+                in sorted(self._callsigns.get(callsign.upper(), ()))]
+
+    def by_number(self, chan_num):
+        """The channels with a ChanNum, e.g. '7' or '7_1'."""
+
+        return [self.channels[chan_id] for chan_id
+                in sorted(self._numbers.get('{}'.format(chan_num), ()))]
+
+    def callsign_prefix(self, prefix):
+        """The channels whose CallSign starts with prefix, by CallSign."""
+
+        prefix = prefix.upper()
+        first = bisect.bisect_left(self._sorted, (prefix,))
+        last = bisect.bisect_left(self._sorted, (prefix + HIGHEST,))
+
+        return [self.channels[chan_id]
+                for _, chan_id in self._sorted[first:last]]
+
+    def __len__(self):
+        return len(self.channels)
+
+    def __contains__(self, chan_id):
+        return to_int(chan_id) in self.channels
+
+    def _add(self, chan_id, channel):
+        """Index one channel."""
+
+        callsign = (channel.get('CallSign') or '').upper()
+
+        self.channels[chan_id] = channel
+        self._callsigns.setdefault(callsign, set()).add(chan_id)
+        self._numbers.setdefault('{}'.format(channel.get('ChanNum')),
+                                 set()).add(chan_id)
+        bisect.insort(self._sorted, (callsign, chan_id))
+
+    def _remove(self, chan_id):
+        """Drop one channel from the indexes."""
+
+        channel = self.channels.pop(chan_id)
+        callsign = (channel.get('CallSign') or '').upper()
+
+        for index, key in ((self._callsigns, callsign),
+                           (self._numbers,
+                            '{}'.format(channel.get('ChanNum')))):
+            index[key].discard(chan_id)
+            if not index[key]:
+                del index[key]
+
+        del self._sorted[bisect.bisect_left(self._sorted,
+                                            (callsign, chan_id))]
+
+
+class ProgramIndex(object):
+    """
+    Index programs by (ChanId, StartTime), with a sorted array of start
+    times per channel for range, prefix and "what's on at" queries. Built
+    from Guide/GetProgramGuide (programs nested in channels) or any program
+    list response where each program has a Channel (Guide/GetProgramList,
+    Dvr/GetUpcomingList...)
+
+    Times are the backend's UTC strings, e.g. 2019-01-01T18:00:00Z, which
+    sort in time order. Prefixes like '2019-01-01T18' select an hour.
+
+    EXAMPLE:
+    ========
+
+        from mythtv_services_api.indexes import ProgramIndex
+
+        programs = ProgramIndex(guide_response)
+
+        programs.get(1071, '2019-01-01T18:00:00Z')
+        programs.at(1071, '2019-01-01T18:20:00Z')
+        programs.starting('2019-01-01T18:00:00Z', '2019-01-01T19:00:00Z')
+    """
+
+    def __init__(self, response=None):
+        # {chan id: (sorted start times, programs in the same order)}
+        self.channels = {}
+        # {chan id: {start time: program}}
+        self._lookup = {}
+        self._all = None
+
+        if response is not None:
+            self.update(response)
+
+    def update(self, response, replace=False):
+        """
+        Add the programs in a new response. Channels in it replace those
+        already indexed, and only the channels whose programs changed are
+        re-sorted. If replace is True, channels that aren't in the response
+        are dropped too. Returns the number of channels that changed.
+        """
+
+        fresh = {}
+        for chan_id, program in _programs(response):
+            if program.get('StartTime'):
+                fresh.setdefault(chan_id, {})[program['StartTime']] = program
+
+        changed = 0
+
+        if replace:
+            for chan_id in set(self.channels) - set(fresh):
+                del self.channels[chan_id]
+                del self._lookup[chan_id]
+                changed += 1
+
+        for chan_id, programs in fresh.items():
+            starts = sorted(programs)
+            entry = (starts, [programs[start] for start in starts])
+            if self.channels.get(chan_id) != entry:
+                self.channels[chan_id] = entry
+                self._lookup[chan_id] = programs
+                changed += 1
+
+        if changed:
+            self._all = None
+
+        LOG.debug('Program index: %d channels, %d changed',
+                  len(self.channels), changed)
+
+        return changed
+
+    def get(self, chan_id, start_time):
+        """The program on a channel starting at start_time, or None."""
+
+        return self._lookup.get(to_int(chan_id), {}).get(start_time)
+
+    def at(self, chan_id, when):
+        """The program on a channel at a time, or None."""
+
+        starts, programs = self.channels.get(to_int(chan_id), ((), ()))
+        where = bisect.bisect_right(starts, when) - 1
+
+        if where >= 0 and (programs[where].get('EndTime') or '') > when:
+            return programs[where]
+
+        return None
+
+    def on_channel(self, chan_id, start=None, end=None):
+        """A channel's programs starting from start up to (not incl.) end."""
+
+        starts, programs = self.channels.get(to_int(chan_id), ((), ()))
+
+        return programs[_slice(starts, start, end)]
+
+    def starting(self, start=None, end=None):
+        """All programs starting from start up to end, by StartTime."""
+
+        starts, programs = self._merged()
+
+        return programs[_slice(starts, start, end)]
+
+    def starting_with(self, prefix):
+        """All programs whose StartTime starts with prefix."""
+
+        return self.starting(prefix, prefix + HIGHEST)
+
+    def __len__(self):
+        return sum(len(starts) for starts, _ in self.channels.values())
+
+    def _merged(self):
+        """Every program by StartTime, rebuilt only after changes."""
+
+        if self._all is None:
+            merged = sorted((start, chan_id, index)
+                            for chan_id, (starts, _) in self.channels.items()
+                            for index, start in enumerate(starts))
+            self._all = ([start for start, _, _ in merged],
+                         [self.channels[chan_id][1][index]
+                          for _, chan_id, index in merged])
+
+        return self._all
+
+
+def _slice(starts, start, end):
+    """The slice of sorted starts from start up to end."""
+
+    return slice(0 if start is None else bisect.bisect_left(starts, start),
+                 len(starts) if end is None
+                 else bisect.bisect_left(starts, end))
+
+
+def _programs(response):
+    """Yield (ChanId, program) from a guide or a program list."""
+
+    try:
+        channels = response['ProgramGuide']['Channels']
+    except (KeyError, TypeError):
+        channels = None
+
+    if channels is not None:
+        for channel in channels:
+            chan_id = to_int(channel.get('ChanId'))
+            for program in channel.get('Programs') or []:
+                yield chan_id, program
+        return
+
+    for program in find_list(response):
+        yield to_int((program.get('Channel') or {}).get('ChanId')), program
+
+# vim: set expandtab tabstop=4 shiftwidth=4 smartindent noai colorcolumn=80:
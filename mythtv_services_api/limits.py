@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+"""Read response bodies without going past opts['max_bytes']."""
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+import sys
+import zlib
+
+try:
+    from requests.packages.urllib3.exceptions import HTTPError
+except ImportError:
+    sys.exit('Install python-requests or python3-requests')
+
+# Bytes read at a time when opts['max_bytes'] is set.
+LIMITED_CHUNK_SIZE = 64 * 1024
+
+
+class ResponseTooLarge(RuntimeError):
+    """
+    A RuntimeError raised when a response is bigger than opts['max_bytes'],
+    before more than that is read or decompressed. limit is max_bytes.
+    """
+
+    def __init__(self, message, limit=None):
+        super(ResponseTooLarge, self).__init__(message)
+        self.limit = limit
+
+
+def read_limited(response, limit, endpoint):
+    """
+    Read a streamed response's body, decompressing it here rather than
+    in urllib3 so that no more than limit bytes are received or produced.
+
+    INPUT:
+    ======
+
+    response: A requests response, from a request made with stream=True.
+
+    limit:    opts['max_bytes'].
+
+    endpoint: The endpoint that was sent, for the ResponseTooLarge message.
+
+    OUTPUT:
+    =======
+
+    The (decompressed) body, as bytes. A ResponseTooLarge is raised, and
+    the response closed, as soon as it's known to be bigger than limit.
+    """
+
+    length = response.headers.get('Content-Length', '')
+    if length.isdigit() and int(length) > limit:
+        response.close()
+        raise too_large(endpoint, limit, int(length))
+
+    if response.headers.get('Content-Encoding', '').lower() in \
+            ('gzip', 'deflate'):
+        # 32 + MAX_WBITS: either a gzip or a zlib header.
+        decompressor = zlib.decompressobj(32 + zlib.MAX_WBITS)
+    else:
+        decompressor = None
+
+    received = 0
+    chunks = []
+    size = 0
+
+    try:
+        for chunk in response.raw.stream(LIMITED_CHUNK_SIZE,
+                                         decode_content=False):
+            received += len(chunk)
+            if decompressor:
+                chunk = decompressor.decompress(chunk, limit - size + 1)
+                if decompressor.unconsumed_tail:
+                    raise too_large(endpoint, limit)
+            size += len(chunk)
+            if received > limit or size > limit:
+                raise too_large(endpoint, limit)
+            chunks.append(chunk)
+        if decompressor:
+            chunks.append(decompressor.flush())
+            if size + len(chunks[-1]) > limit:
+                raise too_large(endpoint, limit)
+    except (HTTPError, IOError, zlib.error) as error:
+        response.close()
+        raise RuntimeError('Error reading the response: {}'.format(error))
+    except ResponseTooLarge:
+        response.close()
+        raise
+
+    return b''.join(chunks)
+
+
+def text(response, body):
+    """
+    The response as text. body is what read_limited() returned, or None if
+    the response hasn't been read yet.
+    """
+
+    if body is None:
+        return response.text
+
+    try:
+        return body.decode(response.encoding, 'replace')
+    except LookupError:
+        return body.decode('UTF8', 'replace')
+
+
+def too_large(endpoint, limit, size=None):
+    """The exception for a response from endpoint bigger than limit."""
+
+    if endpoint.startswith('Guide/GetProgramGuide'):
+        hint = 'ask for a shorter StartTime to EndTime or a ChannelGroupId'
+    else:
+        hint = 'use paging, e.g. rest=\'StartIndex=0&Count=100\''
+
+    size = '({}) '.format(size) if size else ''
+
+    return ResponseTooLarge('Response {}larger than max_bytes ({}) from '
+                            '{}, {}'.format(size, limit, endpoint, hint),
+                            limit=limit)
+
+# vim: set expandtab tabstop=4 shiftwidth=4 smartindent noai colorcolumn=80:
@@ -0,0 +1,404 @@
+# -*- coding: utf-8 -*-
+
+"""Load generator and soak tester for back/frontends."""
+
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import argparse
+import bisect
+import json
+import logging
+import random
+import sys
+import threading
+import time
+
+from . import send as api
+from .stats import percentile
+
+# pylint: disable=no-name-in-module, import-error
+if sys.version_info[0] == 2:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+elif sys.version_info[0] == 3:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+else:
+    sys.exit('Unable to import http.server')
+# pylint: enable=no-name-in-module, import-error
+
+# (endpoint, rest, weight): read only endpoints, roughly what a frontend
+# and a few scripts ask for.
+DEFAULT_MIX = (('Myth/GetHostName', '', 2),
+               ('Dvr/GetRecordedList', 'Count=20', 4),
+               ('Dvr/GetUpcomingList', '', 2),
+               ('Dvr/GetEncoderList', '', 1),
+               ('Channel/GetChannelInfoList', 'Count=50', 1))
+
+LOG = logging.getLogger(__name__)
+logging.getLogger(__name__).addHandler(logging.NullHandler())
+
+
+def summarize(latencies, errors, seconds):
+    """The report for one interval, or the whole run."""
+
+    ordered = sorted(latencies)
+    count = len(ordered) + errors
+
+    return {'requests': count,
+            'errors': errors,
+            'error_rate': errors / count if count else 0.0,
+            'rps': count / seconds if seconds else 0.0,
+            'latency': dict((name, percentile(ordered, fraction))
+                            for name, fraction in (('p50', 0.5),
+                                                   ('p90', 0.9),
+                                                   ('p99', 0.99),
+                                                   ('max', 1.0)))}
+
+
+class LoadTest(object):
+    """
+    Replay a weighted mix of (read only) endpoints against a back/frontend
+    from concurrency threads, each with its own Send(), and measure what
+    it can take.
+
+    Without rps, each thread sends its next request as soon as the last
+    one is answered (a closed loop, for finding the most a backend can
+    serve.) With rps, requests are scheduled at that rate and latency is
+    measured from when each was due, so time spent waiting for a free
+    thread counts too (an open loop, for soak tests at a known load.)
+
+    EXAMPLE:
+    ========
+
+        from mythtv_services_api.loadtest import LoadTest
+
+        test = LoadTest('someName', concurrency=8, rps=50, duration=60)
+        report = test.run(progress=print)
+        print(report['latency']['p99'], report['error_rate'])
+
+    Or: python -m mythtv_services_api.loadtest --host someName --rps 50
+    """
+
+    def __init__(self, host, port=6544, mix=DEFAULT_MIX, concurrency=4,
+                 rps=None, duration=10, interval=1, opts=None):
+        """
+        INPUT:
+        ======
+
+        host:        The back/frontend, and port.
+        port:
+
+        mix:         (endpoint, rest, weight) tuples. Each request is one of
+                     them, chosen at random in proportion to weight.
+
+        concurrency: The number of threads (and connections.)
+
+        rps:         Optional, the target requests per second.
+
+        duration:    Seconds to run for.
+
+        interval:    Seconds per progress report.
+
+        opts:        The same as for send(). Copied for each request.
+        """
+
+        if not mix:
+            raise RuntimeError('usage: mix must have at least one endpoint')
+
+        self.host = host
+        self.port = port
+        self.mix = list(mix)
+        self.concurrency = concurrency
+        self.rps = rps
+        self.duration = duration
+        self.interval = interval
+        self.opts = opts
+        self._cumulative = []
+        total = 0
+        for _, _, weight in self.mix:
+            total += weight
+            self._cumulative.append(total)
+        self._lock = threading.Lock()
+        self._next = None
+        self._window = None
+        self._results = None
+
+    def run(self, progress=None):
+        """
+        Run the test and return a report: requests, errors, error_rate, rps
+        and latency (p50, p90, p99 and max, in seconds) for the whole run,
+        plus 'by_endpoint' with the same for each endpoint and 'intervals'
+        with one for each interval. progress, if set, is called with each
+        interval's report as the test runs.
+        """
+
+        start = time.time()
+        stop = start + self.duration
+        self._next = start
+        # Per endpoint: [latencies], errors.
+        self._results = dict((endpoint, [[], 0])
+                             for endpoint, _, _ in self.mix)
+        self._window = [[], 0]
+
+        workers = [threading.Thread(target=self._worker, args=(stop, seed))
+                   for seed in range(self.concurrency)]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+
+        intervals = []
+        window_start = start
+
+        while time.time() < stop:
+            time.sleep(max(0, min(self.interval, stop - time.time())))
+            now = time.time()
+            with self._lock:
+                window, self._window = self._window, [[], 0]
+            report = summarize(window[0], window[1], now - window_start)
+            report['elapsed'] = now - start
+            intervals.append(report)
+            window_start = now
+            if progress:
+                progress(report)
+
+        for worker in workers:
+            worker.join()
+
+        latencies = []
+        errors = 0
+        by_endpoint = {}
+
+        for endpoint, (times, failed) in self._results.items():
+            latencies.extend(times)
+            errors += failed
+            by_endpoint[endpoint] = summarize(times, failed,
+                                              time.time() - start)
+
+        report = summarize(latencies, errors, time.time() - start)
+        report.update(by_endpoint=by_endpoint, intervals=intervals)
+
+        return report
+
+    def _worker(self, stop, seed):
+        """Send requests until stop."""
+
+        backend = api.Send(host=self.host, port=self.port)
+        chooser = random.Random(seed)
+
+        while True:
+            if self.rps:
+                with self._lock:
+                    due = self._next
+                    self._next += 1 / self.rps
+                if due >= stop:
+                    return
+                time.sleep(max(0, due - time.time()))
+            else:
+                due = time.time()
+                if due >= stop:
+                    return
+
+            endpoint, rest, _ = self.mix[bisect.bisect_right(
+                self._cumulative,
+                chooser.random() * self._cumulative[-1])]
+
+            try:
+                backend.send(endpoint=endpoint, rest=rest,
+                             opts=dict(self.opts or {}))
+                failed = False
+            except (RuntimeError, RuntimeWarning) as error:
+                LOG.debug('%s: %s', endpoint, error)
+                failed = True
+
+            latency = time.time() - due
+
+            with self._lock:
+                if failed:
+                    self._results[endpoint][1] += 1
+                    self._window[1] += 1
+                else:
+                    self._results[endpoint][0].append(latency)
+                    self._window[0].append(latency)
+
+
+class StandIn(object):
+    """
+    A local stand-in backend that answers every GET with a small canned
+    JSON response (and a MythTV Server: header), after delay seconds. For
+    self tests of LoadTest and other tools, not for measuring anything.
+    """
+
+    RESPONSES = {
+        'Myth/version': {'String': '31'},
+        'Myth/GetHostName': {'String': 'standin'},
+        'Dvr/GetRecordedList': {'ProgramList': {
+            'StartIndex': '0', 'Count': '2', 'TotalAvailable': '2',
+            'Programs': [{'Title': 'One', 'StartTime': '2019-01-01T00:00:00Z',
+                          'Channel': {'ChanId': '1001'},
+                          'Recording': {'RecordedId': '1', 'Status': '-3'}},
+                         {'Title': 'Two', 'StartTime': '2019-01-02T00:00:00Z',
+                          'Channel': {'ChanId': '1002'},
+                          'Recording': {'RecordedId': '2', 'Status': '-3'}}]}},
+    }
+
+    def __init__(self, port=0, delay=0.0):
+        """port=0 picks a free port, see self.port."""
+
+        self.delay = delay
+        self.server = _StandInServer(('127.0.0.1', port), _StandInHandler)
+        self.server.standin = self
+        self.port = self.server.server_address[1]
+        self.thread = None
+
+    def start(self):
+        """Serve in a daemon thread. Returns self."""
+
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+        return self
+
+    def stop(self):
+        """Stop serving."""
+
+        self.server.shutdown()
+        self.server.server_close()
+
+    def response(self, endpoint):
+        """The canned response, or {'bool': 'true'}."""
+
+        return self.RESPONSES.get(endpoint, {'bool': 'true'})
+
+
+class _StandInServer(ThreadingMixIn, HTTPServer):
+    """A thread per client connection."""
+
+    daemon_threads = True
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    """Canned responses."""
+
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are separate writes, don't wait for delayed ACKs.
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        """All endpoints."""
+
+        standin = self.server.standin
+        if standin.delay:
+            time.sleep(standin.delay)
+
+        body = json.dumps(standin.response(
+            self.path.split('?')[0].strip('/'))).encode('utf-8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def version_string(self):
+        return 'MythTV/31-standin Linux UPnP/1.0'
+
+    def log_message(self, format, *args):
+        # pylint: disable=redefined-builtin
+        pass
+
+
+def self_test(duration=2, concurrency=4, rps=None):
+    """Run a short LoadTest against a StandIn. Returns the report."""
+
+    standin = StandIn(delay=0.001).start()
+
+    try:
+        return LoadTest('127.0.0.1', port=standin.port,
+                        concurrency=concurrency, rps=rps,
+                        duration=duration).run()
+    finally:
+        standin.stop()
+
+
+def _parse_mix(specs):
+    """
+    ['Dvr/GetRecordedList?Count=20:4', ...] to (endpoint, rest, weight)s.
+    Only a number after the last : is a weight, rest may have times in it.
+    """
+
+    mix = []
+
+    for spec in specs:
+        target, _, weight = spec.rpartition(':')
+        if not weight.isdigit():
+            target, weight = spec, 1
+        endpoint, _, rest = target.partition('?')
+        mix.append((endpoint, rest, int(weight)))
+
+    return mix
+
+
+def main(args=None):
+    """Command line entry point, prints a line per interval, then JSON."""
+
+    parser = argparse.ArgumentParser(
+        prog='python -m mythtv_services_api.loadtest',
+        description='Replay a weighted mix of Services API reads and report '
+                    'throughput, latency percentiles and errors.')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=6544)
+    parser.add_argument('--mix', nargs='+', metavar='ENDPOINT[?REST][:WEIGHT]',
+                        help='e.g. Myth/GetHostName:2 '
+                             'Dvr/GetRecordedList?Count=20:4')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--rps', type=float,
+                        help='target requests/second, default: as fast as '
+                             'possible')
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--interval', type=float, default=1)
+    parser.add_argument('--timeout', type=float, default=10)
+    parser.add_argument('--self-test', action='store_true',
+                        help='run against a local stand-in backend')
+    options = parser.parse_args(args)
+
+    def progress(report):
+        """One line per interval."""
+        print('{elapsed:7.1f}s {requests:6d} req {rps:8.1f}/s '
+              '{errors:4d} err  p50 {p50} p99 {p99}'.format(
+                  p50=_ms(report['latency']['p50']),
+                  p99=_ms(report['latency']['p99']), **report))
+
+    standin = StandIn().start() if options.self_test else None
+
+    try:
+        report = LoadTest(
+            '127.0.0.1' if standin else options.host,
+            port=standin.port if standin else options.port,
+            mix=_parse_mix(options.mix) if options.mix else DEFAULT_MIX,
+            concurrency=options.concurrency, rps=options.rps,
+            duration=options.duration, interval=options.interval,
+            opts={'timeout': options.timeout}).run(progress=progress)
+    finally:
+        if standin:
+            standin.stop()
+
+    report.pop('intervals')
+    print(json.dumps(report, indent=2, sort_keys=True))
+
+    return 1 if report['requests'] == 0 or report['error_rate'] else 0
+
+
+def _ms(seconds):
+    """For progress lines."""
+
+    return '-' if seconds is None else '{:.1f}ms'.format(seconds * 1000)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+# vim: set expandtab tabstop=4 shiftwidth=4 smartindent noai colorcolumn=80:
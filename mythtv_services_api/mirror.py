@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+
+"""Local SQLite mirror of the recorded programs list."""
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+import json
+import logging
+import sqlite3
+
+from . import send as api
+from .utilities import to_int
+
+LOG = logging.getLogger(__name__)
+logging.getLogger(__name__).addHandler(logging.NullHandler())
+
+COLUMNS = ('recorded_id', 'last_modified', 'title', 'subtitle',
+           'description', 'category', 'chan_id', 'call_sign', 'start_time',
+           'end_time', 'rec_group', 'storage_group', 'file_size', 'program')
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS recorded (
+        recorded_id INTEGER PRIMARY KEY,
+        last_modified TEXT,
+        title TEXT,
+        subtitle TEXT,
+        description TEXT,
+        category TEXT,
+        chan_id INTEGER,
+        call_sign TEXT,
+        start_time TEXT,
+        end_time TEXT,
+        rec_group TEXT,
+        storage_group TEXT,
+        file_size INTEGER,
+        program TEXT
+    );
+    CREATE INDEX IF NOT EXISTS recorded_title ON recorded (title);
+    CREATE INDEX IF NOT EXISTS recorded_category ON recorded (category);
+    CREATE INDEX IF NOT EXISTS recorded_start_time ON recorded (start_time);
+    CREATE INDEX IF NOT EXISTS recorded_chan_id ON recorded (chan_id);
+    CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    );
+'''
+
+
+class RecordedMirror(object):
+    """
+    Keep the programs from Dvr/GetRecordedList in a local SQLite database
+    with indexes on title, category, start time and channel, plus full text
+    search of title, subtitle and description.
+
+    refresh() asks for the list with the ETag of the last one, so if
+    nothing was recorded, deleted or changed, the backend just answers 304.
+    Otherwise only rows whose RecordedId is new or whose LastModified
+    changed are written, and rows for deleted recordings are removed.
+
+    EXAMPLE:
+    ========
+
+        import mythtv_services_api.send as send
+        from mythtv_services_api.mirror import RecordedMirror
+
+        backend = send.Send(host='someName')
+        mirror = RecordedMirror(backend, '/var/cache/recorded.sqlite')
+
+        mirror.refresh()
+        for program in mirror.search(text='dinosaurs', category='Science'):
+            print(program['Title'], program['StartTime'])
+
+    Requires RecordedId, which backends older than v29 don't send.
+    """
+
+    def __init__(self, backend, path, rest='', opts=None):
+        """
+        INPUT:
+        ======
+
+        backend: A send.Send() object.
+
+        path:    The database file. ':memory:' works for a throwaway mirror.
+
+        rest:    Passed to Dvr/GetRecordedList, e.g. 'RecGroup=Default' to
+                 mirror only part of the library. Don't use paging here.
+
+        opts:    The same as for send(). The mirror sets opts['etag'].
+        """
+
+        self.backend = backend
+        self.rest = rest
+        self.opts = dict(opts or {})
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+
+        try:
+            self.db.execute('CREATE VIRTUAL TABLE IF NOT EXISTS recorded_fts '
+                            'USING fts5(title, subtitle, description)')
+            self.fts = True
+        except sqlite3.OperationalError as error:
+            LOG.debug('No full text search (%s), using LIKE', error)
+            self.fts = False
+
+        self.db.commit()
+
+    def refresh(self):
+        """
+        Bring the mirror up to date. Returns a dict of the number of
+        programs {'added': n, 'changed': n, 'removed': n}. RuntimeErrors
+        from send() are passed to the caller.
+        """
+
+        counts = {'added': 0, 'changed': 0, 'removed': 0}
+
+        response = api.send_changed(self.backend, 'Dvr/GetRecordedList',
+                                    self._get_meta('etag'), rest=self.rest,
+                                    opts=self.opts)
+        if response is None:
+            LOG.debug('Recorded list unchanged')
+            return counts
+
+        try:
+            programs = response['ProgramList']['Programs']
+        except (KeyError, TypeError):
+            raise RuntimeError('Unexpected Dvr/GetRecordedList response')
+
+        existing = dict(self.db.execute(
+            'SELECT recorded_id, last_modified FROM recorded'))
+        seen = set()
+
+        with self.db:
+            for program in programs:
+                try:
+                    recorded_id = int(program['Recording']['RecordedId'])
+                except (KeyError, TypeError, ValueError):
+                    LOG.debug('Skipping program without a RecordedId: %s',
+                              program.get('Title'))
+                    continue
+
+                seen.add(recorded_id)
+
+                if recorded_id not in existing:
+                    counts['added'] += 1
+                elif existing[recorded_id] != program.get('LastModified'):
+                    self._delete(recorded_id)
+                    counts['changed'] += 1
+                else:
+                    continue
+
+                self._insert(recorded_id, program)
+
+            for recorded_id in set(existing) - seen:
+                self._delete(recorded_id)
+                counts['removed'] += 1
+
+            self._set_meta('etag', self.backend.etag)
+
+        LOG.debug('Recorded mirror refreshed: %s', counts)
+
+        return counts
+
+    def search(self, text=None, title=None, category=None, chan_id=None,
+               start=None, end=None, limit=None):
+        """
+        Return a list of the matching programs (as originally decoded from
+        JSON), ordered by StartTime. All arguments are optional and are
+        ANDed:
+
+            text:     Full text search of title, subtitle and description,
+                      using SQLite FTS5 query syntax, e.g. 'dino*'.
+            title:    Exact title.
+            category: Exact category.
+            chan_id:  Channel.
+            start:    Programs starting at or after this UTC time, e.g.
+            end:      2019-01-01T00:00:00Z, and/or starting before end.
+            limit:    The most programs to return.
+        """
+
+        where = []
+        params = []
+
+        if text:
+            if self.fts:
+                where.append('recorded_id IN (SELECT rowid FROM recorded_fts '
+                             'WHERE recorded_fts MATCH ?)')
+                params.append(text)
+            else:
+                where.append('(title LIKE ? OR subtitle LIKE ? OR '
+                             'description LIKE ?)')
+                params.extend(['%{}%'.format(text)] * 3)
+
+        for column, value in (('title', title), ('category', category),
+                              ('chan_id', chan_id)):
+            if value is not None:
+                where.append('{} = ?'.format(column))
+                params.append(value)
+
+        if start is not None:
+            where.append('start_time >= ?')
+            params.append(start)
+
+        if end is not None:
+            where.append('start_time < ?')
+            params.append(end)
+
+        query = 'SELECT program FROM recorded'
+        if where:
+            query += ' WHERE ' + ' AND '.join(where)
+        query += ' ORDER BY start_time'
+        if limit is not None:
+            query += ' LIMIT ?'
+            params.append(int(limit))
+
+        try:
+            return [json.loads(row['program'])
+                    for row in self.db.execute(query, params)]
+        except sqlite3.OperationalError as error:
+            raise RuntimeError('Invalid search: {}'.format(error))
+
+    def get(self, recorded_id):
+        """Return one program by RecordedId, or None."""
+
+        row = self.db.execute('SELECT program FROM recorded '
+                              'WHERE recorded_id = ?',
+                              (int(recorded_id),)).fetchone()
+
+        return json.loads(row['program']) if row else None
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM recorded').fetchone()[0]
+
+    def close(self):
+        """Close the database."""
+
+        self.db.close()
+
+    def _insert(self, recorded_id, program):
+        """Add one program, and its full text entry."""
+
+        recording = program.get('Recording') or {}
+        channel = program.get('Channel') or {}
+
+        row = (recorded_id, program.get('LastModified'),
+               program.get('Title'), program.get('SubTitle'),
+               program.get('Description'), program.get('Category'),
+               to_int(channel.get('ChanId')), channel.get('CallSign'),
+               program.get('StartTime'), program.get('EndTime'),
+               recording.get('RecGroup'), recording.get('StorageGroup'),
+               to_int(program.get('FileSize')), json.dumps(program))
+
+        self.db.execute('INSERT INTO recorded ({}) VALUES ({})'.format(
+            ', '.join(COLUMNS), ', '.join('?' * len(COLUMNS))), row)
+
+        if self.fts:
+            self.db.execute('INSERT INTO recorded_fts (rowid, title, '
+                            'subtitle, description) VALUES (?, ?, ?, ?)',
+                            row[:1] + row[2:5])
+
+    def _delete(self, recorded_id):
+        """Remove one program, and its full text entry."""
+
+        self.db.execute('DELETE FROM recorded WHERE recorded_id = ?',
+                        (recorded_id,))
+
+        if self.fts:
+            self.db.execute('DELETE FROM recorded_fts WHERE rowid = ?',
+                            (recorded_id,))
+
+    def _get_meta(self, key):
+        """Return a saved value, or None."""
+
+        row = self.db.execute('SELECT value FROM meta WHERE key = ?',
+                              (key,)).fetchone()
+
+        return row['value'] if row else None
+
+    def _set_meta(self, key, value):
+        """Save a value."""
+
+        self.db.execute('INSERT OR REPLACE INTO meta (key, value) '
+                        'VALUES (?, ?)', (key, value))
+
+# vim: set expandtab tabstop=4 shiftwidth=4 smartindent noai colorcolumn=80:
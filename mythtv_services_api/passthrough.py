@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+"""Raw (undecoded) responses, for proxies and gateways."""
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+import logging
+
+from urllib3.exceptions import HTTPError
+
+CHUNK_SIZE = 64 * 1024
+
+LOG = logging.getLogger(__name__)
+logging.getLogger(__name__).addHandler(logging.NullHandler())
+
+
+def passthrough(backend, endpoint, postdata=None, rest='', opts=None,
+                sink=None, compressed=False, on_headers=None):
+    """
+    Send a request like send() does, with the same session, authentication,
+    wrmi and server version checks, but return the body as bytes, without
+    decoding it. Or, if sink is set, write it there in chunks as it
+    arrives.
+
+    EXAMPLE:
+    ========
+
+        import mythtv_services_api.send as send
+        from mythtv_services_api.passthrough import passthrough
+
+        backend = send.Send(host='someName')
+
+        response = passthrough(backend, 'Dvr/GetRecordedList',
+                               rest='Count=10', compressed=True)
+        # Forward response['body'] with response['status'] and the
+        # Content-Type:, Content-Encoding: and ETag: headers.
+
+    INPUT:
+    ======
+
+    backend:    A send.Send() object.
+
+    endpoint:   The same as for send(), also postdata, rest and opts.
+    postdata:   opts['etag'] is sent as If-None-Match:, and a 304 is
+    rest:       returned rather than raised. opts['usexml'] selects XML,
+    opts:       for this request only.
+
+    sink:       Anything with a write() method. If set, the body is written
+                there, not returned.
+
+    compressed: If True, the body is left as the server sent it (usually
+                gzipped, see content_encoding in the output) so it can be
+                forwarded to a client that accepts that encoding without
+                being decompressed and compressed again.
+
+    on_headers: Optional, called with the output (without the body) once
+                the response headers arrive, before anything is written to
+                sink. E.g. to send a client the headers 1st.
+
+    OUTPUT:
+    =======
+
+    {'status': 200, 'etag': ETag: or None, 'content_type': Content-Type:,
+     'content_encoding': Content-Encoding: or None (always None if
+     compressed is False), 'server': Server:, 'content_length':
+     Content-Length: if it applies to the body returned, else None,
+     'body': bytes (None if sink is set), 'bytes': the number of body
+     bytes}
+
+    Errors are raised as they are by send().
+    """
+
+    url = backend.prepare(endpoint, rest=rest, opts=opts,
+                          postdata=postdata)
+
+    headers = {'Accept': '' if backend.opts['usexml']
+                         else 'application/json'}
+    if backend.opts['etag']:
+        headers['If-None-Match'] = backend.opts['etag']
+
+    LOG.debug('Passthrough URL=%s', url)
+
+    response = backend.request(url, headers=headers, stream=True,
+                               allowed=(304,))
+
+    encoding = response.headers.get('Content-Encoding')
+    # The length is of what was sent, so only if the body is left as is.
+    length = response.headers.get('Content-Length') \
+        if compressed or not encoding else None
+
+    result = {'status': response.status_code,
+              'etag': response.headers.get('ETag'),
+              'content_type': response.headers.get('Content-Type'),
+              'content_encoding': encoding if compressed else None,
+              'server': response.headers.get('Server'),
+              'content_length': length,
+              'body': None,
+              'bytes': 0}
+
+    if on_headers is not None:
+        on_headers(result)
+
+    if response.status_code == 304:
+        response.close()
+        return result
+
+    chunks = []
+
+    try:
+        for chunk in response.raw.stream(CHUNK_SIZE,
+                                         decode_content=not compressed):
+            if sink is None:
+                chunks.append(chunk)
+            else:
+                sink.write(chunk)
+            result['bytes'] += len(chunk)
+    except (HTTPError, IOError, OSError, ValueError) as error:
+        raise RuntimeError('Passthrough interrupted: {}'.format(error))
+    finally:
+        response.close()
+
+    if sink is None:
+        result['body'] = b''.join(chunks)
+
+    return result
+
+# vim: set expandtab tabstop=4 shiftwidth=4 smartindent noai colorcolumn=80:
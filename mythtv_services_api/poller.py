@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+
+"""Poll a status endpoint and report only what changed."""
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+import logging
+import threading
+
+from . import send as api
+
+LOG = logging.getLogger(__name__)
+logging.getLogger(__name__).addHandler(logging.NullHandler())
+
+
+class Missing(object):
+    """The old value of an added key or the new value of a removed one."""
+
+    def __repr__(self):
+        return 'MISSING'
+
+    def __bool__(self):
+        return False
+
+    __nonzero__ = __bool__
+
+
+MISSING = Missing()
+
+
+def diff(old, new, path=()):
+    """
+    Compare two decoded responses and return a list of changes, each a
+    tuple of (path, old value, new value). path is a tuple of the dict keys
+    and list indexes leading to the value, e.g.:
+
+        (('FrontendStatus', 'State', 'state'), 'idle', 'WatchingRecording')
+
+    Only the deepest differing values are reported. Added and removed keys
+    (or list items) have MISSING as their old or new value. An empty list
+    means there was no change.
+    """
+
+    if isinstance(old, dict) and isinstance(new, dict):
+        changes = []
+        for key in old:
+            if key in new:
+                changes.extend(diff(old[key], new[key], path + (key,)))
+            else:
+                changes.append((path + (key,), old[key], MISSING))
+        for key in new:
+            if key not in old:
+                changes.append((path + (key,), MISSING, new[key]))
+        return changes
+
+    if isinstance(old, list) and isinstance(new, list):
+        changes = []
+        for index in range(max(len(old), len(new))):
+            if index >= len(new):
+                changes.append((path + (index,), old[index], MISSING))
+            elif index >= len(old):
+                changes.append((path + (index,), MISSING, new[index]))
+            else:
+                changes.extend(diff(old[index], new[index], path + (index,)))
+        return changes
+
+    if old != new:
+        return [(path, old, new)]
+
+    return []
+
+
+def is_busy(response):
+    """
+    The default for Poller(busy_test=...). True if a frontend isn't idle (is
+    playing something, in a menu...) or if any backend encoder isn't in
+    state 0 (idle), e.g. it's recording or watching live TV.
+    """
+
+    try:
+        return response['FrontendStatus']['State']['state'] != 'idle'
+    except (KeyError, TypeError):
+        pass
+
+    try:
+        encoders = response['BackendStatus']['Encoders']['Encoder']
+        return any(str(encoder.get('State', '0')) != '0'
+                   for encoder in encoders)
+    except (AttributeError, KeyError, TypeError):
+        return False
+
+
+class Poller(object):
+    """
+    Poll one endpoint, e.g. Frontend/GetStatus or Status/GetBackendStatus,
+    and hand only the changes to any number of subscribers.
+
+    Each poll sends the ETag from the previous response, so an unchanged
+    response costs the server a 304 and costs nothing to decode or diff.
+    Polls are made every busy_interval seconds while busy_test(response) is
+    True and every idle_interval seconds otherwise.
+
+    EXAMPLE:
+    ========
+
+        import mythtv_services_api.send as send
+        from mythtv_services_api.poller import Poller
+
+        frontend = send.Send(host='someFrontend', port=6547)
+        poller = Poller(frontend, 'Frontend/GetStatus')
+
+        # Either subscribe and run it in a thread:
+        poller.subscribe(lambda changes, response: print(changes))
+        poller.start()
+        ...
+        poller.stop()
+
+        # Or use it as a generator:
+        for changes, response in poller.changes():
+            ...
+    """
+
+    def __init__(self, backend, endpoint, rest='', opts=None,
+                 busy_interval=1, idle_interval=15, busy_test=is_busy,
+                 max_failures=5):
+        """
+        INPUT:
+        ======
+
+        backend:       A send.Send() object, used only by this poller.
+
+        endpoint:      The same as for send(). opts['etag'] is set by the
+        rest:          poller.
+        opts:
+
+        busy_interval: Seconds between polls when busy_test(response) is
+                       True. Defaults to 1.
+
+        idle_interval: Seconds between polls otherwise. Defaults to 15.
+
+        busy_test:     A function that is passed the latest response and
+                       returns True if the faster interval should be used.
+                       Defaults to is_busy().
+
+        max_failures:  changes() raises the RuntimeError of this many failed
+                       polls in a row, so a dead server doesn't look like
+                       one with no changes. Defaults to 5. 0 or None keeps
+                       polling forever.
+        """
+
+        self.backend = backend
+        self.endpoint = endpoint
+        self.rest = rest
+        self.opts = dict(opts or {})
+        self.busy_interval = busy_interval
+        self.idle_interval = idle_interval
+        self.busy_test = busy_test
+        self.max_failures = max_failures
+        self.failures = 0
+        self.response = None
+        self.etag = None
+        self.subscribers = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def subscribe(self, callback):
+        """
+        Call callback(changes, response) every time a poll finds changes.
+        The 1st poll reports the whole response as one change, with a path
+        of () and an old value of MISSING.
+        """
+
+        self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        """Stop calling callback."""
+
+        self.subscribers.remove(callback)
+
+    @property
+    def interval(self):
+        """Seconds to wait before the next poll."""
+
+        if self.response is not None and self.busy_test(self.response):
+            return self.busy_interval
+
+        return self.idle_interval
+
+    def poll(self):
+        """
+        Poll once and return the list of changes since the last poll (see
+        diff()), which is empty if nothing changed. Subscribers are called
+        only if something did. RuntimeErrors from send() are passed to the
+        caller.
+        """
+
+        response = api.send_changed(self.backend, self.endpoint, self.etag,
+                                    rest=self.rest, opts=self.opts)
+        if response is None:
+            return []
+
+        self.etag = self.backend.etag
+
+        if self.response is None:
+            changes = [((), MISSING, response)]
+        else:
+            changes = diff(self.response, response)
+
+        self.response = response
+
+        if changes:
+            for callback in list(self.subscribers):
+                callback(changes, response)
+
+        return changes
+
+    def changes(self):
+        """
+        A generator that polls until stop() is called and yields
+        (changes, response) whenever something changed. Failed polls are
+        logged and counted in failures, the RuntimeError of the
+        max_failures'th in a row is raised.
+        """
+
+        self._stop.clear()
+        self.failures = 0
+
+        while not self._stop.is_set():
+            try:
+                changes = self.poll()
+                self.failures = 0
+            except RuntimeError as error:
+                self.failures += 1
+                if self.max_failures and self.failures >= self.max_failures:
+                    raise
+                LOG.warning('%s (%d failed in a row)', error, self.failures)
+                changes = None
+            if changes:
+                yield changes, self.response
+            self._stop.wait(self.interval)
+
+    def start(self):
+        """Poll in a daemon thread, calling subscribers, until stop()."""
+
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        def run():
+            """Only subscribers see the changes."""
+            try:
+                for _ in self.changes():
+                    pass
+            except RuntimeError as error:
+                LOG.error('Stopped polling %s: %s', self.endpoint, error)
+
+        self._thread = threading.Thread(target=run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop polling, after any poll in progress."""
+
+        self._stop.set()
+
+        if self._thread is not None and \
+                self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+# vim: set expandtab tabstop=4 shiftwidth=4 smartindent noai colorcolumn=80:
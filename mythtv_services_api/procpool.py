@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+"""Spread requests and CPU heavy decoding across processes."""
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+import logging
+import multiprocessing
+
+from . import send as api
+
+# The Send() of each worker process, made from the pickled configuration
+# of the one passed to ProcessPool().
+_BACKEND = None
+
+LOG = logging.getLogger(__name__)
+logging.getLogger(__name__).addHandler(logging.NullHandler())
+
+
+def _init_worker(backend):
+    """Runs once in each worker."""
+
+    global _BACKEND  # pylint: disable=global-statement
+
+    _BACKEND = backend
+
+
+def _call(args):
+    """Run function(backend, item) in a worker. Returns (result, error.)"""
+
+    function, item = args
+
+    try:
+        return function(_BACKEND, item), None
+    except (RuntimeError, RuntimeWarning) as error:
+        return None, str(error)
+
+
+def _send_and_decode(backend, call):
+    """Used by send_many(), call is (endpoint, rest, opts, decode.)"""
+
+    endpoint, rest, opts, decode = call
+
+    response = backend.send(endpoint=endpoint, rest=rest,
+                            opts=dict(opts or {}))
+
+    return decode(response) if decode else response
+
+
+class ProcessPool(object):
+    """
+    A multiprocessing pool whose workers each have their own Send() for
+    the same back/frontend, for work where decoding or analysing the
+    responses costs more CPU than one process has. Each worker's Send()
+    keeps its session (and connections) for all the calls it's given.
+
+    EXAMPLE:
+    ========
+
+        import mythtv_services_api.send as send
+        from mythtv_services_api.procpool import ProcessPool
+
+        def count_titles(response):
+            ...
+            return counts
+
+        backend = send.Send(host='someName')
+
+        with ProcessPool(backend, processes=4) as pool:
+            for call, counts, error in pool.send_many(
+                    [('Guide/GetProgramGuide', 'StartTime=...&EndTime=...'),
+                     ...], decode=count_titles):
+                ...
+
+    Functions passed to map() and send_many() must be picklable, i.e.
+    defined at the top level of a module. Errors (RuntimeError and
+    RuntimeWarning) are returned as strings, like fanout does.
+    """
+
+    def __init__(self, backend, processes=None):
+        """
+        INPUT:
+        ======
+
+        backend:   A send.Send() object. Only its configuration is passed to
+                   the workers, see Send.__getstate__().
+
+        processes: The number of workers. Defaults to the number of CPUs.
+        """
+
+        if not isinstance(backend, api.Send):
+            raise RuntimeError('usage: backend must be a Send() object')
+
+        self.pool = multiprocessing.Pool(processes=processes,
+                                         initializer=_init_worker,
+                                         initargs=(backend,))
+
+    def map(self, function, items, chunksize=1):
+        """
+        Return [(item, result, error), ...] in the order of items, where
+        result is function(backend, item) run in a worker with its Send().
+        One of result and error is None.
+        """
+
+        items = list(items)
+        results = self.pool.map(_call, [(function, item) for item in items],
+                                chunksize=chunksize)
+
+        return [(item, result, error)
+                for item, (result, error) in zip(items, results)]
+
+    def send_many(self, calls, decode=None, opts=None):
+        """
+        send() each call in a worker and, if decode is set, return
+        decode(response) instead of the response, so decoding happens in
+        the worker too and only its result is passed back.
+
+        calls: endpoints or (endpoint, rest) tuples.
+
+        Returns [(call, response or decoded, error), ...] in order.
+        """
+
+        calls = list(calls)
+        jobs = []
+
+        for call in calls:
+            endpoint, rest = (call, '') if not isinstance(call, tuple) \
+                else call
+            jobs.append((endpoint, rest, opts, decode))
+
+        return [(call, result, error) for call, (_, result, error) in
+                zip(calls, self.map(_send_and_decode, jobs))]
+
+    def close(self):
+        """Let the workers finish and exit."""
+
+        self.pool.close()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+# vim: set expandtab tabstop=4 shiftwidth=4 smartindent noai colorcolumn=80:
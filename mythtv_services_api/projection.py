@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+"""Decode only the fields of list items that are needed."""
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+import logging
+import threading
+
+# Projections by frozenset of fields, so their shape caches are kept
+# between requests.
+_PROJECTIONS = {}
+_LOCK = threading.Lock()
+
+LOG = logging.getLogger(__name__)
+logging.getLogger(__name__).addHandler(logging.NullHandler())
+
+
+def get_projection(fields):
+    """The (shared) Projection for an iterable of fields."""
+
+    key = frozenset(fields)
+
+    with _LOCK:
+        try:
+            return _PROJECTIONS[key]
+        except KeyError:
+            projection = _PROJECTIONS[key] = Projection(key)
+            return projection
+
+
+class Projection(object):
+    """
+    Prunes each object of a response as it's decoded, so the subtrees of
+    list items that aren't wanted (Artwork, Recording, Cast...) are dropped
+    as soon as they're built, instead of being held until the whole list
+    has been decoded.
+
+    fields are paths as in columns.py, e.g. 'Title', 'Channel/ChanId'.
+    An object keeps only its keys that are named in one of the paths, so
+    'Channel/ChanId' keeps Channel in each item and ChanId in Channel. A
+    name is kept wherever it's found in an item, which is exact for the
+    usual paths (item fields and those of its Channel or Recording.)
+
+    Only the response itself, e.g. {'ProgramList': ...}, and the object
+    that holds the list of items (with Count, TotalAvailable...) are kept
+    whole, so the response keeps its usual structure. Nested objects are
+    pruned whatever they hold, e.g. a Program's Channel always has its
+    own (empty) Programs list. JSON is decoded from the inside out, so
+    those two are only known at the end, see decoder().
+
+    What to keep is worked out from the keys, once per set of keys (items
+    of a list all have the same keys) so pruning costs about as much as
+    decoding the dicts in the 1st place.
+
+    EXAMPLE:
+    ========
+
+        import mythtv_services_api.send as send
+
+        backend = send.Send(host='someName')
+        backend.send(endpoint='Dvr/GetRecordedList',
+                     opts={'fields': ('Title', 'StartTime', 'FileSize',
+                                      'Channel/ChanId')})
+    """
+
+    def __init__(self, fields):
+        self.fields = frozenset(fields)
+        self.names = frozenset(name for field in self.fields
+                               for name in field.split('/') if name)
+        # {keys: keys to keep}
+        self._shapes = {}
+
+        if not self.names:
+            raise RuntimeError('usage: fields must name at least one key')
+
+    def prune(self, item):
+        """An object with only the keys named in fields."""
+
+        keys = tuple(item)
+
+        try:
+            keep = self._shapes[keys]
+        except KeyError:
+            keep = self._shapes[keys] = [key for key in keys
+                                         if key in self.names]
+
+        if len(keep) == len(keys):
+            return item
+
+        return dict((key, item[key]) for key in keep)
+
+    def decoder(self, then=None):
+        """
+        A _Decoder for one json.loads(object_hook=...) call. then, if set,
+        is another object_hook that's called with each pruned object.
+        """
+
+        return _Decoder(self, then)
+
+
+class _Decoder(object):
+    """
+    Prunes objects as they're decoded and keeps the last two, unpruned, so
+    finish() can put back the response and the object that holds its list.
+    """
+
+    def __init__(self, projection, then=None):
+        self.prune = projection.prune
+        self.then = then
+        # (object as decoded, what object_hook() returned for it)
+        self.last = None
+        self.previous = None
+
+    def __call__(self, item):
+        """The object_hook."""
+
+        result = self.prune(item)
+        if self.then is not None:
+            result = self.then(result)
+
+        self.previous, self.last = self.last, (item, result)
+
+        return result
+
+    def finish(self, decoded):
+        """Return the decoded response with its top two levels unpruned."""
+
+        if self.last is None or decoded is not self.last[1]:
+            return decoded
+
+        top = self.last[0]
+
+        if len(top) == 1 and self.previous is not None:
+            key, value = next(iter(top.items()))
+            if value is self.previous[1]:
+                value = self.previous[0]
+                if self.then is not None:
+                    value = self.then(value)
+                top = {key: value}
+
+        return self.then(top) if self.then is not None else top
+
+# vim: set expandtab tabstop=4 shiftwidth=4 smartindent noai colorcolumn=80:
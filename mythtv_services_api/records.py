@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+
+"""Compact record types for large list responses."""
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+import json
+import logging
+
+try:
+    from sys import intern
+except ImportError:
+    # Python 2, intern() is a builtin.
+    pass
+
+# Strings up to this long are interned. Callsigns, categories, groups,
+# timestamps, flags and small numbers repeat a lot in big lists and only
+# one copy of each is kept. Descriptions, file names etc. are left alone.
+INTERN_LENGTH = 32
+
+LOG = logging.getLogger(__name__)
+logging.getLogger(__name__).addHandler(logging.NullHandler())
+
+
+class Record(object):
+    """
+    Base for the record types. Fields are attributes (None if the server
+    didn't send them), and records also act enough like the dict they
+    replace for most code: record['Title'], record.get('Title'), 'Title' in
+    record and to_dict() all work. Keys that aren't one of the class's
+    fields (e.g. from newer backends) are kept in a small dict and are only
+    available through the dict style access.
+    """
+
+    __slots__ = ('_extra',)
+
+    def __init__(self, item):
+        extra = None
+
+        for key, value in item.items():
+            if isinstance(value, str) and len(value) <= INTERN_LENGTH:
+                value = intern(value)
+            try:
+                object.__setattr__(self, key, value)
+            except AttributeError:
+                if extra is None:
+                    extra = {}
+                extra[key] = value
+
+        for key in self.__slots__:
+            if key not in item:
+                object.__setattr__(self, key, None)
+
+        self._extra = extra
+
+    def __getitem__(self, key):
+        if key in self.__slots__:
+            return getattr(self, key)
+        if self._extra and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        try:
+            return self[key] is not None
+        except KeyError:
+            return False
+
+    def get(self, key, default=None):
+        """The same as dict.get()."""
+
+        try:
+            value = self[key]
+        except KeyError:
+            return default
+        return default if value is None else value
+
+    def to_dict(self):
+        """Back to the dict (and list) structure send() returns."""
+
+        item = {}
+
+        for key in self.__slots__:
+            value = getattr(self, key)
+            if value is not None:
+                item[key] = _to_plain(value)
+
+        for key, value in (self._extra or {}).items():
+            item[key] = _to_plain(value)
+
+        return item
+
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, self.to_dict())
+
+
+class Program(Record):
+    """An item of ProgramList/Programs or ProgramGuide Channel/Programs."""
+
+    __slots__ = ('StartTime', 'EndTime', 'Title', 'SubTitle', 'Category',
+                 'CatType', 'Repeat', 'VideoProps', 'AudioProps',
+                 'SubProps', 'SeriesId', 'ProgramId', 'Stars',
+                 'LastModified', 'ProgramFlags', 'Airdate', 'Description',
+                 'Inetref', 'Season', 'Episode', 'TotalEpisodes', 'FileSize',
+                 'FileName', 'HostName', 'Channel', 'Recording', 'Artwork',
+                 'Cast')
+
+
+class Channel(Record):
+    """An item of ChannelInfoList/ChannelInfos, or a Program's Channel."""
+
+    __slots__ = ('ChanId', 'ChanNum', 'CallSign', 'IconURL', 'ChannelName',
+                 'MplexId', 'ServiceId', 'ATSCMajorChan', 'ATSCMinorChan',
+                 'Format', 'FrequencyId', 'FineTune', 'ChanFilters',
+                 'SourceId', 'InputId', 'CommFree', 'UseEPG', 'Visible',
+                 'XMLTVID', 'DefaultAuth', 'Programs')
+
+
+class Recording(Record):
+    """A Program's Recording."""
+
+    __slots__ = ('RecordedId', 'Status', 'Priority', 'StartTs', 'EndTs',
+                 'FileSize', 'FileName', 'HostName', 'LastModified',
+                 'RecordId', 'RecGroup', 'PlayGroup', 'StorageGroup',
+                 'RecType', 'DupInType', 'DupMethod', 'EncoderId',
+                 'EncoderName', 'Profile')
+
+
+class Encoder(Record):
+    """An item of EncoderList/Encoders."""
+
+    __slots__ = ('Id', 'HostName', 'Local', 'Connected', 'State',
+                 'SleepStatus', 'LowOnFreeSpace', 'Inputs', 'Recording')
+
+
+# Keys only a RecRule (Dvr/GetRecordSchedule etc.) has. A rule also has a
+# Title, StartTime, ChanId and CallSign, but isn't a Program or a Channel.
+RECRULE_KEYS = frozenset(('Type', 'SearchType', 'FindDay', 'FindTime',
+                          'RecPriority', 'PreferredInput', 'StartOffset',
+                          'EndOffset', 'Inactive', 'ParentId', 'Filter',
+                          'MaxEpisodes', 'MaxNewest', 'NextRecording',
+                          'LastRecorded', 'LastDeleted', 'AverageDelay'))
+
+# Tried in order, the 1st class whose required keys are all present, and
+# none of whose excluded keys are, is used.
+SIGNATURES = ((Encoder, ('Id', 'Connected', 'State'), ()),
+              (Recording, ('RecordedId',), ()),
+              (Recording, ('StartTs', 'Status'), ()),
+              (Program, ('Title', 'StartTime'), RECRULE_KEYS),
+              (Channel, ('ChanId', 'CallSign'), RECRULE_KEYS))
+
+_CLASS_CACHE = {}
+
+
+def object_hook(item):
+    """
+    For json.loads(object_hook=...). Returns a record for dicts that look
+    like a Program, Channel, Recording or Encoder, otherwise the dict (e.g.
+    for recording rules, see RECRULE_KEYS.) JSON is decoded from the inside
+    out, so nested Channel and Recording dicts are already records when
+    their Program is built.
+    """
+
+    keys = tuple(item)
+
+    try:
+        cls = _CLASS_CACHE[keys]
+    except KeyError:
+        cls = None
+        for candidate, required, excluded in SIGNATURES:
+            if all(key in item for key in required) and \
+                    not any(key in excluded for key in keys):
+                cls = candidate
+                break
+        _CLASS_CACHE[keys] = cls
+
+    if cls is None:
+        return item
+
+    return cls(item)
+
+
+def loads(text):
+    """Decode a JSON response into records, see object_hook()."""
+
+    return json.loads(text, object_hook=object_hook)
+
+
+def _to_plain(value):
+    """Records (also in lists) back to dicts."""
+
+    if isinstance(value, Record):
+        return value.to_dict()
+    if isinstance(value, list):
+        return [_to_plain(entry) for entry in value]
+    return value
+
+
+def memory_benchmark(count=100000):
+    """
+    Decode a synthetic Dvr/GetRecordedList-like response of count programs
+    as plain dicts and as records. Returns a dict of the memory held by the
+    result of each, in bytes, e.g. {'dicts': ..., 'records': ...}
+
+    Needs Python 3 (tracemalloc.)
+    """
+
+    import tracemalloc
+
+    programs = []
+    for index in range(count):
+        programs.append({
+            'StartTime': '2019-01-01T00:{:02}:00Z'.format(index % 60),
+            'EndTime': '2019-01-01T01:00:00Z',
+            'Title': 'Title {}'.format(index % 500),
+            'SubTitle': 'Subtitle {}'.format(index), 'Category': 'News',
+            'CatType': 'series', 'Repeat': 'false', 'Description':
+            'Description {}'.format(index), 'Season': '1', 'Episode': '2',
+            'FileSize': str(index * 1000), 'HostName': 'backend',
+            'Channel': {'ChanId': str(1000 + index % 50), 'ChanNum': '2',
+                        'CallSign': 'CALL{}'.format(index % 50),
+                        'ChannelName': 'Channel', 'SourceId': '1'},
+            'Recording': {'RecordedId': str(index), 'Status': '-3',
+                          'StartTs': '2019-01-01T00:00:00Z',
+                          'EndTs': '2019-01-01T01:00:00Z',
+                          'RecGroup': 'Default', 'StorageGroup': 'Default',
+                          'PlayGroup': 'Default', 'RecType': '1'}})
+
+    text = json.dumps({'ProgramList': {'Programs': programs}})
+    del programs
+
+    result = {}
+
+    for name, hook in (('dicts', None), ('records', object_hook)):
+        tracemalloc.start()
+        decoded = json.loads(text, object_hook=hook)
+        result[name] = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del decoded
+
+    LOG.debug('Memory for %d programs: %s', count, result)
+
+    return result
+
+# vim: set expandtab tabstop=4 shiftwidth=4 smartindent noai colorcolumn=80:
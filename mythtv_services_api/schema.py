@@ -0,0 +1,604 @@
+# -*- coding: utf-8 -*-
+
+"""Services API schemas (from the WSDL) and type coercion."""
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+import difflib
+import json
+import logging
+import os
+import sys
+import threading
+import xml.etree.ElementTree as ElementTree
+from datetime import datetime
+
+# pylint: disable=no-name-in-module, import-error
+if sys.version_info[0] == 2:
+    from urlparse import urlparse, parse_qsl
+elif sys.version_info[0] == 3:
+    from urllib.parse import urlparse, parse_qsl
+else:
+    sys.exit('Unable to import urllib')
+# pylint: enable=no-name-in-module, import-error
+
+XS = '{http://www.w3.org/2001/XMLSchema}'
+WSDL = '{http://schemas.xmlsoap.org/wsdl/}'
+
+# Bump if what's saved in the on-disk cache changes.
+CACHE_FORMAT = 3
+
+# The services in the catalog, see get_catalog(). Frontend is only on
+# frontends (port 6547.)
+SERVICES = ('Myth', 'Dvr', 'Guide', 'Channel', 'Content', 'Video', 'Capture',
+            'Frontend')
+
+# Endpoints every service has, but that aren't in its WSDL.
+BUILTIN_OPERATIONS = ('version', 'wsdl', 'xsd')
+
+# get_schema() keeps schemas in this directory between runs, unless it's
+# set to None.
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache',
+                         'mythtv_services_api', 'wsdl')
+
+INT_TYPES = frozenset(('int', 'integer', 'long', 'short', 'byte', 'uint',
+                       'unsignedInt', 'unsignedLong', 'unsignedShort',
+                       'unsignedByte'))
+FLOAT_TYPES = frozenset(('float', 'double', 'decimal'))
+
+# (server version, service, service version): schema. And the same
+# schemas by (host, port, service.) See: get_schema().
+SCHEMA_CACHE = {}
+HOST_SCHEMAS = {}
+SCHEMA_LOCK = threading.Lock()
+
+LOG = logging.getLogger(__name__)
+logging.getLogger(__name__).addHandler(logging.NullHandler())
+
+
+def _to_int(value):
+    """'1071' to 1071."""
+
+    return int(value)
+
+
+def _to_float(value):
+    """'1.5' to 1.5."""
+
+    return float(value)
+
+
+def _to_bool(value):
+    """'true' to True, anything else to False."""
+
+    if isinstance(value, bool):
+        return value
+    return value.lower() == 'true'
+
+
+def _to_datetime(value):
+    """2019-01-01T00:00:00Z to a naive (UTC) datetime."""
+
+    return datetime.strptime(value.replace('Z', ''), '%Y-%m-%dT%H:%M:%S')
+
+
+def _to_date(value):
+    """2019-01-01 to a date."""
+
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+SIMPLE_CONVERTERS = {'bool': _to_bool, 'boolean': _to_bool,
+                     'dateTime': _to_datetime, 'date': _to_date}
+SIMPLE_CONVERTERS.update((name, _to_int) for name in INT_TYPES)
+SIMPLE_CONVERTERS.update((name, _to_float) for name in FLOAT_TYPES)
+
+
+class Schema(object):
+    """
+    The types of one service (Dvr, Guide, Myth...), parsed from its WSDL
+    and the XSDs that it imports, and compiled into converters that turn
+    the strings in a JSON response into ints, bools, datetimes (naive, UTC)
+    and floats in one pass.
+
+    Normally used through opts['typed'] in send(), or get_schema().
+    """
+
+    def __init__(self, service, types=None, simple_types=None,
+                 operations=None):
+        """
+        types:        {complex type: {element: [type, is a list]}}
+        simple_types: {simple type: base type}, e.g. enums based on int.
+        operations:   {operation: {'verb': 'GET' or 'POST',
+                                   'params': {parameter: type}}}
+        """
+
+        self.service = service
+        self.types = types or {}
+        self.simple_types = simple_types or {}
+        self.operations = operations or {}
+        # Set by get_schema(), the versions the schema was fetched from.
+        self.server_version = None
+        self.service_version = None
+        self._converters = {}
+
+    @classmethod
+    def from_backend(cls, backend, service, opts=None):
+        """
+        Fetch and parse the service's WSDL and every XSD it imports, using
+        backend (a Send() that isn't otherwise in use.)
+        """
+
+        schema = cls(service)
+        pending = [('{}/wsdl'.format(service), '')]
+        seen = set()
+
+        while pending:
+            endpoint, rest = pending.pop()
+            if (endpoint, rest) in seen:
+                continue
+            seen.add((endpoint, rest))
+
+            url = backend.prepare(endpoint, rest=rest, opts=opts)
+            text = backend.request(url).text
+
+            try:
+                root = ElementTree.fromstring(text.encode('utf-8'))
+            except ElementTree.ParseError as error:
+                raise RuntimeError('Invalid schema from {}: {}'
+                                   .format(url, error))
+
+            pending.extend(schema.parse(root))
+
+        return schema
+
+    def parse(self, root):
+        """
+        Add the types defined in a parsed WSDL or XSD. Returns a list of
+        (endpoint, rest) for the XSDs it imports or includes.
+        """
+
+        imports = []
+
+        for tag in ('import', 'include'):
+            for node in root.iter(XS + tag):
+                location = node.get('schemaLocation')
+                if location:
+                    parsed = urlparse(location)
+                    path = parsed.path.lstrip('/')
+                    if '/' not in path:
+                        path = '{}/{}'.format(self.service, path)
+                    imports.append((path, parsed.query))
+
+        for node in root.iter(XS + 'complexType'):
+            name = node.get('name')
+            if not name:
+                continue
+            fields = {}
+            for element in node.iter(XS + 'element'):
+                if element.get('name') and element.get('type'):
+                    fields[element.get('name')] = [
+                        element.get('type').split(':')[-1],
+                        element.get('maxOccurs') == 'unbounded']
+            self.types[name] = fields
+
+        # Each operation's parameters are in an element of the same name.
+        requests = {}
+        for node in root.iter(XS + 'element'):
+            complex_type = node.find(XS + 'complexType')
+            if node.get('name') and complex_type is not None:
+                requests[node.get('name')] = dict(
+                    (element.get('name'), element.get('type').split(':')[-1])
+                    for element in complex_type.iter(XS + 'element')
+                    if element.get('name') and element.get('type'))
+
+        for port_type in root.iter(WSDL + 'portType'):
+            for node in port_type.findall(WSDL + 'operation'):
+                name = node.get('name')
+                # The backend puts the verb at the start of the text.
+                documentation = node.findtext(WSDL + 'documentation') or ''
+                self.operations[name] = {
+                    'verb': 'POST' if documentation.strip().upper()
+                            .startswith('POST') else 'GET',
+                    'params': requests.get(name, {})}
+
+        for node in root.iter(XS + 'simpleType'):
+            name = node.get('name')
+            restriction = node.find(XS + 'restriction')
+            if name and restriction is not None and restriction.get('base'):
+                self.simple_types[name] = \
+                    restriction.get('base').split(':')[-1]
+
+        return imports
+
+    def to_json(self):
+        """For the on-disk cache."""
+
+        return json.dumps({'format': CACHE_FORMAT, 'service': self.service,
+                           'server_version': self.server_version,
+                           'service_version': self.service_version,
+                           'types': self.types,
+                           'simple_types': self.simple_types,
+                           'operations': self.operations})
+
+    @classmethod
+    def from_json(cls, text):
+        """Returns None if text is from a different CACHE_FORMAT."""
+
+        saved = json.loads(text)
+        if saved.get('format') != CACHE_FORMAT:
+            return None
+
+        schema = cls(saved['service'], saved['types'], saved['simple_types'],
+                     saved['operations'])
+        schema.server_version = saved['server_version']
+        schema.service_version = saved['service_version']
+
+        return schema
+
+    def coerce(self, response):
+        """
+        Return a copy of a decoded JSON response with values converted to
+        the types the schema declares. The top level key is the name of
+        the type, e.g. {'ProgramList': {...}} or {'bool': 'true'}. Values
+        that don't convert (e.g. '' for an int) become None, anything the
+        schema doesn't describe is left as it was.
+        """
+
+        if not isinstance(response, dict):
+            return response
+
+        return dict((key, self.converter(key)(value))
+                    for key, value in response.items())
+
+    def validate(self, operation, params=None, post=False):
+        """
+        Raise a RuntimeError if the operation doesn't exist, if it needs a
+        different HTTP verb, or if a parameter isn't one it takes or isn't
+        a valid int/float. params is a dict or list of (name, value) pairs.
+        Parameter names are matched without regard to case, as the backend
+        does.
+        """
+
+        if operation in BUILTIN_OPERATIONS:
+            return
+
+        if operation not in self.operations:
+            close = difflib.get_close_matches(operation, self.operations, n=3)
+            raise RuntimeError('Invalid endpoint: {}/{}{}'.format(
+                self.service, operation,
+                ', did you mean: {}?'.format(', '.join(close)) if close
+                else ''))
+
+        verb = self.operations[operation]['verb']
+        if post and verb == 'GET':
+            raise RuntimeError('{}/{} is a GET, use rest, not postdata'
+                               .format(self.service, operation))
+        if not post and verb == 'POST':
+            raise RuntimeError('{}/{} is a POST, use postdata, not rest'
+                               .format(self.service, operation))
+
+        known = dict((name.lower(), (name, param_type)) for name, param_type
+                     in self.operations[operation]['params'].items())
+
+        if isinstance(params, dict):
+            params = params.items()
+
+        for name, value in params or ():
+            if name.lower() not in known:
+                raise RuntimeError('Invalid parameter for {}/{}: {}, use: {}'
+                                   .format(self.service, operation, name,
+                                           ', '.join(sorted(
+                                               param for param, _
+                                               in known.values())) or
+                                           'none'))
+            param, param_type = known[name.lower()]
+            base = self.simple_types.get(param_type, param_type)
+            if base in INT_TYPES or base in FLOAT_TYPES:
+                try:
+                    SIMPLE_CONVERTERS[base]('{}'.format(value))
+                except ValueError:
+                    raise RuntimeError('Invalid value for {}/{} {}: {}, '
+                                       'use: {}'.format(self.service,
+                                                        operation, param,
+                                                        value, base))
+
+    def converter(self, type_name):
+        """Return a function that converts values of this type."""
+
+        try:
+            return self._converters[type_name]
+        except KeyError:
+            pass
+
+        # Placeholder for recursive types.
+        self._converters[type_name] = _unchanged
+
+        base = self.simple_types.get(type_name, type_name)
+
+        if base in SIMPLE_CONVERTERS:
+            convert = _simple(SIMPLE_CONVERTERS[base])
+        elif type_name in self.types:
+            fields = self.types[type_name]
+            items = [(name, item_type) for name, (item_type, is_list)
+                     in fields.items() if is_list]
+            convert = _complex(self, fields)
+            if len(fields) == 1 and items:
+                # ArrayOfProgram etc. are sent as just the list.
+                convert = _list(self, items[0][1], convert)
+        else:
+            convert = _unchanged
+
+        self._converters[type_name] = convert
+
+        return convert
+
+
+def _unchanged(value):
+    """For anything the schema says is a string or doesn't describe."""
+
+    return value
+
+
+def _simple(function):
+    """Convert a string, None if it's empty or won't convert."""
+
+    def convert(value):
+        if value is None or isinstance(value, (dict, list)):
+            return value
+        try:
+            return function(value)
+        except (AttributeError, TypeError, ValueError):
+            return None
+
+    return convert
+
+
+def _list(schema, item_type, otherwise):
+    """Convert each item of a list, or use otherwise() if it's a dict."""
+
+    def convert(value):
+        if not isinstance(value, list):
+            return otherwise(value)
+        item = schema.converter(item_type)
+        return [item(entry) for entry in value]
+
+    return convert
+
+
+def _complex(schema, fields):
+    """Convert each known key of a dict, looking converters up once."""
+
+    converters = {}
+
+    def convert(value):
+        if not isinstance(value, dict):
+            return value
+        if not converters and fields:
+            for name, (field_type, is_list) in fields.items():
+                item = schema.converter(field_type)
+                converters[name] = _each(item) if is_list else item
+        result = {}
+        for key, entry in value.items():
+            function = converters.get(key)
+            result[key] = function(entry) if function else entry
+        return result
+
+    return convert
+
+
+def _each(item):
+    """For elements with maxOccurs=unbounded."""
+
+    def convert(value):
+        if isinstance(value, list):
+            return [item(entry) for entry in value]
+        return item(value)
+    return convert
+
+
+def get_schema(backend, service, opts=None, cache_dir=None):
+    """
+    Return the Schema for a service on the host backend talks to. Schemas
+    are kept by host and port, in HOST_SCHEMAS and in cache_dir (if set)
+    for later runs, so once a host's schema has been fetched, this costs
+    no requests, even offline. A schema is fetched again if send() has
+    since found a different server version. cache_dir defaults to
+    CACHE_DIR.
+
+    Hosts with the same server and service versions share a schema, see
+    SCHEMA_CACHE.
+
+    backend isn't used for requests, a new Send() for the same host/port is.
+    Only opts user, pass and timeout are used.
+    """
+
+    host_key = (backend.host, backend.port, service)
+    reported = _reported_version(backend)
+
+    with SCHEMA_LOCK:
+        schema = HOST_SCHEMAS.get(host_key)
+
+    if _current(schema, reported):
+        return schema
+
+    cache_dir = cache_dir or CACHE_DIR
+    path = os.path.join(cache_dir, '{}-{}-{}.json'.format(*host_key)) \
+        if cache_dir else None
+
+    schema = _load(path)
+
+    if not _current(schema, reported):
+        schema = _fetch(backend, service, opts)
+        _save(schema, path)
+
+    LOG.debug('Schema for %s: %d types', host_key, len(schema.types))
+
+    with SCHEMA_LOCK:
+        HOST_SCHEMAS[host_key] = schema
+
+    return schema
+
+
+def _reported_version(backend):
+    """The server version send() found, None before the 1st send()."""
+
+    version = backend.server_version
+
+    return version if version[:1].isdigit() else None
+
+
+def _current(schema, reported):
+    """False if there's no schema, or it's from another server version."""
+
+    return schema is not None and reported in (None, schema.server_version)
+
+
+def _fetch(backend, service, opts):
+    """Ask the host for the service's version, then its schema if needed."""
+
+    opts = dict((key, value) for key, value in (opts or {}).items()
+                if key in ('user', 'pass', 'timeout'))
+    fetcher = backend.__class__(host=backend.host, port=backend.port)
+
+    try:
+        service_version = fetcher.send(endpoint='{}/version'.format(service),
+                                       opts=dict(opts))['String']
+    except (KeyError, TypeError):
+        raise RuntimeError('Unexpected {}/version response'.format(service))
+
+    key = (fetcher.server_version, service, service_version)
+
+    with SCHEMA_LOCK:
+        if key in SCHEMA_CACHE:
+            return SCHEMA_CACHE[key]
+
+    schema = Schema.from_backend(fetcher, service, opts=opts)
+    schema.server_version = fetcher.server_version
+    schema.service_version = service_version
+
+    with SCHEMA_LOCK:
+        return SCHEMA_CACHE.setdefault(key, schema)
+
+
+def _load(path):
+    """The schema saved at path, or None."""
+
+    if not path:
+        return None
+
+    try:
+        with open(path) as f_obj:
+            return Schema.from_json(f_obj.read())
+    except (IOError, OSError, ValueError, KeyError):
+        return None
+
+
+def _save(schema, path):
+    """Write a new file and rename it, other processes may be reading."""
+
+    if not path:
+        return
+
+    temporary = '{}.{}.{}'.format(path, os.getpid(),
+                                  threading.current_thread().ident)
+
+    try:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(temporary, 'w') as f_obj:
+            f_obj.write(schema.to_json())
+        os.rename(temporary, path)
+    except (IOError, OSError) as error:
+        LOG.debug('Schema not saved to %s: %s', path, error)
+
+
+def get_catalog(backend, services=SERVICES, opts=None, cache_dir=None):
+    """
+    Return {service: Schema} for each of services that the host backend
+    talks to has. Services it doesn't have (e.g. Frontend on a backend)
+    are left out.
+    """
+
+    catalog = {}
+
+    for service in services:
+        try:
+            catalog[service] = get_schema(backend, service, opts=opts,
+                                          cache_dir=cache_dir)
+        except RuntimeError as error:
+            LOG.debug('No %s service: %s', service, error)
+
+    return catalog
+
+
+def endpoints(backend, prefix='', opts=None, cache_dir=None):
+    """
+    Return a sorted list of the endpoints starting with prefix (without
+    regard to case), e.g. prefix='Dvr/GetRec' for autocompletion. Only the
+    services that match prefix are fetched.
+    """
+
+    services = [service for service in SERVICES
+                if service.lower().startswith(prefix.split('/')[0].lower())]
+    catalog = get_catalog(backend, services, opts=opts, cache_dir=cache_dir)
+
+    return sorted(endpoint for endpoint in
+                  ('{}/{}'.format(service, operation)
+                   for service, schema in catalog.items()
+                   for operation in schema.operations)
+                  if endpoint.lower().startswith(prefix.lower()))
+
+
+def describe(backend, endpoint, opts=None, cache_dir=None):
+    """
+    Return {'verb': 'GET' or 'POST', 'params': {parameter: type}} for an
+    endpoint, e.g. describe(backend, 'Dvr/GetRecordedList').
+    """
+
+    service, operation = _split(endpoint)
+    schema = get_schema(backend, service, opts=opts, cache_dir=cache_dir)
+
+    try:
+        return schema.operations[operation]
+    except KeyError:
+        # Raises, unless it's one of the BUILTIN_OPERATIONS.
+        schema.validate(operation)
+        return {'verb': 'GET', 'params': {}}
+
+
+def validate(backend, endpoint, rest='', postdata=None, opts=None,
+             cache_dir=None):
+    """
+    Raise a RuntimeError if a send() with these arguments would be rejected
+    by the backend for an invalid endpoint, verb or parameter. Once the
+    service's schema is cached, no requests are made. See: opts['validate']
+    in send().
+    """
+
+    if postdata and not isinstance(postdata, dict):
+        raise RuntimeError('usage: postdata must be passed as a dict')
+
+    service, operation = _split(endpoint)
+    schema = get_schema(backend, service, opts=opts, cache_dir=cache_dir)
+
+    if postdata:
+        schema.validate(operation, postdata, post=True)
+    else:
+        schema.validate(operation, parse_qsl(rest or '',
+                                             keep_blank_values=True))
+
+
+def _split(endpoint):
+    """Dvr/GetRecordedList to ('Dvr', 'GetRecordedList')."""
+
+    try:
+        service, operation = endpoint.split('/')
+    except (AttributeError, ValueError):
+        raise RuntimeError('Invalid endpoint: {}, use: Service/Operation'
+                           .format(endpoint))
+
+    return service, operation
+
+# vim: set expandtab tabstop=4 shiftwidth=4 smartindent noai colorcolumn=80:
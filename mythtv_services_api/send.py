@@ -6,9 +6,14 @@ from __future__ import print_function
 from __future__ import absolute_import
 from os import fdopen
 
+import os
 import re
+import socket
 import sys
 import tempfile
+import threading
+import json
+import time
 import logging
 
 try:
@@ -18,6 +23,11 @@ except ImportError:
     sys.exit('Install python-requests or python3-requests')
 
 from ._version import __version__
+from . import limits
+from . import projection
+from . import records
+from . import schema
+from . import xmlparse
 
 # !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!! #
 # If MYTHTV_VERSION_LIST needs to be changed, be sure to     #
@@ -29,6 +39,135 @@ from ._version import __version__
 
 MYTHTV_VERSION_LIST = ('0.27', '0.28', '29', '30', '31')
 
+# Digest challenges (realm, nonce...) and the nonce count last used with
+# them, keyed by (host, port, user). Shared by all sessions and Send()s.
+DIGEST_CACHE = {}
+DIGEST_LOCK = threading.Lock()
+
+# Resolved addresses, keyed by host: (address, time it expires.) Only
+# used by Send()s that have been warm()ed.
+ADDRESS_CACHE = {}
+ADDRESS_LOCK = threading.Lock()
+ADDRESS_TTL = 300
+
+# Raised by send() when a response is bigger than opts['max_bytes'].
+ResponseTooLarge = limits.ResponseTooLarge
+
+
+def _after_fork():
+    """
+    Locks held by other threads when a process forks are never released
+    in the child, give it new ones. Sessions are replaced by the PID check
+    in Send._check_fork().
+    """
+
+    global DIGEST_LOCK, ADDRESS_LOCK  # pylint: disable=global-statement
+
+    DIGEST_LOCK = threading.Lock()
+    ADDRESS_LOCK = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def resolve_host(host, port=6544, ttl=ADDRESS_TTL):
+    """
+    Return the address of host, ready to put in a URL, looking it up only
+    if it isn't in ADDRESS_CACHE or has been there for more than ttl
+    seconds. If the lookup fails, host is returned unchanged and requests
+    will report the problem when it's used.
+    """
+
+    now = time.time()
+
+    with ADDRESS_LOCK:
+        cached = ADDRESS_CACHE.get(host)
+    if cached and cached[1] > now:
+        return cached[0]
+
+    try:
+        address = socket.getaddrinfo(host, port, 0,
+                                     socket.SOCK_STREAM)[0][4][0]
+    except socket.error as error:
+        logging.getLogger(__name__).debug('Unable to resolve %s: %s', host,
+                                          error)
+        return host
+
+    if ':' in address:
+        address = '[{}]'.format(address)
+
+    with ADDRESS_LOCK:
+        ADDRESS_CACHE[host] = (address, now + ttl)
+
+    return address
+
+
+class _CachedDigestAuth(HTTPDigestAuth):
+    """
+    Digest authentication that remembers the server's challenge in
+    DIGEST_CACHE. New sessions for the same host/port/user send the
+    Authorization header with their 1st request instead of waiting for
+    a 401. The nonce count is shared too, so it keeps incrementing no
+    matter which session or thread uses the nonce.
+    """
+
+    def __init__(self, username, password, key):
+        super(_CachedDigestAuth, self).__init__(username, password)
+        self.key = key
+
+    @property
+    def primed(self):
+        """True if a challenge for this host/port/user is cached."""
+        with DIGEST_LOCK:
+            return self.key in DIGEST_CACHE
+
+    def build_digest_header(self, method, url):
+        with DIGEST_LOCK:
+            cached = DIGEST_CACHE.get(self.key)
+            state = self._thread_local
+            if cached and cached['nonce'] == state.chal.get('nonce'):
+                state.last_nonce = cached['nonce']
+                state.nonce_count = cached['nonce_count']
+            header = super(_CachedDigestAuth, self).build_digest_header(
+                method, url)
+            DIGEST_CACHE[self.key] = {'chal': dict(state.chal),
+                                      'nonce': state.last_nonce,
+                                      'nonce_count': state.nonce_count}
+        return header
+
+    def __call__(self, request):
+        self.init_per_thread_state()
+        if not self._thread_local.chal:
+            with DIGEST_LOCK:
+                cached = DIGEST_CACHE.get(self.key)
+            if cached:
+                self._thread_local.chal = dict(cached['chal'])
+                self._thread_local.last_nonce = cached['nonce']
+        return super(_CachedDigestAuth, self).__call__(request)
+
+
+class ServicesError(RuntimeError):
+    """
+    A RuntimeError for an error response from the back/frontend. status is
+    the HTTP status, code and description are the errorCode and
+    errorDescription from the XML body (or None), and url is what was sent.
+    """
+
+    def __init__(self, message, status=None, code=None, description=None,
+                 url=None):
+        super(ServicesError, self).__init__(message)
+        self.status = status
+        self.code = code
+        self.description = description
+        self.url = url
+
+
+def not_modified(warning):
+    """True if a RuntimeWarning from send() is the 304 for opts['etag']."""
+
+    return 'Not Modified' in str(warning)
+
 
 class Send(object):
     """Services API."""
@@ -56,11 +195,30 @@ class Send(object):
         self.rest = None
         self.opts = None
         self.session = None
+        self.use_address_cache = False
+        self.etag = None
         self.server_version = 'Set to MythTV version after calls to send()'
         self.logger = logging.getLogger(__name__)
+        self._pid = None
 
         logging.getLogger(__name__).addHandler(logging.NullHandler())
 
+    def __getstate__(self):
+        """
+        Pickle just the configuration, e.g. to pass a Send() to a
+        multiprocessing worker. The session can't be shared with another
+        process, the copy makes its own when it's 1st used.
+        """
+
+        state = dict(self.__dict__)
+        state.update(session=None, logger=None, _pid=None)
+
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.logger = logging.getLogger(__name__)
+
     def send(self, endpoint='', postdata=None, rest='', opts=None):
         """
         Form a URL and send it to the back/frontend.  Parameter/option checking
@@ -119,6 +277,31 @@ class Send(object):
         own. The defaults are all False except for 'user', 'pass' and
         'timeout'.
 
+        opts['etag']:    If set to the etag attribute saved by an earlier
+                         send() of the same request, it's sent in an
+                         If-None-Match: header. If the data hasn't changed,
+                         the server answers 304 and a RuntimeWarning of
+                         'Not Modified (304)' is raised instead of returning
+                         the same response again.
+
+        opts['fields']:  If set to paths of the fields needed from each item
+                         of a list response, e.g. ('Title', 'StartTime',
+                         'Channel/ChanId'), the objects of the response
+                         are pruned as they're decoded, so other fields
+                         and subtrees (Artwork, Recording...) are never
+                         held. The list's Count, TotalAvailable etc. are
+                         kept. See projection.py. Also used with
+                         opts['decodexml'], opts['records'] and
+                         opts['typed'].
+
+        opts['max_bytes']: If set, the most bytes of the response that are
+                         read, counting both what's received and what it
+                         decompresses to (so gzip bombs are caught too.)
+                         Checked while the response arrives. Bigger
+                         responses raise a ResponseTooLarge (a
+                         RuntimeError) without being buffered. Use paging,
+                         or a smaller Guide window, for those.
+
         opts['noetag']:  Don't request the back/frontend to check for matching
                          ETag. Mostly for testing.
 
@@ -126,6 +309,12 @@ class Send(object):
                          Useful if watching protocol with a tool that doesn't
                          uncompress it.
 
+        opts['records']: If True, dicts in the JSON response that look like a
+                         Program, Channel, Recording or Encoder are decoded
+                         into compact records.Record objects, which use
+                         about half the memory of the equivalent dicts on
+                         big lists. See records.py.
+
         opts['timeout']: May be set, in seconds. Examples: 5, 0.01. Used to
                          prevent script from waiting indefinitely for a reply
                          from the server. Note: a timeout exception is only
@@ -134,12 +323,36 @@ class Send(object):
                          option. Defaults to 10 seconds.
 
         opts['user']:    Digest authentication. Usually not turned on in the
-        opts['pass']:    backend.
+        opts['pass']:    backend. The server's challenge is cached per
+                         host/port/user, so later sessions authenticate on
+                         their 1st request. See: prime_auth().
+
+        opts['typed']:   If True, values in the JSON response are converted
+                         to the types the service's WSDL declares: ints,
+                         bools, floats and (naive, UTC) datetimes, rather
+                         than strings. The WSDL is fetched once per host,
+                         see schema.get_schema(). Not used with
+                         opts['records'].
+
+        opts['validate']: If True, the endpoint, rest or postdata parameter
+                         names, int parameter values and the HTTP verb are
+                         checked against the service's WSDL before anything
+                         is sent, and a RuntimeError is raised if they're
+                         invalid. The WSDL is fetched once, then this costs
+                         nothing. WSDLs are kept in schema.CACHE_DIR between
+                         runs. See schema.validate(), schema.endpoints() and
+                         schema.describe() for introspection.
 
         opts['usexml']:  For testing only! If True, causes the backend to send
                          its response in XML rather than JSON. Defaults to
                          False.
 
+        opts['decodexml']: If True, the response is requested in XML and
+                         decoded as it arrives into the same structure as
+                         JSON (strings only.) Useful for backends whose
+                         JSON is broken. See xmlparse.py, which can also
+                         stream the items of big lists.
+
         opts['wrmi']:    If True and there is postdata, the URL is then sent to
                          the server.
 
@@ -178,10 +391,18 @@ class Send(object):
 
             'Image file = "/tmp/tmp5pxynqdf.jpeg"'
 
-        However, some errors returned by the server are in XML, e.g. if an
-        endpoint is invalid. That will cause the JSON decoder to fail. In
-        the application calling this, turn logging on and use the DEBUG
-        level. See the next section.
+        Large files and recordings (Content/GetFile, Content/GetRecording)
+        should be fetched with download.download(), which streams them to
+        disk rather than decoding them in memory.
+
+        Errors returned by the server are in XML, e.g. if an endpoint is
+        invalid. They're raised as a ServicesError (a RuntimeError) with
+        the HTTP status and the server's errorCode and errorDescription as
+        attributes. For anything else, in the application calling this,
+        turn logging on and use the DEBUG level. See the next section.
+
+        Whenever send() returns, 'etag' is set to the value of the ETag:
+        header received, or None. See opts['etag'] above.
 
         Whenever send() is used, 'server_version' is set to the value returned
         by the back/frontend in the HTTP Server: header. It is saved as just
@@ -205,23 +426,259 @@ class Send(object):
 
         """
 
+        url = self.check(endpoint, postdata=postdata, rest=rest, opts=opts)
+
+        self.logger.debug('URL=%s', url)
+
+        self._check_fork()
+
+        if self.session is None:
+            self._create_session()
+
+        headers = {}
+
+        if self.opts['etag']:
+            headers['If-None-Match'] = self.opts['etag']
+
+        if self.opts['decodexml']:
+            headers['Accept'] = ''
+
+        response = self.request(url, headers=headers or None,
+                                stream=bool(self.opts['decodexml'] or
+                                            self.opts['max_bytes']))
+
+        if self.opts['max_bytes']:
+            # Everything after this uses the body that's been checked.
+            body = limits.read_limited(response, self.opts['max_bytes'],
+                                       self.endpoint)
+        else:
+            body = None
+
+        if response.encoding is None:
+            response.encoding = 'UTF8'
+
+        try:
+            ct_header, image_type = response.headers['Content-Type'].split('/')
+        except (KeyError, ValueError):
+            ct_header = None
+
+        ##############################################################
+        # Finally, return the response in the desired format         #
+        ##############################################################
+
+        if self.opts['wsdl']:
+            return {'WSDL': limits.text(response, body)}
+
+        if ct_header == 'image':
+            raise RuntimeWarning('Image file = "{}"'.format(
+                self._save_image(response, body, image_type)))
+
+        if self.opts['decodexml']:
+            try:
+                return xmlparse.decode(response if body is None else body,
+                                       fields=self.opts['fields'])
+            finally:
+                response.close()
+
+        text = limits.text(response, body)
+
+        try:
+            self.logger.debug('1st 60 bytes of response: %s', text[:60])
+        except UnicodeEncodeError:
+            pass
+
+        if self.opts['usexml']:
+            return text
+
+        hook = self._object_hook(records.object_hook
+                                 if self.opts['records'] else None)
+
+        try:
+            decoded = json.loads(text, object_hook=hook)
+        except ValueError as err:
+            code, description = xmlparse.parse_error(text)
+            if description is not None:
+                raise ServicesError('Error returned: {}'.format(description),
+                                    status=response.status_code, code=code,
+                                    description=description,
+                                    url=response.url)
+            raise RuntimeError('Set loglevel=DEBUG to see JSON parse error: {}'
+                               .format(err))
+
+        if self.opts['fields']:
+            decoded = hook.finish(decoded)
+
+        if self.opts['records']:
+            return decoded
+
+        if self.opts['typed']:
+            return schema.get_schema(self, self.endpoint.split('/')[0],
+                                     opts=self.opts).coerce(decoded)
+
+        return decoded
+
+    def prime_auth(self, opts=None):
+        """
+        Optional. Get the digest challenge from the back/frontend with a
+        cheap GET (Myth/version) before a burst of authenticated writes.
+        Nothing happens if the challenge for this host/port/user is already
+        cached by any Send() or session.
+
+        opts must include 'user' and 'pass'. Returns True if a challenge is
+        now cached.
+        """
+
+        if not isinstance(opts, dict) or not opts.get('user') or \
+                not opts.get('pass'):
+            raise RuntimeError('usage: prime_auth() needs opts user and pass')
+
+        key = (self.host, self.port, opts['user'])
+
+        with DIGEST_LOCK:
+            if key in DIGEST_CACHE:
+                return True
+
+        self.send(endpoint='Myth/version', opts=opts)
+
+        with DIGEST_LOCK:
+            return key in DIGEST_CACHE
+
+    def warm(self, opts=None, connections=1, endpoint='Myth/version',
+             background=False):
+        """
+        Optional. Do the one time work of the 1st send() ahead of time, so
+        that the 1st real request has steady-state latency.
+
+        The session is created (opts are the ones that would be passed to
+        send(), including user/pass), the host's address is resolved and
+        cached for ADDRESS_TTL seconds and used in all following URLs,
+        then connections GETs of endpoint are made concurrently. That fills
+        the connection pool, caches any digest challenge and sets
+        server_version.
+
+        connections: The number of pooled connections to open, at most 10
+                     (the requests default pool size.) Defaults to 1.
+
+        endpoint:    Something cheap. A frontend (port 6547) doesn't have
+                     Myth/version, but any status returned is good enough
+                     here, the connection and Server: header are what
+                     count.
+
+        background:  If True, the GETs are made in a daemon thread, which
+                     is returned. Callers can go on and call send() at any
+                     time. Otherwise, server_version is returned.
+        """
+
         self.endpoint = endpoint
-        self.postdata = postdata
-        self.rest = rest
+        self.postdata = None
+        self.rest = ''
         self.opts = opts
 
         self._set_missing_opts()
 
+        self.use_address_cache = True
         url = self._form_url()
 
-        self.logger.debug('URL=%s', url)
+        self._check_fork()
 
         if self.session is None:
             self._create_session()
 
+        self.session.headers.update({'Host': '{}:{}'.format(self.host,
+                                                            self.port)})
+
+        workers = [threading.Thread(target=self._open_connection, args=(url,))
+                   for _ in range(max(1, min(connections, 10)))]
+
+        def open_connections():
+            """Make all GETs at once, so each needs its own connection."""
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+
+        if background:
+            thread = threading.Thread(target=open_connections)
+            thread.daemon = True
+            thread.start()
+            return thread
+
+        open_connections()
+
+        return self.server_version
+
+    def check(self, endpoint, postdata=None, rest='', opts=None):
+        """
+        Make the checks send() makes before anything is sent, without
+        sending anything: the endpoint, rest and postdata, wrmi and, if
+        opts['validate'] is set, the schema (which may fetch the WSDL
+        once.) The arguments are the same as for send(), and missing opts
+        are set in opts. Raises as send() would. Returns the URL.
+        """
+
+        self.endpoint = endpoint
+        self.postdata = postdata
+        self.rest = rest
+        self.opts = opts
+
+        self._set_missing_opts()
+
+        url = self._form_url()
+
+        if self.opts['validate'] and not self.opts['wsdl']:
+            schema.validate(self, self.endpoint, rest=self.rest.lstrip('?'),
+                            postdata=self.postdata, opts=self.opts)
+
         if self.postdata:
             self._validate_postdata()
 
+        return url
+
+    def prepare(self, endpoint, rest='', opts=None, postdata=None):
+        """
+        The setup part of send(), for requests made with request() by
+        callers that need their own headers or a streamed response. The
+        arguments are the same as for send(), and checked the same way,
+        see check(). opts is copied. Returns the URL.
+        """
+
+        url = self.check(endpoint, postdata=postdata, rest=rest,
+                         opts=dict(opts or {}))
+
+        self._check_fork()
+
+        if self.session is None:
+            self._create_session()
+
+        return url
+
+    def request(self, url, headers=None, stream=False, allowed=()):
+        """
+        Send the request set up by prepare() (or send()) and check the
+        response: its status, the Server: header (setting server_version)
+        and ETag: (setting etag.) For callers that need their own headers
+        or the response itself, e.g. to stream it somewhere.
+
+        INPUT:
+        ======
+
+        url:     As returned by prepare().
+
+        headers: Added to the session's, for this request only.
+
+        stream:  If True, the body hasn't been read yet when the response
+                 is returned. Close it when done.
+
+        allowed: Status codes that are returned rather than raised.
+
+        OUTPUT:
+        =======
+
+        A requests.Response. A POST is made if there's postdata. Errors are
+        raised as by send(): RuntimeError (ServicesError for an error
+        response) or RuntimeWarning for 304.
+        """
+
         exceptions = (requests.exceptions.HTTPError,
                       requests.exceptions.URLRequired,
                       requests.exceptions.Timeout,
@@ -229,70 +686,55 @@ class Send(object):
                       requests.exceptions.InvalidURL,
                       KeyboardInterrupt)
 
-        ##############################################################
-        # Actually try to get the data and handle errors.            #
-        ##############################################################
-
         try:
             if self.postdata:
                 response = self.session.post(url, data=self.postdata,
+                                             headers=headers, stream=stream,
                                              timeout=self.opts['timeout'])
             else:
-                response = self.session.get(url, timeout=self.opts['timeout'])
+                response = self.session.get(url, headers=headers,
+                                            stream=stream,
+                                            timeout=self.opts['timeout'])
         except exceptions:
             raise RuntimeError('Connection problem/Keyboard Interrupt, URL={}'
                                .format(url))
 
+        if response.status_code in allowed:
+            return response
+
         if response.status_code == 401:
             raise RuntimeError('Unauthorized (401). Need valid user/password.')
 
+        if response.status_code == 304:
+            raise RuntimeWarning('Not Modified (304)')
+
         # TODO: Should handle redirects here (mostly for remote backends.)
         if response.status_code > 299:
             self.logger.debug('%s', response.text)
-            raise RuntimeError('Unexpected status returned: {}: URL was: {}'
-                               .format(response.status_code, url))
+            code, description = xmlparse.parse_error(response.text)
+            raise ServicesError('Unexpected status returned: {}: URL was: {}{}'
+                                .format(response.status_code, url,
+                                        ': {}'.format(description)
+                                        if description else ''),
+                                status=response.status_code, code=code,
+                                description=description, url=url)
 
         self._validate_header(response.headers['Server'])
 
         self.logger.debug('Response headers: %s', response.headers)
 
-        if response.encoding is None:
-            response.encoding = 'UTF8'
+        self.etag = response.headers.get('ETag')
 
-        try:
-            ct_header, image_type = response.headers['Content-Type'].split('/')
-        except (KeyError, ValueError):
-            ct_header = None
+        return response
 
-        ##############################################################
-        # Finally, return the response in the desired format         #
-        ##############################################################
-
-        if self.opts['wsdl']:
-            return {'WSDL': response.text}
-
-        if ct_header == 'image':
-            handle, filename = tempfile.mkstemp(suffix='.' + image_type)
-            self.logger.debug('created %s, remember to delete it.', filename)
-            with fdopen(handle, 'wb') as f_obj:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f_obj.write(chunk)
-            raise RuntimeWarning('Image file = "{}"'.format(filename))
-        else:
-            try:
-                self.logger.debug('1st 60 bytes of response: %s',
-                                  response.text[:60])
-            except UnicodeEncodeError:
-                pass
-
-        if self.opts['usexml']:
-            return response.text
+    def _open_connection(self, url):
+        """Used by warm(), any failure is left for send() to report."""
 
         try:
-            return response.json()
-        except ValueError as err:
-            raise RuntimeError('Set loglevel=DEBUG to see JSON parse error: {}'
-                               .format(err))
+            response = self.session.get(url, timeout=self.opts['timeout'])
+            self._validate_header(response.headers.get('Server'))
+        except (requests.exceptions.RequestException, RuntimeError) as error:
+            self.logger.debug('warm(): %s: %s', url, error)
 
     def close_session(self):
         """
@@ -303,6 +745,17 @@ class Send(object):
 
         self.session.close()
 
+    def _check_fork(self):
+        """
+        A session made before this process was forked shares its pooled
+        sockets with the parent. Drop it (without closing the parent's
+        connections) so a new one is made.
+        """
+
+        if self.session is not None and self._pid != os.getpid():
+            self.logger.debug('New process, replacing the session')
+            self.session = None
+
     def _set_missing_opts(self):
         """
         Sets options not set by the caller to False (or 10 in the
@@ -312,7 +765,9 @@ class Send(object):
         if not isinstance(self.opts, dict):
             self.opts = {}
 
-        for option in ('noetag', 'nogzip', 'usexml', 'wrmi', 'wsdl'):
+        for option in ('decodexml', 'etag', 'fields', 'max_bytes', 'noetag',
+                       'nogzip', 'records', 'typed', 'usexml', 'validate',
+                       'wrmi', 'wsdl'):
             try:
                 self.opts[option]
             except (KeyError, TypeError):
@@ -347,7 +802,12 @@ class Send(object):
         else:
             self.rest = '?' + self.rest
 
-        return 'http://{}:{}/{}{}'.format(self.host, self.port, self.endpoint,
+        if self.use_address_cache:
+            host = resolve_host(self.host, self.port)
+        else:
+            host = self.host
+
+        return 'http://{}:{}/{}{}'.format(host, self.port, self.endpoint,
                                           self.rest)
 
     def _validate_postdata(self):
@@ -376,9 +836,14 @@ class Send(object):
         """
 
         self.session = requests.Session()
+        self._pid = os.getpid()
         self.session.headers.update({'User-Agent': 'Python Services API v{}'
                                                    .format(__version__)})
 
+        if self.use_address_cache:
+            self.session.headers.update({'Host': '{}:{}'.format(self.host,
+                                                                self.port)})
+
         if self.opts['noetag']:
             self.session.headers.update({'Cache-Control': 'no-store'})
             self.session.headers.update({'If-None-Match': ''})
@@ -398,13 +863,16 @@ class Send(object):
         # TODO: Problem with the BE not accepting postdata in the initial
         # authorized query, Send a GET first as a workaround.
         #
-        # Looks like a bug, Myth/version works for the backend.
+        # Looks like a bug, Myth/version works for the backend. Once any
+        # session has seen the challenge, it's cached and the GET isn't
+        # needed, see prime_auth().
 
         try:
             if self.opts['user'] and self.opts['pass']:
-                self.session.auth = HTTPDigestAuth(self.opts['user'],
-                                                   self.opts['pass'])
-                if self.postdata:
+                self.session.auth = _CachedDigestAuth(
+                    self.opts['user'], self.opts['pass'],
+                    (self.host, self.port, self.opts['user']))
+                if self.postdata and not self.session.auth.primed:
                     saved_endpoint = self.endpoint
                     saved_postdata = self.postdata
                     self.send(endpoint='Myth/version', opts=self.opts)
@@ -414,6 +882,34 @@ class Send(object):
             # Proceed without authentication.
             pass
 
+    def _save_image(self, response, body, image_type):
+        """
+        Write an image response to a temporary file and return its name.
+        body is what limits.read_limited() returned, or None.
+        """
+
+        handle, filename = tempfile.mkstemp(suffix='.' + image_type)
+        self.logger.debug('created %s, remember to delete it.', filename)
+
+        with fdopen(handle, 'wb') as f_obj:
+            for chunk in ((body,) if body is not None else
+                          response.iter_content(chunk_size=8192)):
+                f_obj.write(chunk)
+
+        return filename
+
+    def _object_hook(self, then=None):
+        """
+        The object_hook for json.loads(), given opts, or None. With
+        opts['fields'], it's a projection decoder, call its finish() with
+        the decoded response.
+        """
+
+        if not self.opts['fields']:
+            return then
+
+        return projection.get_projection(self.opts['fields']).decoder(then)
+
     def _validate_header(self, header):
         """
         Process the contents of the HTTP Server: header. Try to see
@@ -471,4 +967,34 @@ class Send(object):
 
         return self.session.headers[header]
 
+
+def local_send(local, host, port=6544):
+    """
+    This thread's Send() for host and port, kept in local (a
+    threading.local()), so connections are reused without sharing a
+    session between threads.
+    """
+
+    try:
+        return local.backend
+    except AttributeError:
+        local.backend = Send(host=host, port=port)
+        return local.backend
+
+
+def send_changed(backend, endpoint, etag, rest='', opts=None):
+    """
+    backend.send() with opts['etag'] set to etag. Returns None if the
+    response hasn't changed (a 304), other RuntimeWarnings are raised as
+    RuntimeErrors. Afterwards, backend.etag is the new ETag.
+    """
+
+    try:
+        return backend.send(endpoint=endpoint, rest=rest,
+                            opts=dict(opts or {}, etag=etag))
+    except RuntimeWarning as warning:
+        if not_modified(warning):
+            return None
+        raise RuntimeError('{} failed: {}'.format(endpoint, warning))
+
 # vim: set expandtab tabstop=4 shiftwidth=4 smartindent noai colorcolumn=80:
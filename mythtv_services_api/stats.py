@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+
+"""Small statistics helpers shared by the load tester and hedged reads."""
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+
+def percentile(ordered, fraction):
+    """Nearest rank percentile of a sorted list, None if it's empty."""
+
+    if not ordered:
+        return None
+
+    return ordered[min(len(ordered) - 1,
+                       max(0, int(round(fraction * len(ordered))) - 1))]
+
+# vim: set expandtab tabstop=4 shiftwidth=4 smartindent noai colorcolumn=80:
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+
+"""Report what was added, changed or removed in lists between fetches."""
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+import hashlib
+import json
+import logging
+
+from . import send as api
+from .columns import find_list
+
+LOG = logging.getLogger(__name__)
+logging.getLogger(__name__).addHandler(logging.NullHandler())
+
+
+def upcoming_key(program):
+    """A showing is identified by (ChanId, StartTime.)"""
+
+    return ((program.get('Channel') or {}).get('ChanId'),
+            program.get('StartTime'))
+
+
+def rule_key(rule):
+    """A recording rule is identified by its Id (the RecordId.)"""
+
+    return rule.get('Id')
+
+
+def digest(item, ignore=()):
+    """A 20 byte digest of an item, leaving out its keys in ignore."""
+
+    if ignore:
+        item = dict((key, value) for key, value in item.items()
+                    if key not in ignore)
+
+    return hashlib.sha1(json.dumps(item, sort_keys=True,
+                                   separators=(',', ':'), default=_plain)
+                        .encode('utf-8')).digest()
+
+
+def _plain(value):
+    """records.Record and opts['typed'] values, for json.dumps()."""
+
+    if hasattr(value, 'to_dict'):
+        return value.to_dict()
+
+    return str(value)
+
+
+class Delta(object):
+    """
+    What changed between two snapshots: the added and changed items (as
+    sent by the backend) and the keys of those removed. False if nothing
+    did.
+    """
+
+    def __init__(self, added=None, changed=None, removed=None):
+        self.added = added or []
+        self.changed = changed or []
+        self.removed = removed or []
+
+    def __bool__(self):
+        return bool(self.added or self.changed or self.removed)
+
+    __nonzero__ = __bool__
+
+    def __len__(self):
+        return len(self.added) + len(self.changed) + len(self.removed)
+
+    def __repr__(self):
+        return 'Delta(added={}, changed={}, removed={})'.format(
+            len(self.added), len(self.changed), len(self.removed))
+
+
+class DeltaSync(object):
+    """
+    Fetch a list endpoint and report only what changed since the last
+    fetch. Each item is identified by key(item) and only a digest of it is
+    kept, so memory depends on the number of items, not their size, and
+    finding the delta takes one pass over the new list.
+
+    Each fetch sends the ETag from the previous one, so an unchanged list
+    costs a 304 and an empty Delta.
+
+    EXAMPLE:
+    ========
+
+        import mythtv_services_api.send as send
+        from mythtv_services_api import sync
+
+        backend = send.Send(host='someName')
+        upcoming = sync.upcoming(backend)
+
+        upcoming.sync()      # The 1st Delta has every item as added.
+        ...
+        delta = upcoming.sync()
+        for program in delta.added + delta.changed:
+            ...
+        for chan_id, start_time in delta.removed:
+            ...
+    """
+
+    def __init__(self, backend, endpoint, key, rest='', opts=None,
+                 ignore=()):
+        """
+        INPUT:
+        ======
+
+        backend:  A send.Send() object.
+
+        endpoint: A list endpoint, and the same as for send(). opts['etag']
+        rest:     is set here.
+        opts:
+
+        key:      A function that returns the identity of an item, e.g.
+                  upcoming_key() or rule_key().
+
+        ignore:   Keys of items whose changes aren't reported.
+        """
+
+        self.backend = backend
+        self.endpoint = endpoint
+        self.key = key
+        self.rest = rest
+        self.opts = dict(opts or {})
+        self.ignore = frozenset(ignore)
+        # {key: digest} of the last snapshot.
+        self.digests = {}
+        self.etag = None
+        self.subscribers = []
+
+    def subscribe(self, callback):
+        """Call callback(delta) after each sync() that found changes."""
+
+        self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        """Stop calling callback."""
+
+        self.subscribers.remove(callback)
+
+    def sync(self):
+        """
+        Fetch the list and return the Delta since the last sync(). The
+        1st reports every item as added. RuntimeErrors from send() are
+        passed to the caller and the snapshot is left as it was.
+        """
+
+        response = api.send_changed(self.backend, self.endpoint, self.etag,
+                                    rest=self.rest, opts=self.opts)
+        if response is None:
+            return Delta()
+
+        delta = self.update(find_list(response))
+        self.etag = self.backend.etag
+
+        return delta
+
+    def update(self, items):
+        """
+        Replace the snapshot with items (from any source) and return the
+        Delta. Subscribers are called if there is one.
+        """
+
+        old = self.digests
+        new = {}
+        delta = Delta()
+
+        for item in items:
+            key = self.key(item)
+            if key in new:
+                LOG.debug('%s: duplicate key %s, the 1st is used',
+                          self.endpoint, key)
+                continue
+            new[key] = value = digest(item, self.ignore)
+            previous = old.get(key)
+            if previous is None:
+                delta.added.append(item)
+            elif previous != value:
+                delta.changed.append(item)
+
+        delta.removed = [key for key in old if key not in new]
+        self.digests = new
+
+        LOG.debug('%s: %r', self.endpoint, delta)
+
+        if delta:
+            for callback in list(self.subscribers):
+                callback(delta)
+
+        return delta
+
+    def reset(self):
+        """Forget the snapshot, the next sync() reports everything."""
+
+        self.digests = {}
+        self.etag = None
+
+    def __len__(self):
+        return len(self.digests)
+
+
+def upcoming(backend, opts=None, rest=''):
+    """A DeltaSync of Dvr/GetUpcomingList."""
+
+    return DeltaSync(backend, 'Dvr/GetUpcomingList', upcoming_key, rest=rest,
+                     opts=opts)
+
+
+def record_rules(backend, opts=None, rest=''):
+    """A DeltaSync of Dvr/GetRecordScheduleList."""
+
+    return DeltaSync(backend, 'Dvr/GetRecordScheduleList', rule_key,
+                     rest=rest, opts=opts)
+
+# vim: set expandtab tabstop=4 shiftwidth=4 smartindent noai colorcolumn=80:
@@ -272,4 +272,19 @@ def dup_method_to_string(backend=None, dup_method=0, opts=None):
         LOG.error('dup_method_to_string(): warning/failure: %s.', error)
         return None
 
+
+def to_int(value, missing=None):
+    """
+    MythTV sends numbers as strings.
+
+    Input:  A value from a response, e.g. a ChanId of '1001', or None.
+
+    Output: The value as an int, or missing if it isn't a number.
+    """
+
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return missing
+
 # vim: set expandtab tabstop=4 shiftwidth=4 smartindent noai colorcolumn=80:
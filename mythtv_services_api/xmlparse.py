@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+
+"""Incremental decoding of Services API XML responses."""
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+import io
+import logging
+import xml.etree.ElementTree as ElementTree
+
+from .projection import get_projection
+
+LOG = logging.getLogger(__name__)
+logging.getLogger(__name__).addHandler(logging.NullHandler())
+
+
+def decode(source, fields=None):
+    """
+    Decode an XML response into the same structure send() returns for
+    JSON, e.g. {'ProgramList': {'Count': '2', 'Programs': [{...}, ...]}}.
+    Values are strings, as they are in the JSON.
+
+    source may be the XML (bytes or text), a file like object or a
+    requests response (which should have been made with stream=True, so
+    the body is parsed as it arrives rather than read into memory 1st.)
+
+    Elements are decoded and then dropped from the tree as soon as they
+    end, so only the decoded result is held in memory. Which elements are
+    lists is guessed: those whose children all have the same tag and that
+    have more than one child or a name ending in s or List (Programs,
+    ChannelInfos, StringList...) An empty list is decoded as ''.
+
+    If fields (paths like 'Channel/ChanId') are set, elements are pruned
+    as they end, as with opts['fields'], see projection.py.
+    """
+
+    for value in _parse(source, items=False, fields=fields):
+        return value
+
+
+def iter_items(source, tag=None, fields=None):
+    """
+    Yield the items of the list in an XML response one at a time, each
+    decoded as in decode(), without holding the rest of the response. See
+    decode() for source.
+
+    If tag isn't set, the items are the children of the 1st element (below
+    the top one) that has any, e.g. each Program in a ProgramList or each
+    ChannelInfo in a ProgramGuide. Otherwise, the items are the elements
+    named tag, at the depth where the 1st one was found, e.g. tag='Program'
+    for the programs of every channel in a ProgramGuide. fields are the
+    same as for decode().
+    """
+
+    for value in _parse(source, tag=tag, fields=fields):
+        yield value
+
+
+def iter_list(backend, endpoint, rest='', opts=None, tag=None):
+    """
+    Request endpoint from backend (a send.Send()) in XML and yield the
+    items of the list in the response as they arrive, see iter_items().
+    rest and opts are the same as for send(), including opts['fields'].
+
+    EXAMPLE:
+    ========
+
+        import mythtv_services_api.send as send
+        from mythtv_services_api import xmlparse
+
+        backend = send.Send(host='someName')
+
+        for program in xmlparse.iter_list(backend, 'Dvr/GetRecordedList'):
+            print(program['Title'])
+    """
+
+    url = backend.prepare(endpoint, rest=rest, opts=opts)
+    response = backend.request(url, headers={'Accept': ''}, stream=True)
+
+    try:
+        for value in iter_items(response, tag=tag,
+                                fields=(opts or {}).get('fields')):
+            yield value
+    finally:
+        response.close()
+
+
+def parse_error(text):
+    """
+    Return (errorCode, errorDescription) from an error response like:
+
+        <detail><errorCode>401</errorCode>
+                <errorDescription>Invalid Action</errorDescription></detail>
+
+    or (None, None) if text isn't one.
+    """
+
+    try:
+        root = ElementTree.fromstring(text.encode('utf-8')
+                                      if not isinstance(text, bytes)
+                                      else text)
+    except (AttributeError, ElementTree.ParseError):
+        return None, None
+
+    code = description = None
+
+    for elem in root.iter():
+        if _local(elem.tag) == 'errorCode':
+            code = (elem.text or '').strip()
+        elif _local(elem.tag) == 'errorDescription':
+            description = (elem.text or '').strip()
+
+    return code, description
+
+
+def _parse(source, tag=None, items=True, fields=None):
+    """
+    Decode source as it's parsed. Yields the items (see iter_items()) if
+    items is True, otherwise just the decoded response.
+    """
+
+    prune = get_projection(fields).prune if fields else None
+
+    values = [[]]
+    elements = []
+    item_depth = None
+    parent = None
+
+    try:
+        for event, elem in ElementTree.iterparse(_file(source),
+                                                 events=('start', 'end')):
+            if event == 'start':
+                elements.append(elem)
+                values.append([])
+                if items and item_depth is None and \
+                        (_local(elem.tag) == tag if tag
+                         else len(elements) == 3):
+                    item_depth = len(elements)
+                    parent = None if tag else elements[-2]
+                continue
+
+            depth = len(elements)
+            elements.pop()
+            value = _value(elem, values.pop())
+            # The root element's value holds the list, it's kept whole.
+            if prune and depth > 1 and isinstance(value, dict):
+                value = prune(value)
+
+            if depth == item_depth and (parent is None or
+                                        elements[-1] is parent) and \
+                    (tag is None or _local(elem.tag) == tag):
+                yield value
+            else:
+                values[-1].append((_local(elem.tag), elem.get('key'), value))
+
+            if elements:
+                elements[-1].remove(elem)
+    except ElementTree.ParseError as error:
+        raise RuntimeError('Invalid XML response: {}'.format(error))
+
+    if not items and values[0]:
+        name, _, value = values[0][0]
+        yield {name: value}
+
+
+def _value(elem, children):
+    """The decoded value of an element, given its decoded children."""
+
+    if not children:
+        return elem.text or ''
+
+    if all(key is not None for _, key, _ in children):
+        # A map, e.g. Myth/GetSettingList's Settings.
+        return dict((key, value) for _, key, value in children)
+
+    name = _local(elem.tag)
+
+    if len(set(child for child, _, _ in children)) == 1 and \
+            (len(children) > 1 or name.endswith('s') or
+             name.endswith('List')):
+        return [value for _, _, value in children]
+
+    return dict((child, value) for child, _, value in children)
+
+
+def _local(tag):
+    """The tag without a namespace."""
+
+    return tag.rsplit('}', 1)[-1]
+
+
+def _file(source):
+    """Something iterparse() can read."""
+
+    if hasattr(source, 'raw'):
+        # A requests response, let urllib3 undo any gzip.
+        source.raw.decode_content = True
+        return source.raw
+
+    if hasattr(source, 'read'):
+        return source
+
+    if not isinstance(source, bytes):
+        source = source.encode('utf-8')
+
+    return io.BytesIO(source)
+
+# vim: set expandtab tabstop=4 shiftwidth=4 smartindent noai colorcolumn=80:
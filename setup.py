@@ -26,7 +26,9 @@ setup(
         'Programming Language :: Python :: 2',
         'Programming Language :: Python :: 3'
     ],
-    install_requires=['requests', 'future'],
+    install_requires=['requests', 'future',
+                      'futures; python_version < "3"'],
+    extras_require={'numpy': ['numpy']},
     url='https://www.mythtv.org/wiki/Python_API_Examples'
 )
 #requirements = ["zope.interface >= 3.6.0"],
@@ -14,11 +14,24 @@ digest protection on.
 '''
 
 # pylint: disable=protected-access,global-at-module-level,global-statement
+# pylint: disable=too-many-lines
 
+import io
+import json
 import logging
+import os
+import pickle
+import sys
+import tempfile
 import unittest
 import requests
-from mythtv_services_api import (send as api, utilities as util)
+from mythtv_services_api import (send as api, utilities as util, bulk,
+                                 columns, conflicts, download, fanout,
+                                 gateway, guidecache, hedge, imagecache,
+                                 indexes, loadtest, mirror, passthrough,
+                                 poller, procpool, projection, records,
+                                 schema, sync, xmlparse)
+from mythtv_services_api import __main__ as cli
 from mythtv_services_api._version import __version__
 
 global BACKEND
@@ -186,6 +199,727 @@ class MythTVServicesAPI(unittest.TestCase):
         self.assertEqual(BACKEND.send(endpoint=url_protection, **kwargs),
                          {'bool': 'true'})
 
+    def test_prime_auth(self):
+        '''
+        Test prime_auth() usage errors. test_digest() covers the rest.
+        '''
+
+        for opts in (None, {}, {'user': 'admin'}, {'pass': 'mythtv'}):
+            with self.assertRaisesRegex(RuntimeError,
+                                        'needs opts user and pass'):
+                BACKEND.prime_auth(opts=opts)
+
+    def test_warm(self):
+        '''
+        Test warm() and the resolved address cache
+        '''
+
+        backend = api.Send(host=TEST_HOST)
+        self.assertEqual(backend.warm(connections=2), TEST_SERVER_VERSION)
+        self.assertIn(TEST_HOST, api.ADDRESS_CACHE)
+        self.assertEqual(backend.get_headers(header='Host'),
+                         '{}:{}'.format(TEST_HOST, TEST_PORT))
+        self.assertEqual(backend.send(endpoint=TEST_ENDPOINT)['String'],
+                         TEST_DVR_VERSION)
+
+        backend = api.Send(host=TEST_HOST)
+        backend.warm(background=True).join()
+        self.assertEqual(backend.server_version, TEST_SERVER_VERSION)
+
+    def test_fan_out(self):
+        '''
+        Test fan_out() with a good host and one that can't be reached
+        '''
+
+        result = fanout.fan_out([TEST_HOST, (TEST_HOST, 1)], TEST_ENDPOINT,
+                                port=TEST_PORT, opts={'timeout': 2})
+
+        self.assertEqual(result[TEST_HOST],
+                         {'response': {'String': TEST_DVR_VERSION},
+                          'error': None})
+        self.assertIsNone(result[(TEST_HOST, 1)]['response'])
+        self.assertRegex(result[(TEST_HOST, 1)]['error'],
+                         'Connection problem')
+
+    def test_etag(self):
+        '''
+        Test opts['etag'], an unchanged response should get a 304
+        '''
+
+        BACKEND.send(endpoint=TEST_ENDPOINT)
+        self.assertIsNotNone(BACKEND.etag)
+
+        with self.assertRaisesRegex(RuntimeWarning, r'Not Modified \(304\)'):
+            BACKEND.send(endpoint=TEST_ENDPOINT, opts={'etag': BACKEND.etag})
+
+    def test_poller(self):
+        '''
+        Test diff() and the Poller
+        '''
+
+        old = {'State': {'state': 'idle', 'volume': '50'}, 'List': [1]}
+        new = {'State': {'state': 'WatchingLiveTV'}, 'List': [1, 2]}
+
+        self.assertEqual(poller.diff(old, old), [])
+        self.assertEqual(poller.diff(old, new), [
+            (('State', 'state'), 'idle', 'WatchingLiveTV'),
+            (('State', 'volume'), '50', poller.MISSING),
+            (('List', 1), poller.MISSING, 2)])
+
+        status_poller = poller.Poller(BACKEND, TEST_ENDPOINT)
+        self.assertEqual(status_poller.poll(),
+                         [((), poller.MISSING,
+                           {'String': TEST_DVR_VERSION})])
+        self.assertEqual(status_poller.poll(), [])
+        self.assertEqual(status_poller.interval, status_poller.idle_interval)
+
+        # A dead server is logged, then raised, not "no changes".
+        dead_poller = poller.Poller(api.Send(host='127.0.0.1', port=1),
+                                    TEST_ENDPOINT, opts={'timeout': 1},
+                                    idle_interval=0, max_failures=2)
+        with self.assertLogs(poller.LOG, level='WARNING'):
+            with self.assertRaisesRegex(RuntimeError, 'Connection problem'):
+                list(dead_poller.changes())
+        self.assertEqual(dead_poller.failures, 2)
+
+    def test_download(self):
+        '''
+        Test download() usage errors
+        '''
+
+        for kwargs in ({}, {'path': '/tmp/x', 'sink': sys.stdout}):
+            with self.assertRaisesRegex(RuntimeError,
+                                        'needs either path or sink'):
+                download.download(BACKEND, 'Content/GetFile', **kwargs)
+
+        with self.assertRaisesRegex(RuntimeError, 'parts > 1 needs a path'):
+            download.download(BACKEND, 'Content/GetFile', sink=sys.stdout,
+                              parts=2)
+
+    def test_image_cache(self):
+        '''
+        Test ImageCache keys, hits and misses. Any small endpoint will do,
+        the cache doesn't care about the content type.
+        '''
+
+        directory = tempfile.mkdtemp()
+
+        # Only the cache's own temporary files, from processes that are
+        # gone, are removed.
+        key = '0' * 40
+        temporaries = {'{}.{}.1.tmp'.format(key, 2 ** 30): False,
+                       '{}.{}.1.tmp'.format(key, os.getpid()): True,
+                       'other.tmp': True}
+        for name in temporaries:
+            open(os.path.join(directory, name), 'w').close()
+
+        cache = imagecache.ImageCache(BACKEND, directory)
+
+        for name, kept in temporaries.items():
+            self.assertEqual(os.path.exists(os.path.join(directory, name)),
+                             kept)
+            if kept:
+                os.remove(os.path.join(directory, name))
+
+        self.assertEqual(cache.key('Content/GetPreviewImage', 'A=1&B=2'),
+                         cache.key('Content/GetPreviewImage', 'B=2&A=1'))
+
+        path = cache.get(TEST_ENDPOINT)
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(cache.get(TEST_ENDPOINT), path)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        cache.clear()
+        self.assertEqual(cache.size, 0)
+        self.assertFalse(os.path.exists(path))
+        os.rmdir(directory)
+
+    def test_recorded_mirror(self):
+        '''
+        Test RecordedMirror, the 2nd refresh should find nothing new
+        '''
+
+        recorded = mirror.RecordedMirror(BACKEND, ':memory:')
+
+        self.assertEqual(recorded.refresh()['removed'], 0)
+        self.assertEqual(recorded.refresh(),
+                         {'added': 0, 'changed': 0, 'removed': 0})
+
+        programs = recorded.search(limit=1)
+        if programs:
+            title = programs[0]['Title']
+            self.assertIn(title, [program['Title'] for program in
+                                  recorded.search(title=title)])
+
+        recorded.close()
+
+    def test_guide_cache(self):
+        '''
+        Test GuideCache, a window inside cached tiles shouldn't need any
+        more fetches.
+        '''
+
+        import time  # pylint: disable=import-outside-toplevel
+
+        guide = guidecache.GuideCache(BACKEND)
+        now = int(time.time())
+
+        with self.assertRaisesRegex(RuntimeError, 'end must be after start'):
+            guide.get(guidecache._to_string(now), guidecache._to_string(now))
+
+        response = guide.get(guidecache._to_string(now),
+                             guidecache._to_string(now + 4 * 3600))
+        self.assertIn('Channels', response['ProgramGuide'])
+
+        tiles = len(guide.tiles)
+        guide.get(guidecache._to_string(now + 3600),
+                  guidecache._to_string(now + 2 * 3600))
+        self.assertEqual(len(guide.tiles), tiles)
+
+        guide.close()
+
+        # The least recently used tiles are dropped.
+        guide = guidecache.GuideCache(BACKEND, max_tiles=1)
+        guide.get(guidecache._to_string(now),
+                  guidecache._to_string(now + 4 * 3600))
+        self.assertEqual(len(guide.tiles), 1)
+
+        guide.close()
+
+    def test_records(self):
+        '''
+        Test opts['records'] and the record types
+        '''
+
+        response = BACKEND.send(endpoint='Dvr/GetRecordedList',
+                                rest='Count=2', opts={'records': True})
+
+        for program in response['ProgramList']['Programs']:
+            self.assertIsInstance(program, records.Program)
+            self.assertIsInstance(program.Channel, records.Channel)
+            self.assertIsInstance(program.Recording, records.Recording)
+            self.assertEqual(program.Title, program['Title'])
+            self.assertEqual(program.to_dict()['Title'], program.Title)
+
+        program = records.loads('{"Title": "T", "StartTime": "S", "X": 1}')
+        self.assertIsInstance(program, records.Program)
+        self.assertEqual(program['X'], 1)
+        self.assertIsNone(program.SubTitle)
+        self.assertNotIn('SubTitle', program)
+        self.assertEqual(program.get('SubTitle', ''), '')
+        with self.assertRaises(KeyError):
+            program['Missing']
+
+        # A recording rule has a Title, StartTime, ChanId and CallSign too.
+        rule = records.loads('{"Id": "1", "Title": "T", "StartTime": "S", '
+                             '"ChanId": "1", "CallSign": "C", '
+                             '"Type": "Single Record", "RecPriority": "0"}')
+        self.assertIsInstance(rule, dict)
+
+    def test_columns(self):
+        '''
+        Test columns() and, if NumPy is installed, to_numpy()
+        '''
+
+        response = BACKEND.send(endpoint='Dvr/GetRecordedList',
+                                rest='Count=5')
+        programs = response['ProgramList']['Programs']
+
+        self.assertIs(columns.find_list(response), programs)
+        with self.assertRaisesRegex(RuntimeError, 'No list found'):
+            columns.find_list({'String': TEST_DVR_VERSION})
+
+        result = columns.columns(response)
+        self.assertEqual(result['Title'],
+                         [program['Title'] for program in programs])
+        self.assertEqual(result['ChanId'],
+                         [int(program['Channel']['ChanId'])
+                          for program in programs])
+
+        if columns.numpy is None:
+            return
+
+        arrays = columns.to_numpy(response)
+        self.assertEqual(arrays['FileSize'].dtype, columns.numpy.int64)
+        self.assertEqual(list(arrays['Title_categories'][arrays['Title']]),
+                         result['Title'])
+
+    def test_typed(self):
+        '''
+        Test opts['typed'] and the schema cache
+        '''
+
+        response = BACKEND.send(endpoint='Dvr/GetRecordedList',
+                                rest='Count=2', opts={'typed': True})
+        self.assertIsInstance(response['ProgramList']['Count'], int)
+        for program in response['ProgramList']['Programs']:
+            self.assertIsInstance(program['Recording']['RecordedId'], int)
+            self.assertIsInstance(program['Repeat'], bool)
+
+        self.assertIs(schema.get_schema(BACKEND, 'Dvr'),
+                      schema.get_schema(BACKEND, 'Dvr'))
+
+        # A later run uses the on-disk cache, without any requests.
+        cache_dir = tempfile.mkdtemp()
+        schema.get_schema(BACKEND, 'Myth', cache_dir=cache_dir)
+        schema.HOST_SCHEMAS.clear()
+        schema.SCHEMA_CACHE.clear()
+
+        class Offline(api.Send):
+            """Can't reach anything."""
+            def request(self, *args, **kwargs):
+                raise RuntimeError('offline')
+
+        offline = Offline(host=BACKEND.host, port=BACKEND.port)
+        self.assertIn('GetHostName', schema.get_schema(
+            offline, 'Myth', cache_dir=cache_dir).operations)
+
+    def test_validate(self):
+        '''
+        Test opts['validate'] and the endpoint catalog
+        '''
+
+        opts = {'validate': True}
+
+        with self.assertRaisesRegex(RuntimeError, 'did you mean'):
+            BACKEND.send(endpoint='Dvr/GetRecordedLst', opts=opts)
+        with self.assertRaisesRegex(RuntimeError, 'Invalid parameter'):
+            BACKEND.send(endpoint='Dvr/GetRecordedList', rest='Cont=1',
+                         opts=opts)
+        with self.assertRaisesRegex(RuntimeError, 'Invalid value'):
+            BACKEND.send(endpoint='Dvr/GetRecordedList', rest='Count=x',
+                         opts=opts)
+        with self.assertRaisesRegex(RuntimeError, 'is a POST'):
+            BACKEND.send(endpoint='Dvr/DeleteRecording',
+                         rest='RecordedId=1', opts=opts)
+        with self.assertRaisesRegex(RuntimeError, 'usage: postdata'):
+            BACKEND.send(endpoint='Dvr/DeleteRecording', postdata='x',
+                         opts=opts)
+        # Before wrmi is checked.
+        with self.assertRaisesRegex(RuntimeError, 'Invalid parameter'):
+            BACKEND.send(endpoint='Dvr/DeleteRecording',
+                         postdata={'RecordedI': 1}, opts=opts)
+
+        self.assertIn('Dvr/GetRecordedList',
+                      schema.endpoints(BACKEND, 'Dvr/GetRec'))
+        self.assertEqual(schema.describe(BACKEND, 'Myth/PutSetting')['verb'],
+                         'POST')
+
+    def test_xmlparse(self):
+        '''
+        Test opts['decodexml'], xmlparse.iter_list() and ServicesError
+        '''
+
+        self.assertEqual(BACKEND.send(endpoint='Myth/GetHostName',
+                                      opts={'decodexml': True}),
+                         BACKEND.send(endpoint='Myth/GetHostName'))
+
+        response = BACKEND.send(endpoint='Dvr/GetRecordedList',
+                                rest='Count=3')
+        self.assertEqual([program['Title'] for program in xmlparse.iter_list(
+            BACKEND, 'Dvr/GetRecordedList', rest='Count=3')],
+                         [program['Title'] for program
+                          in response['ProgramList']['Programs']])
+
+        with self.assertRaises(api.ServicesError) as context:
+            BACKEND.send(endpoint='Myth/InvalidEndpoint')
+        self.assertEqual(context.exception.status, 404)
+        self.assertTrue(context.exception.description)
+
+    def test_passthrough(self):
+        '''
+        Test passthrough() returns the same body send() decodes
+        '''
+
+        response = passthrough.passthrough(BACKEND, 'Myth/GetHostName')
+        self.assertEqual(response['status'], 200)
+        self.assertIn('application/json', response['content_type'])
+        self.assertEqual(json.loads(response['body'].decode('utf-8')),
+                         BACKEND.send(endpoint='Myth/GetHostName'))
+
+        sink = tempfile.TemporaryFile()
+        response = passthrough.passthrough(BACKEND, 'Myth/GetHostName',
+                                           sink=sink, compressed=True)
+        self.assertIsNone(response['body'])
+        self.assertEqual(sink.tell(), response['bytes'])
+        sink.close()
+
+    def test_gateway(self):
+        '''
+        Test a client using the Gateway gets what the backend sends
+        '''
+
+        server = gateway.Gateway(BACKEND, max_age=60)
+        server.start(host='127.0.0.1', port=16544)
+
+        try:
+            client = api.Send(host='127.0.0.1', port=16544)
+            for _ in range(2):
+                self.assertEqual(client.send(endpoint='Myth/GetHostName'),
+                                 BACKEND.send(endpoint='Myth/GetHostName'))
+            self.assertEqual(server.stats['misses'], 1)
+            self.assertEqual(server.stats['hits'], 1)
+            self.assertEqual(client.get_server_version,
+                             BACKEND.get_server_version)
+            # Content/ is streamed, not cached.
+            sink = io.BytesIO()
+            passthrough.passthrough(client, 'Content/GetPreviewImage',
+                                    rest='RecordedId=1', sink=sink)
+            self.assertEqual(sink.getvalue(), passthrough.passthrough(
+                BACKEND, 'Content/GetPreviewImage',
+                rest='RecordedId=1')['body'])
+            self.assertEqual(server.stats['streamed'], 1)
+            self.assertEqual(len(server.cache), 1)
+            # Writes aren't passed through unless allowed.
+            with self.assertRaisesRegex(RuntimeError, '403'):
+                client.send(endpoint='Myth/PutSetting',
+                            postdata={'Key': 'x', 'Value': 'y'},
+                            opts={'wrmi': True})
+        finally:
+            server.stop()
+
+    def test_conflicts(self):
+        '''
+        Test the IntervalTree and Schedule
+        '''
+
+        tree = conflicts.IntervalTree([(0, 10, 'a'), (5, 15, 'b'),
+                                       (20, 30, 'c'), (3, 3, 'empty')])
+        self.assertEqual(len(tree), 3)
+        self.assertEqual([interval[2] for interval in tree.overlap(9, 21)],
+                         ['a', 'b', 'c'])
+        self.assertEqual(tree.overlap(15, 20), [])
+
+        # Pending showings hold their input, and the backend's conflicts
+        # are cross-checked.
+        def showing(chan_id, start, end, status, input_id=None):
+            """A Dvr/ list entry."""
+            return {'Title': chan_id, 'StartTime': start, 'EndTime': end,
+                    'Channel': {'ChanId': chan_id, 'SourceId': '1'},
+                    'Recording': {'Status': status, 'EncoderId': input_id}}
+
+        class Canned(object):
+            """Two inputs, both busy from 18:00 to 19:00."""
+            responses = {
+                'Dvr/GetEncoderList': {'EncoderList': {'Encoders': [
+                    {'Id': '1', 'Inputs': [{'Id': '1', 'SourceId': '1'},
+                                           {'Id': '2', 'SourceId': '1'}]}]}},
+                'Dvr/GetUpcomingList': {'ProgramList': {'Programs': [
+                    showing('1', '2019-01-01T18:00:00Z',
+                            '2019-01-01T19:00:00Z', '-1', '1'),
+                    showing('2', '2019-01-01T18:00:00Z',
+                            '2019-01-01T19:00:00Z', '-15', '2')]}},
+                'Dvr/GetConflictList': {'ProgramList': {'Programs': [
+                    showing('3', '2019-01-01T18:30:00Z',
+                            '2019-01-01T19:00:00Z', '7'),
+                    showing('3', '2019-01-01T20:00:00Z',
+                            '2019-01-01T21:00:00Z', '7')]}}}
+
+            def send(self, endpoint, opts=None):
+                """The canned response."""
+                return self.responses[endpoint]
+
+        schedule = conflicts.Schedule(Canned())
+        self.assertEqual(len(schedule.busy(2, '2019-01-01T18:30:00Z',
+                                           '2019-01-01T18:40:00Z')), 1)
+        self.assertEqual(schedule.unexplained,
+                         schedule.conflicting[1:])
+
+        schedule = conflicts.Schedule(BACKEND)
+        self.assertTrue(schedule.inputs)
+        if schedule.upcoming:
+            # A scheduled program doesn't compete with itself.
+            program = schedule.upcoming[0]
+            self.assertIsInstance(schedule.conflicts_with(program), list)
+            self.assertIsInstance(schedule.free_windows(
+                program['StartTime'], program['EndTime']), list)
+
+    def test_indexes(self):
+        '''
+        Test ChannelIndex and ProgramIndex lookups
+        '''
+
+        response = BACKEND.send(endpoint='Channel/GetChannelInfoList')
+        channels = indexes.ChannelIndex(response)
+        channel = response['ChannelInfoList']['ChannelInfos'][0]
+
+        self.assertIs(channels.get(channel['ChanId']), channel)
+        self.assertIn(channel, channels.by_callsign(channel['CallSign']))
+        self.assertIn(channel, channels.callsign_prefix(
+            channel['CallSign'][:1]))
+        self.assertEqual(channels.update(response), 0)
+
+        response = BACKEND.send(endpoint='Dvr/GetUpcomingList')
+        programs = indexes.ProgramIndex(response)
+        for program in response['ProgramList']['Programs']:
+            self.assertIs(programs.get(program['Channel']['ChanId'],
+                                       program['StartTime']), program)
+            self.assertIn(program, programs.starting_with(
+                program['StartTime'][:13]))
+
+    def test_procpool(self):
+        '''
+        Test pickling a Send, the fork check and the ProcessPool
+        '''
+
+        backend = api.Send(host=TEST_HOST)
+        backend.send(endpoint='Myth/GetHostName')
+        copy = pickle.loads(pickle.dumps(backend))
+        self.assertIsNone(copy.session)
+        self.assertEqual(copy.send(endpoint='Myth/GetHostName'),
+                         backend.send(endpoint='Myth/GetHostName'))
+
+        # As if forked.
+        session = backend.session
+        backend._pid = -1
+        backend.send(endpoint='Myth/GetHostName')
+        self.assertIsNot(backend.session, session)
+
+        with procpool.ProcessPool(backend, processes=2) as pool:
+            results = pool.send_many(['Myth/GetHostName', 'Myth/Invalid'])
+        self.assertEqual(results[0][1],
+                         backend.send(endpoint='Myth/GetHostName'))
+        self.assertIsNone(results[1][1])
+        self.assertIn('404', results[1][2])
+
+    def test_max_bytes(self):
+        '''
+        Test opts['max_bytes']
+        '''
+
+        with self.assertRaisesRegex(api.ResponseTooLarge, 'use paging'):
+            BACKEND.send(endpoint='Dvr/GetRecordedList',
+                         opts={'max_bytes': 100})
+
+        for opts in ({'max_bytes': 10 ** 8},
+                     {'max_bytes': 10 ** 8, 'nogzip': True}):
+            self.assertEqual(BACKEND.send(endpoint='Myth/GetHostName',
+                                          opts=opts),
+                             BACKEND.send(endpoint='Myth/GetHostName'))
+
+        # Images are written from the checked body.
+        program = BACKEND.send(endpoint='Dvr/GetRecordedList',
+                               rest='Count=1')['ProgramList']['Programs'][0]
+        recorded_id = program['Recording']['RecordedId']
+        sizes = []
+        for opts in ({}, {'max_bytes': 10 ** 8}):
+            with self.assertRaisesRegex(RuntimeWarning, 'Image file') as what:
+                BACKEND.send(endpoint='Content/GetPreviewImage',
+                             rest='RecordedId={}'.format(recorded_id),
+                             opts=opts)
+            filename = str(what.exception).split('"')[1]
+            sizes.append(os.path.getsize(filename))
+            os.remove(filename)
+        self.assertGreater(sizes[0], 0)
+        self.assertEqual(sizes[0], sizes[1])
+
+    def test_loadtest(self):
+        '''
+        Test the LoadTest against the stand-in and the backend
+        '''
+
+        mix = loadtest._parse_mix(
+            ['Myth/GetHostName', 'Dvr/GetRecordedList?Count=20:4',
+             'Guide/GetProgramGuide?StartTime=2019-01-01T00:00:00Z:2',
+             'Guide/GetProgramGuide?StartTime=2019-01-01T00:00:00Z'])
+        self.assertEqual(mix, [('Myth/GetHostName', '', 1),
+                               ('Dvr/GetRecordedList', 'Count=20', 4),
+                               ('Guide/GetProgramGuide',
+                                'StartTime=2019-01-01T00:00:00Z', 2),
+                               ('Guide/GetProgramGuide',
+                                'StartTime=2019-01-01T00:00:00Z', 1)])
+
+        report = loadtest.self_test(duration=1, rps=20)
+        self.assertEqual(report['errors'], 0)
+        self.assertGreater(report['requests'], 10)
+        self.assertLessEqual(report['latency']['p50'],
+                             report['latency']['p99'])
+
+        report = loadtest.LoadTest(
+            TEST_HOST, mix=(('Myth/GetHostName', '', 1),
+                            ('Myth/Invalid', '', 1)),
+            concurrency=2, duration=1, interval=0.5).run()
+        self.assertEqual(len(report['intervals']), 2)
+        self.assertEqual(report['by_endpoint']['Myth/GetHostName']['errors'],
+                         0)
+        self.assertEqual(report['by_endpoint']['Myth/Invalid']['error_rate'],
+                         1.0)
+
+    def test_cli(self):
+        '''
+        Test the command line Client, paging, fields and the cache
+        '''
+
+        output = io.StringIO()
+        errors = io.StringIO()
+        client = cli.Client(TEST_HOST, concurrency=2, ordered=True,
+                            output=output, errors=errors)
+        self.assertEqual(client.run(['Myth/GetHostName', 'Myth/Invalid']), 1)
+        self.assertEqual(json.loads(output.getvalue()),
+                         {'endpoint': 'Myth/GetHostName', 'rest': '',
+                          'response': BACKEND.send(
+                              endpoint='Myth/GetHostName')})
+        self.assertIn('404', json.loads(errors.getvalue())['error'])
+
+        cache_dir = tempfile.mkdtemp()
+        output = io.StringIO()
+        client = cli.Client(TEST_HOST, page=2, output=output,
+                            fields=['Title', 'Channel/ChanId'],
+                            cache=cli.ResponseCache(cache_dir))
+        self.assertEqual(client.run(['Dvr/GetRecordedList']), 0)
+        lines = [json.loads(line) for line in output.getvalue().splitlines()]
+        total = int(BACKEND.send(endpoint='Dvr/GetRecordedList',
+                                 rest='Count=1')
+                    ['ProgramList']['TotalAvailable'])
+        self.assertEqual(len(lines), total)
+        for line in lines:
+            self.assertLessEqual(set(line), set(('Title', 'Channel')))
+
+        # Typed datetimes are written (and cached) as the backend sends
+        # them.
+        for _ in range(2):
+            output = io.StringIO()
+            client = cli.Client(TEST_HOST, opts={'typed': True}, items=True,
+                                output=output,
+                                cache=cli.ResponseCache(cache_dir))
+            self.assertEqual(client.run(['Dvr/GetRecordedList?Count=2']), 0)
+            for line in output.getvalue().splitlines():
+                self.assertRegex(json.loads(line)['StartTime'],
+                                 r'^\d{4}-\d\d-\d\dT\d\d:\d\d:\d\dZ$')
+
+        # A 304 keeps the cached ETag, not one the Send() kept from another
+        # request.
+        class Pooled(object):
+            """A pooled Send(), sent is the ETags it was asked with."""
+            host, port, etag = TEST_HOST, 6544, None
+            sent = []
+
+            def send(self, **kwargs):
+                """The response, or a 304 if there's an ETag."""
+                if 'etag' not in kwargs['opts']:
+                    return {'x': 1}
+                self.sent.append(kwargs['opts']['etag'])
+                raise RuntimeWarning('Not Modified (304)')
+
+        pooled = Pooled()
+        cache = cli.ResponseCache(tempfile.mkdtemp(), max_age=0)
+        pooled.etag = '"a"'
+        cache.send(pooled, 'Myth/GetHostName', '', {})
+        pooled.etag = '"b"'
+        for _ in range(2):
+            self.assertEqual(cache.send(pooled, 'Myth/GetHostName', '', {}),
+                             {'x': 1})
+        self.assertEqual(pooled.sent, ['"a"', '"a"'])
+
+        self.assertEqual(cli.project({'a': {'b': 1, 'c': 2}, 'd': 3},
+                                     ['a/b', 'e', 'd/f']), {'a': {'b': 1}})
+
+    def test_fields(self):
+        '''
+        Test opts['fields'] with JSON and XML
+        '''
+
+        fields = ('Title', 'StartTime', 'FileSize', 'Channel/ChanId')
+        full = BACKEND.send(endpoint='Dvr/GetRecordedList', rest='Count=5')
+
+        for opts in ({'fields': fields},
+                     {'fields': fields, 'decodexml': True}):
+            response = BACKEND.send(endpoint='Dvr/GetRecordedList',
+                                    rest='Count=5', opts=opts)
+            self.assertEqual(response['ProgramList']['TotalAvailable'],
+                             full['ProgramList']['TotalAvailable'])
+            for program, expected in zip(response['ProgramList']['Programs'],
+                                         full['ProgramList']['Programs']):
+                self.assertEqual(set(program),
+                                 set(('Title', 'StartTime', 'FileSize',
+                                      'Channel')))
+                self.assertEqual(program['Title'], expected['Title'])
+                self.assertEqual(program['Channel'],
+                                 {'ChanId': expected['Channel']['ChanId']})
+
+        self.assertEqual(BACKEND.send(endpoint='Myth/GetHostName',
+                                      opts={'fields': fields}),
+                         BACKEND.send(endpoint='Myth/GetHostName'))
+
+        # Empty lists keep their envelope, a Channel's own empty Programs
+        # don't keep it whole.
+        decoder = projection.Projection(fields).decoder()
+        empty = {'ProgramList': {'Count': '0', 'TotalAvailable': '0',
+                                 'Programs': []}}
+        self.assertEqual(decoder.finish(json.loads(json.dumps(empty),
+                                                   object_hook=decoder)),
+                         empty)
+        empty['ProgramList']['Programs'] = ''
+        self.assertEqual(xmlparse.decode(
+            '<ProgramList><Count>0</Count><TotalAvailable>0</TotalAvailable>'
+            '<Programs/></ProgramList>', fields=fields), empty)
+
+        decoder = projection.Projection(fields).decoder()
+        program = {'Title': 'T', 'Channel': {'ChanId': '1', 'Programs': [],
+                                             'ChanFilters': ''}}
+        pruned = {'ProgramList': {'Count': '1', 'Programs': [
+            {'Title': 'T', 'Channel': {'ChanId': '1'}}]}}
+        text = json.dumps({'ProgramList': {'Count': '1',
+                                           'Programs': [program]}})
+        self.assertEqual(decoder.finish(json.loads(text,
+                                                   object_hook=decoder)),
+                         pruned)
+        self.assertEqual(xmlparse.decode(
+            '<ProgramList><Count>1</Count><Programs><Program><Title>T</Title>'
+            '<Channel><ChanId>1</ChanId><Programs/><ChanFilters/></Channel>'
+            '</Program></Programs></ProgramList>', fields=fields), pruned)
+
+        with self.assertRaisesRegex(RuntimeError, 'fields must name'):
+            projection.Projection(['/'])
+
+    def test_hedge(self):
+        '''
+        Test hedging from a slow stand-in to the backend, and errors
+        '''
+
+        slow = loadtest.StandIn(delay=0.5).start()
+
+        try:
+            backends = hedge.Hedged(('127.0.0.1', slow.port), [TEST_HOST],
+                                    delay=0.05)
+            self.assertEqual(backends.send(endpoint='Myth/GetHostName'),
+                             BACKEND.send(endpoint='Myth/GetHostName'))
+            self.assertEqual(backends.send(endpoint='Myth/version'),
+                             {'String': '31'})
+            metrics = backends.metrics()
+            self.assertEqual((metrics['requests'], metrics['hedged'],
+                              metrics['alternate_wins']), (2, 1, 1))
+            self.assertEqual(metrics['hedge_rate'], 0.5)
+        finally:
+            slow.stop()
+
+        backends = hedge.Hedged(TEST_HOST, [TEST_HOST])
+        with self.assertRaisesRegex(RuntimeError, '404'):
+            backends.send(endpoint='Guide/Invalid')
+        self.assertEqual(backends.metrics()['errors'], 1)
+
+    def test_sync(self):
+        '''
+        Test DeltaSync of the upcoming list and recording rules
+        '''
+
+        for syncer in (sync.upcoming(BACKEND), sync.record_rules(BACKEND)):
+            first = syncer.sync()
+            self.assertEqual(len(first.added), len(syncer))
+            self.assertFalse(syncer.sync())
+
+        syncer = sync.DeltaSync(BACKEND, 'Dvr/GetUpcomingList',
+                                sync.upcoming_key)
+        program = {'Channel': {'ChanId': '1071'}, 'Title': 'A',
+                   'StartTime': '2019-01-01T00:00:00Z'}
+        other = dict(program, StartTime='2019-01-02T00:00:00Z')
+        syncer.update([program, other])
+        delta = syncer.update([dict(program, Title='B')])
+        self.assertEqual(delta.changed, [dict(program, Title='B')])
+        self.assertEqual(delta.removed,
+                         [('1071', '2019-01-02T00:00:00Z')])
+        self.assertEqual(delta.added, [])
+
     def test_headers_using_default_opts(self):
         '''
         Test headers with all options False
@@ -463,6 +1197,29 @@ class MythTVServicesAPI(unittest.TestCase):
             self.assertEqual(util.dup_method_to_string(
                 backend=BACKEND, dup_method=method), response)
 
+    def test_bulk_write(self):
+        '''
+        Test BulkWrite validation and dry run. Nothing is written.
+        '''
+
+        bulk_write = bulk.BulkWrite(BACKEND, max_workers=2)
+        bulk_write.add(endpoint='Myth/PutSetting',
+                       postdata={'Key': 'FakeSetting', 'HostName': TEST_HOST})
+        bulk_write.add(endpoint='Myth/PutSetting', postdata='Not a dict')
+
+        self.assertEqual(bulk_write.validate(),
+                         [(1, 'usage: postdata must be passed as a dict')])
+        self.assertIn('invalid', bulk_write.dry_run())
+
+        with self.assertRaisesRegex(RuntimeWarning, 'wrmi=False'):
+            bulk_write.apply()
+
+        with self.assertRaisesRegex(RuntimeError, '1 invalid item'):
+            bulk_write.apply(opts={'wrmi': True})
+
+        self.assertEqual(bulk_write.summary, {'pending': 1, 'invalid': 1,
+                                              'succeeded': 0, 'failed': 0})
+
 
 if __name__ == '__main__':
 